@@ -1,363 +1,13 @@
-import os, json, csv, sys, subprocess, platform, glob, shutil, time, re
-from datetime import datetime, timedelta, date
+import os, sys, copy, queue
+from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import serial
 import serial.tools.list_ports
 
-# ---------- New centralized base directory ----------
-# This is the single source of truth for the application's root folder.
-APP_BASE_DIR = "C:/Users/asmlzr/Documents/LaserSerials"
-
-
-# ---------- Windows helpers (ctypes) ----------
-IS_WINDOWS = platform.system() == "Windows"
-if IS_WINDOWS:
-    import ctypes
-    from ctypes import wintypes
-    user32 = ctypes.WinDLL("user32", use_last_error=True)
-    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
-    EnumWindows = user32.EnumWindows
-    EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
-    GetWindowTextW = user32.GetWindowTextW
-    GetWindowTextLengthW = user32.GetWindowTextLengthW
-    IsWindowVisible = user32.IsWindowVisible
-    GetClassNameW = user32.GetClassNameW
-    SetForegroundWindow = user32.SetForegroundWindow
-    BringWindowToTop = user32.BringWindowToTop
-    ShowWindow = user32.ShowWindow
-    MoveWindow = user32.MoveWindow
-    GetSystemMetrics = user32.GetSystemMetrics
-    GetWindowRect = user32.GetWindowRect
-    GetWindowThreadProcessId = user32.GetWindowThreadProcessId
-    AttachThreadInput = user32.AttachThreadInput
-    SetFocus = user32.SetFocus
-    keybd_event = user32.keybd_event
-    # --- ADDED FOR CLOSING WINDOW ---
-    PostMessageW = user32.PostMessageW
-    WM_CLOSE = 0x0010
-    # --- END ---
-    SW_RESTORE = 9
-    SW_SHOW = 5
-    SM_CXSCREEN = 0
-    SM_CYSCREEN = 1
-    VK = {
-        "ALT": 0x12, "MENU": 0x12, "CTRL": 0x11, "CONTROL": 0x11, "SHIFT": 0x10, "WIN": 0x5B,
-        "ENTER": 0x0D, "RETURN": 0x0D, "SPACE": 0x20, "TAB": 0x09, "ESC": 0x1B, "ESCAPE": 0x1B,
-        "F1": 0x70, "F2": 0x71, "F3": 0x72, "F4": 0x73, "F5": 0x74, "F6": 0x75, "F7": 0x76,
-        "F8": 0x77, "F9": 0x78, "F10": 0x79, "F11": 0x7A, "F12": 0x7B
-    }
-    for i, ch in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ"): VK[ch] = 0x41 + i
-    for i, ch in enumerate("0123456789"): VK[ch] = 0x30 + i
-
-def _parse_hotkey(spec: str):
-    if not IS_WINDOWS: return []
-    seq = []
-    try:
-        parts = [p.strip().upper() for p in spec.split("+") if p.strip()]
-        for p in parts:
-            if p in VK: seq.append(VK[p])
-            elif len(p) == 1 and p.isalnum(): seq.append(VK[p.upper()])
-        mods = [VK["CTRL"], VK["SHIFT"], VK["ALT"], VK["WIN"]]
-        seq = [k for k in mods if k in seq] + [k for k in seq if k not in mods]
-    except Exception:
-        seq = [VK["ALT"], VK["S"]]
-    return seq
-
-def _send_hotkey_to_foreground(vkeys):
-    if not IS_WINDOWS or not vkeys: return
-    pressed = []
-    for vk in vkeys:
-        keybd_event(vk, 0, 0, 0)
-        pressed.append(vk)
-        time.sleep(0.01)
-    for vk in reversed(pressed):
-        keybd_event(vk, 0, 2, 0)
-        time.sleep(0.01)
-
-def _enum_windows():
-    wins = []
-    if not IS_WINDOWS: return wins
-    def callback(hwnd, lParam):
-        if not IsWindowVisible(hwnd): return True
-        length = GetWindowTextLengthW(hwnd)
-        title = ctypes.create_unicode_buffer(length + 1)
-        GetWindowTextW(hwnd, title, length + 1)
-        cls = ctypes.create_unicode_buffer(256)
-        GetClassNameW(hwnd, cls, 256)
-        wins.append((hwnd, title.value, cls.value))
-        return True
-    EnumWindows(EnumWindowsProc(callback), 0)
-    return wins
-
-def _find_lightburn_window():
-    if not IS_WINDOWS: return None
-    for hwnd, title, cls in _enum_windows():
-        t = (title or "").lower()
-        if "lightburn" in t: return hwnd
-    return None
-
-def _find_notepad_window():
-    if not IS_WINDOWS: return None
-    for hwnd, title, cls in _enum_windows():
-        t = (title or "").lower()
-        if "notepad" in t: return hwnd
-    return None
-
-def _move_window_bottom_right(hwnd, width, height, margin=10):
-    if not IS_WINDOWS or not hwnd: return
-    sw = GetSystemMetrics(SM_CXSCREEN)
-    sh = GetSystemMetrics(SM_CYSCREEN)
-    x = max(0, sw - width - margin)
-    y = max(0, sh - height - margin)
-    try:
-        ShowWindow(hwnd, SW_RESTORE)
-        MoveWindow(hwnd, x, y, width, height, True)
-    except Exception:
-        pass
-
-def _focus_window(hwnd):
-    if not IS_WINDOWS or not hwnd: return
-    try:
-        ShowWindow(hwnd, SW_RESTORE)
-        BringWindowToTop(hwnd)
-        SetForegroundWindow(hwnd)
-        SetFocus(hwnd)
-    except Exception:
-        pass
-
-def _force_foreground(hwnd):
-    if not IS_WINDOWS or not hwnd:
-        return
-    try:
-        ShowWindow(hwnd, SW_RESTORE)
-        BringWindowToTop(hwnd)
-        SetForegroundWindow(hwnd)
-        SetFocus(hwnd)
-        time.sleep(0.05)
-        cur_tid = kernel32.GetCurrentThreadId()
-        pid = wintypes.DWORD()
-        target_tid = user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
-        if target_tid and target_tid != cur_tid:
-            AttachThreadInput(cur_tid, target_tid, True)
-            try:
-                BringWindowToTop(hwnd)
-                SetForegroundWindow(hwnd)
-                SetFocus(hwnd)
-            finally:
-                AttachThreadInput(cur_tid, target_tid, False)
-    except Exception:
-        pass
-
-# ----------------- Default Config -----------------
-def today_code(): return datetime.now().strftime("%y%m%d")
-def serial5(n): return f"{n:05d}"
-
-DEFAULT_CONFIG = {
-    "ROOT": APP_BASE_DIR,
-    "JOBS": {
-        "Job 8": {
-            "display_name": "Idler 1",
-            "part_number": "PN123",
-            "revision": 1,
-            "version": "A",
-            "cavity": 1,
-            "machine": 1,
-            "default_batch": 28,
-            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobA.lbrn2"),
-            "focus_height": 0.0,
-            "select_pattern": "100",
-            "job_delay_sec": 5,
-            "air_before_sec": 5,
-            "air_after_sec": 5
-        },
-        "Job 9": {
-            "display_name": "Idler 2",
-            "part_number": "PN456",
-            "revision": 2,
-            "version": "B",
-            "cavity": 0,
-            "machine": 2,
-            "default_batch": 9,
-            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobB.lbrn2"),
-            "focus_height": 0.0,
-            "select_pattern": "010",
-            "job_delay_sec": 5,
-            "air_before_sec": 5,
-            "air_after_sec": 5
-        },
-        "Job 10": {
-            "display_name": "Idler 3",
-            "part_number": "PN789",
-            "revision": 1,
-            "version": "C",
-            "cavity": 2,
-            "machine": 1,
-            "default_batch": 28,
-            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobC.lbrn2"),
-            "focus_height": 0.0,
-            "select_pattern": "110",
-            "job_delay_sec": 5,
-            "air_before_sec": 5,
-            "air_after_sec": 5
-        },
-        "Job 11": {
-            "display_name": "Job 11",
-            "part_number": "PN000",
-            "revision": 0,
-            "version": "A",
-            "cavity": 0,
-            "machine": 1,
-            "default_batch": 28,
-            "lightburn_file": "",
-            "focus_height": 0.0,
-            "select_pattern": "111",
-            "job_delay_sec": 5,
-            "air_before_sec": 5,
-            "air_after_sec": 5
-        },
-        "Job 12": {
-            "display_name": "Job 12",
-            "part_number": "PN000",
-            "revision": 0,
-            "version": "A",
-            "cavity": 0,
-            "machine": 1,
-            "default_batch": 28,
-            "lightburn_file": "",
-            "focus_height": 0.0,
-            "select_pattern": "011",
-            "job_delay_sec": 5,
-            "air_before_sec": 5,
-            "air_after_sec": 5
-        }
-    },
-    "OPEN_LB_FILE_ON_START": True,
-    "LIGHTBURN": {
-        "exe_path": "",
-        "start_delay_sec": 2,
-        "post_open_delay_sec": 3,
-        "enable_start_hotkey": True,
-        "test_hotkey_with_notepad": False,
-        "close_on_complete": False # <-- NEW SETTING
-    },
-    "SERIAL": {
-        "enabled": True,
-        "port": "COM3",
-        "baud": 115200,
-        "done_token": "DONE",
-        "poll_ms": 10,
-        "auto_connect": True
-    },
-    "ESP32_PINS": {
-        "board": "esp32-c6-evb",
-        "relays": [10, 11, 22, 23, 9],
-        "opto_inputs": [1, 2, 3, 15],
-    },
-    "RELAYS": {
-        "names": ["Auto Focus", "Air", "Start", "Door Lock", "Stack Light"],
-        "modes": ["pulse", "pulse", "pulse", "pulse", "switch"],
-        "pulse_ms": [250, 250, 250, 250, 0],
-        "pins": [10, 11, 22, 23, 9],
-        "disabled": [False, False, False, False, False]
-    },
-    "INPUTS": {
-        "names": ["Job Sensor 1", "Job Sensor 2", "Job Sensor 3", "Door Sensor"],
-        "pins": [1, 2, 3, 17]
-    },
-    "SIMULATE": {
-        "enabled": False,
-        "batch_done_on_done": True
-    },
-    "UI": {
-        "up_next_tail": 28,
-        "show_autofocus_btn": True,
-        "job_button_colors": {
-            "Job 8": "#2ecc71",
-            "Job 9": "#3498db",
-            "Job 10": "#e67e22",
-            "Job 11": "#9b59b6",
-            "Job 12": "#7f8c8d"
-        }
-    },
-    "LOGGING": {
-        "daily_max_rows": 20000,
-        "retain_mode": "off",
-        "retain_days": 7,
-        "write_planned": True
-    },
-    "HISTORY": {
-        "enabled": True
-    },
-    "FILE_PATHS": {
-        "next_batch_path": os.path.join(APP_BASE_DIR, "LOGS", "NextBatch.csv"),
-        "completed_today_path": os.path.join(APP_BASE_DIR, "LOGS", "Completed_Today.csv"),
-        "entire_history_path": os.path.join(APP_BASE_DIR, "LOGS", "All_Jobs_History.csv")
-    },
-    "AUTOFOCUS": {
-        "enabled": True
-    },
-    "LAST_DATE_CODE": today_code()
-}
-
-def load_config_file(path):
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                loaded_config = json.load(f)
-            return deep_merge(DEFAULT_CONFIG, loaded_config)
-        except Exception:
-            return dict(DEFAULT_CONFIG)
-    else:
-        return dict(DEFAULT_CONFIG)
-
-def deep_merge(a, b):
-    out = dict(a)
-    for k, v in b.items():
-        if k in out and isinstance(out[k], dict) and isinstance(v, dict):
-            out[k] = deep_merge(out[k], v)
-        else:
-            out[k] = v
-    return out
-
-def build_fullcode(job_cfg, date_code, serial_5_digit_str):
-    """Builds the full serial number string based on the new rules."""
-    pn = job_cfg.get("part_number")
-    rev = job_cfg.get("revision")
-    ver = job_cfg.get("version")
-    cav = job_cfg.get("cavity")
-    mach = job_cfg.get("machine")
-
-    parts = []
-
-    # Part Number (e.g., "220327-01")
-    if pn:
-        parts.append(str(pn))
-
-    # Revision (R)
-    if rev is not None:  # Check for existence, allowing '0'
-        parts.append(str(rev))
-
-    # Version (V)
-    if ver:
-        parts.append(str(ver))
-
-    # Cavity (C) - No "C" prefix
-    if cav is not None:  # Check for existence, allowing '0'
-        parts.append(str(cav))
-
-    # Machine (M)
-    if mach is not None: # Check for existence, allowing '0'
-        parts.append(str(mach))
+from station_engine import (APP_BASE_DIR, IS_WINDOWS, CompiledConfig, StationEngine,
+                            build_job_select_table, config_diff)
 
-    # Date Code (YYMMDD)
-    parts.append(str(date_code))
-
-    # Serial Number (XXXXX)
-    parts.append(str(serial_5_digit_str))
-
-    # Join all collected parts with a hyphen
-    return "-".join(parts)
 
 class App(tk.Tk):
     def __init__(self):
@@ -373,32 +23,29 @@ class App(tk.Tk):
             pass
         self.bind("<Unmap>", self._on_unmap_restore)
 
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        # All station logic runs in the engine; this window only shows its state and sends commands.
         self.config_path = self.get_config_path()
-        self.CONFIG = load_config_file(self.config_path)
-        self.DIRS, self.LB_BATCH, self.WORKING_BATCH, self.WORKING_COMPLETED_TODAY = self.derive_paths()
-        self.ensure_dirs()
-        self.filter_completed_today_old_dates()
-        self.enforce_retention_on_startup()
+        self.engine = StationEngine(self.config_path)
+        self.CONFIG = copy.deepcopy(self.engine.CONFIG)
+        self._apply_config()
+        self._applied_config = copy.deepcopy(self.CONFIG)
 
-        self.relay_state = [0] * len(self.CONFIG["RELAYS"]["names"])
-        self.input_state = [1] * len(self.CONFIG["INPUTS"]["names"])
-        self.input_override = [False] * len(self.CONFIG["INPUTS"]["names"])
+        self.relay_state = [0] * len(self.CC.relay_names)
+        self.input_state = [1] * len(self.CC.input_names)
 
         self.door_closed = False
         self.is_engraving = False
-        self.is_air_on = False
-        self.is_startup_complete = False
-        self.af_enabled = self.CONFIG.get("AUTOFOCUS", {}).get("enabled", True)
+        self.connected = False
+        self.adaptive = {}
+        self.af_enabled = self.CC.af_enabled
         self._io_status_labels = {}
         self._io_update_after_id = None
 
         self.ports_dict = {}
         self.port_var = tk.StringVar(value=self.CONFIG["SERIAL"]["port"])
 
-        self.last_job_pattern = ""
-        self.last_stable_job_time = 0
-        self.job_cooldown_ms = 500
-
         self.banner = tk.Label(self, text="Idle", font=("Segoe UI", 14, "bold"), fg="white", bg="#7f8c8d", padx=10, pady=6)
         self.banner.pack(fill="x")
 
@@ -436,9 +83,7 @@ class App(tk.Tk):
 
         self.job_btns = {}
         self.job_keys = list(self.CONFIG["JOBS"].keys())
-        self.selected_job = tk.StringVar(value="")
-        self.last_selected_job = ""
-        self.last_valid_job = ""
+        self.active_job = ""
         self._rebuild_job_buttons()
 
         # Define StringVars for job details
@@ -480,7 +125,7 @@ class App(tk.Tk):
         ttk.Label(batch_frame, text="Batch Size:").grid(row=0, column=2, sticky="e", padx=(20,0))
         be = ttk.Entry(batch_frame, textvariable=self.batch_var, width=8)
         be.grid(row=0, column=3, sticky="w", padx=6)
-        be.bind("<KeyRelease>", lambda e: self.refresh_preview_upnext_and_lb())
+        be.bind("<KeyRelease>", lambda e: self.engine.submit("set_batch_size", text=self.batch_var.get()))
         ttk.Button(batch_frame, text="Set as Default for Job", command=self.set_job_default_batch).grid(row=0, column=4, padx=8)
 
         right_frame = ttk.Frame(main_content_frame)
@@ -510,9 +155,6 @@ class App(tk.Tk):
         self.status_var = tk.StringVar(value="Idle.")
         ttk.Label(self, textvariable=self.status_var).pack(fill="x", padx=8, pady=(0,8))
 
-        self.serial = SerialHelper(self.CONFIG["SERIAL"], self.update_conn_pill, self.on_serial_line, self)
-
-        self.selected_job.set("")
         self._apply_job_visibility_for_pin_selection(active_key=None)
 
         self.update_visibility_from_settings()
@@ -520,20 +162,110 @@ class App(tk.Tk):
         self.update_af_button_state()
         self._update_input_status_display()
 
-        if self.CONFIG["SERIAL"]["enabled"] and not self.CONFIG["SIMULATE"]["enabled"]:
-            self.after(self.CONFIG["SERIAL"]["poll_ms"], self.poll_serial)
-        else:
-            self.update_conn_pill("SIMULATE" if self.CONFIG["SIMULATE"]["enabled"] else "Disabled", warn=True)
-
         self.refresh_ports()
-        self.after(30_000, self._watch_date_rollover)
-        self.after(100, self._check_for_job_select_on_start)
-
+        self._events = self.engine.subscribe()
+        self.engine.start()
+        self.after(20, self._pump_events)
         self.after(500, self._auto_connect_on_startup)
 
-        if self.CONFIG.get("OPEN_LB_FILE_ON_START"):
-            delay = int(self.CONFIG.get("LIGHTBURN", {}).get("start_delay_sec", 2) * 1000)
-            self.after(delay, self._open_and_position_lb_for_current_job)
+    def _pump_events(self):
+        """Applies events from the engine to the widgets. Runs on the Tk thread."""
+        try:
+            while True:
+                event, payload = self._events.get_nowait()
+                handler = getattr(self, f"_on_{event}", None)
+                if handler is None: continue
+                try: handler(**payload)
+                except Exception as e: print(f"[UI] Event {event} failed: {e}")
+        except queue.Empty:
+            pass
+        finally:
+            self.after(20, self._pump_events)
+
+    def _on_state(self, **changed):
+        if "status" in changed: self.status_var.set(changed["status"])
+        if "banner" in changed: self.set_banner(*changed["banner"])
+        if "conn" in changed: self.update_conn_pill(**changed["conn"])
+        if "connected" in changed:
+            self.connected = changed["connected"]
+            if self.connected: self.connect_button.config(text="Disconnect", bg="#E74C3C")
+            else: self.connect_button.config(text="Connect", bg="#4CAF50")
+        if "inputs" in changed: self.input_state = changed["inputs"]
+        if "relays" in changed: self.relay_state = changed["relays"]
+        if "door_closed" in changed: self.door_closed = changed["door_closed"]
+        if "is_engraving" in changed: self.is_engraving = changed["is_engraving"]
+        if changed.keys() & {"door_closed", "is_engraving"}: self.update_door_ui()
+        if changed.keys() & {"inputs", "door_closed"}: self._update_input_status_display()
+
+        if "job" in changed:
+            self.active_job = changed["job"]
+            self._apply_job_visibility_for_pin_selection(active_key=self.active_job or None)
+        if "job_details" in changed:
+            d = changed["job_details"]
+            for var, k in ((self.part_var, "part"), (self.rev_var, "rev"), (self.ver_var, "ver"),
+                           (self.cav_var, "cav"), (self.mach_var, "mach"), (self.date_var, "date")):
+                var.set(d.get(k, ""))
+        if "batch_size" in changed: self.batch_var.set(changed["batch_size"])
+        if "next_serial" in changed: self.next_var.set(changed["next_serial"])
+        if "preview" in changed:
+            preview = changed["preview"]
+            self.upnext_list.delete(0, tk.END)
+            for code in preview["codes"]:
+                self.upnext_list.insert(tk.END, code)
+            self.left_hdr.config(text=f"Up Next (Preview / Current Batch) [{preview['total']}]")
+        if "adaptive" in changed: self.adaptive = changed["adaptive"]
+
+    def _on_config(self, config):
+        self.CONFIG = config
+        if not self._apply_config(): return
+        n_inputs = len(self.CC.input_names)
+        self.input_state = (self.input_state + [1] * n_inputs)[:n_inputs]
+        changed = config_diff(self._applied_config, self.CONFIG)
+        self._applied_config = copy.deepcopy(self.CONFIG)
+        self._apply_config_changes(changed)
+
+    def _on_prompt(self, kind, title, message):
+        answer = messagebox.askyesno(title, message)
+        if kind == "autofocus":
+            self.engine.submit("autofocus_reply", run=answer)
+        elif kind == "focus_check":
+            self.engine.submit("focus_check_reply", confirmed=answer)
+        elif kind == "recovery":
+            self.engine.submit("resolve_recovery", engraved=answer)
+
+    def _on_error(self, title, message):
+        messagebox.showerror(title, message)
+
+    def _on_info(self, title, message):
+        messagebox.showinfo(title, message)
+
+    def _on_close(self):
+        self.engine.stop()
+        self.destroy()
+
+    def _apply_config(self):
+        """Compiles the CONFIG mirror for the widgets. Returns False (keeping the old CC) if invalid."""
+        try:
+            self.CC = CompiledConfig(self.CONFIG)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[CONFIG] Invalid config: {e}")
+            return False
+        return True
+
+    def _apply_config_changes(self, changed):
+        """Updates only the widgets affected by a config change; the engine handles the station itself."""
+        if not changed: return
+        sections = {c.split(".", 1)[0] for c in changed}
+
+        if "JOBS" in sections or "UI.job_button_colors" in changed:
+            self._rebuild_job_buttons()
+        if sections & {"IO_MAP", "INPUTS"}:
+            self._update_input_status_display()
+        if "AUTOFOCUS" in sections:
+            self.af_enabled = self.CC.af_enabled
+            self.update_af_button_state()
+        if "UI" in sections:
+            self.update_visibility_from_settings()
 
     def _auto_connect_on_startup(self):
         if self.CONFIG["SERIAL"].get("auto_connect", False):
@@ -598,11 +330,8 @@ class App(tk.Tk):
         self.refresh_button.pack(side=tk.LEFT, padx=5)
 
     def toggle_connection(self):
-        if self.serial.ser and self.serial.ser.is_open:
-            self.serial.close()
-            self.connect_button.config(text="Connect", bg="#4CAF50")
-            self.update_conn_pill("Disconnected", warn=True)
-            print("Disconnected from serial port via GUI.")
+        if self.connected:
+            self.engine.submit("disconnect")
         else:
             selected_display_name = self.port_var.get()
             port_name = self.ports_dict.get(selected_display_name)
@@ -611,32 +340,7 @@ class App(tk.Tk):
                 messagebox.showerror("Connection Error", "No valid COM port selected.")
                 return
 
-            if self.serial.try_open_manual(port_name):
-                self.connect_button.config(text="Disconnect", bg="#E74C3C")
-                self.initialize_relays_off()
-
-                self.after(250, self.serial.get_all_states)
-
-                self.CONFIG["SERIAL"]["port"] = port_name
-                self.save_config()
-
-    def initialize_relays_off(self):
-        relay_pins = self.CONFIG["ESP32_PINS"]["relays"]
-        print("Sending initial RSET 0 commands to ensure all relays are OFF...")
-
-        if not (self.serial.ser and self.serial.ser.is_open):
-            print("Error: Serial connection lost, cannot send RSET commands.")
-            return
-
-        for i in range(len(relay_pins)):
-            command = f"RSET {i} 0\n"
-            try:
-                self.serial.ser.write(command.encode('utf-8'))
-                time.sleep(0.01)
-            except serial.SerialException as e:
-                print(f"Error sending RSET OFF command for Relay {i}: {e}")
-
-        print("Initial relays state set to OFF.")
+            self.engine.submit("connect", port=port_name)
 
     def get_config_path(self):
         if len(sys.argv) > 1 and sys.argv[1].lower().endswith('.json'):
@@ -650,111 +354,21 @@ class App(tk.Tk):
         except Exception:
             pass
 
-    def derive_paths(self):
-        ROOT = self.CONFIG["ROOT"]
-        DIRS = {
-            "config": os.path.join(ROOT, "Config"),
-            "logs": os.path.join(ROOT, "LOGS"),
-            "jobs": os.path.join(ROOT, "Jobs")
-        }
-
-        # Use paths from config, with updated defaults pointing to LOGS
-        file_paths = self.CONFIG.get("FILE_PATHS", {})
-        LB_BATCH = file_paths.get("next_batch_path", os.path.join(DIRS["logs"], "NextBatch.csv"))
-        WORKING_BATCH = os.path.join(DIRS["logs"], "CurrentBatch.csv") # Intermediate file
-        WORKING_COMPLETED_TODAY = file_paths.get("completed_today_path", os.path.join(DIRS["logs"], "Completed_Today.csv"))
-
-        return DIRS, LB_BATCH, WORKING_BATCH, WORKING_COMPLETED_TODAY
-
-    def ensure_dirs(self):
-        for d in self.DIRS.values(): os.makedirs(d, exist_ok=True)
-        y = os.path.join(self.DIRS["logs"], datetime.now().strftime("%Y"))
-        os.makedirs(y, exist_ok=True); os.makedirs(os.path.join(y, today_code()), exist_ok=True)
-
-    def daily_dir(self):
-        return os.path.join(self.DIRS["logs"], datetime.now().strftime("%Y"), today_code())
-
-    def save_config(self):
+    def save_config(self, persist=True):
+        """Validates the edited CONFIG and hands it to the engine, which saves and applies it."""
         try:
-            with open(self.config_path, "w", encoding="utf-8") as f: json.dump(self.CONFIG, f, indent=2)
-            return True
-        except Exception as e:
-            messagebox.showerror("Save Config", f"Failed to save config:\n{e}"); return False
-
-    def enforce_retention_on_startup(self):
-        mode = self.CONFIG["LOGGING"].get("retain_mode", "off")
-        
-        if mode == "off":
-            # --- MODIFIED: Protect All_Jobs_History.csv ---
-            logs_dir = self.DIRS.get("logs")
-            hist_path = self.CONFIG.get("FILE_PATHS", {}).get("entire_history_path")
-            if not logs_dir or not os.path.exists(logs_dir):
-                return
-            
-            hist_filename = os.path.basename(hist_path) if hist_path else "All_Jobs_History.csv"
-            
-            for item in os.listdir(logs_dir):
-                item_path = os.path.join(logs_dir, item)
-                if item.lower() == hist_filename.lower():
-                    continue # Skip the history file
-                try:
-                    if os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                    else:
-                        os.remove(item_path)
-                except Exception as e:
-                    print(f"Could not remove log item {item_path}: {e}")
-
-        elif mode == "today_only":
-            y_root = self.DIRS["logs"]
-            if os.path.exists(y_root):
-                for y in os.listdir(y_root):
-                    ypath = os.path.join(y_root, y)
-                    if not os.path.isdir(ypath): continue
-                    for d in os.listdir(ypath):
-                        if d != today_code(): shutil.rmtree(os.path.join(ypath, d), ignore_errors=True)
-        elif mode == "days":
-            keep_days = max(1, int(self.CONFIG["LOGGING"].get("retain_days", 7)))
-            self._purge_older_than_days(keep_days)
-
-    def _purge_older_than_days(self, n_days):
-        cutoff = date.today() - timedelta(days=n_days-1)
-        y_root = self.DIRS["logs"]
-        if not os.path.exists(y_root): return
-        for y in os.listdir(y_root):
-            ypath = os.path.join(y_root, y)
-            if not os.path.isdir(ypath): continue
-            for d in os.listdir(ypath):
-                dpath = os.path.join(ypath, d)
-                if not os.path.isdir(dpath): continue
-                try:
-                    dt = datetime.strptime(d, "%y%m%d").date()
-                    if dt < cutoff: shutil.rmtree(dpath, ignore_errors=True)
-                except Exception: pass
-
-    def filter_completed_today_old_dates(self):
-        if os.path.exists(self.WORKING_COMPLETED_TODAY):
-            kept = []
-            curr_dc = today_code()
-            try:
-                with open(self.WORKING_COMPLETED_TODAY, "r", newline="", encoding="utf-8") as fh:
-                    r = csv.DictReader(fh)
-                    for row in r:
-                        if row.get("DateCode") == curr_dc: kept.append(row)
-                with open(self.WORKING_COMPLETED_TODAY, "w", newline="", encoding="utf-8") as fh:
-                    if not kept: # If no rows are kept, file is effectively cleared
-                        return
-                    w = csv.DictWriter(fh, fieldnames=kept[0].keys())
-                    w.writeheader(); w.writerows(kept)
-            except (IOError, csv.Error) as e:
-                print(f"Error processing Completed_Today.csv: {e}")
-
+            CompiledConfig(self.CONFIG)
+        except (KeyError, TypeError, ValueError) as e:
+            messagebox.showerror("Save Config", f"Config is not valid, not saved:\n{e}"); return False
+        self.engine.submit("save_config", config=copy.deepcopy(self.CONFIG), persist=persist)
+        return True
 
     def set_banner(self, text, color): self.banner.config(text=text, bg=color)
-    def banner_idle(self): self.set_banner("Idle", "#7f8c8d")
-    def banner_engraving(self): self.set_banner("Engraving… please wait", "#c0392b")
-    def banner_warning(self): self.set_banner("Warning", "#f39c12")
-    def banner_ok(self): self.set_banner("Complete", "#27ae60")
+
+    def open_door_pulse(self): self.engine.submit("open_door")
+    def do_autofocus(self): self.engine.submit("autofocus")
+    def set_job_default_batch(self): self.engine.submit("set_job_default_batch")
+    def _test_relay(self, index): self.engine.submit("test_relay", index=index)
 
     def tick_clock(self):
         self.clock_var.set(datetime.now().strftime("%Y-%m-%d %H:%M:%S")); self.after(200, self.tick_clock)
@@ -803,462 +417,15 @@ class App(tk.Tk):
             b.grid(row=0, column=0, padx=6, pady=4)
             b.grid_remove()
             self.job_btns[key] = b
-        self._apply_job_visibility_for_pin_selection()
-
-    def on_job_clicked(self, key):
-        old_job = self.selected_job.get()
-
-        if key:
-            self.selected_job.set(key)
-
-        if key and key != old_job:
-            print(f"DEBUG: Job change detected. Old: '{old_job}', New: '{key}'.")
-            should_autofocus = False
-
-            if not self.is_startup_complete:
-                print("DEBUG: Autofocus triggered by first job selection.")
-                should_autofocus = True
-                self.is_startup_complete = True
-
-            elif self.last_valid_job and key != self.last_valid_job:
-                print("DEBUG: Autofocus triggered because new job differs from the last valid one.")
-                should_autofocus = True
-
-            if should_autofocus:
-                self.do_autofocus()
-
-        if key:
-            self.last_valid_job = key
-            job_cfg = self.CONFIG["JOBS"][key]
-            
-            # Update all job detail fields
-            self.part_var.set(job_cfg.get("part_number", ""))
-            self.rev_var.set(job_cfg.get("revision", ""))
-            self.ver_var.set(job_cfg.get("version", ""))
-            self.cav_var.set(job_cfg.get("cavity", ""))
-            self.mach_var.set(job_cfg.get("machine", ""))
-            self.date_var.set(today_code())
-            self.batch_var.set(str(job_cfg.get("default_batch", "")))
-            
-            self.refresh_next_serial_label()
-            self.refresh_preview_upnext_and_lb()
-            self.status_var.set(f"Selected {job_cfg.get('display_name', key)}. Serial batch loaded.")
-            self.banner_idle()
-
-            if self.CONFIG.get("OPEN_LB_FILE_ON_START"):
-                self.after(100, self._open_and_position_lb_for_current_job)
-        
-        # If key is None/empty, the clearing is handled by _maybe_select_job_from_input_pattern
-        
-        self._apply_job_visibility_for_pin_selection(active_key=key)
-        self._check_and_start_job_automatically()
-
-    def compute_next_serial_from_completed(self, pn):
-        mode = self.CONFIG["LOGGING"].get("retain_mode", "off")
-        max_ser = 0
-        if mode == "off":
-            if os.path.exists(self.WORKING_COMPLETED_TODAY):
-                with open(self.WORKING_COMPLETED_TODAY, "r", newline="", encoding="utf-8") as fh:
-                    for row in csv.DictReader(fh):
-                        if row.get("PartNumber")==pn and row.get("DateCode")==today_code():
-                            try: max_ser = max(max_ser, int(row.get("Serial5","00000")))
-                            except: pass
-        else:
-            for f in self.completed_files_today():
-                if os.path.exists(f):
-                    with open(f, "r", newline="", encoding="utf-8") as fh:
-                        for row in csv.DictReader(fh):
-                            if row.get("PartNumber")==pn and row.get("DateCode")==today_code():
-                                try: max_ser = max(max_ser, int(row.get("Serial5","00000")))
-                                except: pass
-        return max_ser + 1
-
-    def refresh_next_serial_label(self):
-        try:
-            if not self.selected_job.get(): self.next_var.set(""); return
-            pn = self.CONFIG["JOBS"][self.selected_job.get()]["part_number"]
-        except Exception: pn = ""
-        next_n = self.compute_next_serial_from_completed(pn) if pn else 1
-        try: self.next_var.set(f"{next_n:05d}")
-        except Exception: pass
-
-    def completed_files_today(self):
-        base = os.path.join(self.daily_dir(), "Completed.csv")
-        pattern = os.path.join(self.daily_dir(), "Completed*.csv")
-        files = sorted(glob.glob(pattern), key=self._completed_sort_key)
-        return files if files else [base]
-
-    def planned_files_today(self):
-        base = os.path.join(self.daily_dir(), "Planned.csv")
-        pattern = os.path.join(self.daily_dir(), "Planned*.csv")
-        files = sorted(glob.glob(pattern), key=self._completed_sort_key)
-        return files if files else [base]
-
-    @staticmethod
-    def _completed_sort_key(path):
-        name = os.path.basename(path)
-        if "_" in name:
-            try: n = int(name.split("_",1)[1].split(".")[0])
-            except Exception: n = 1
-        else: n = 1
-        return n
-
-    def _next_chunk_path(self, base_path):
-        folder, base = os.path.split(base_path)
-        stem, ext = os.path.splitext(base)
-        existing = sorted(glob.glob(os.path.join(folder, stem+"*.csv")), key=self._completed_sort_key)
-        if not existing: return base_path
-        last = os.path.basename(existing[-1])
-        if "_" in last:
-            try: idx = int(last.split("_",1)[1].split(".")[0]) + 1
-            except Exception: idx = 2
-            return os.path.join(folder, f"{stem}_{idx}.csv")
-        else:
-            return os.path.join(folder, f"{stem}_2.csv")
-
-    def _needs_rollover(self, path):
-        max_rows = int(self.CONFIG.get("LOGGING",{}).get("daily_max_rows", 20000))
-        if not os.path.exists(path): return False
-        try:
-            with open(path, "r", newline="", encoding="utf-8") as fh:
-                r = csv.reader(fh); next(r, None)
-                for i, _ in enumerate(r, start=1):
-                    if i >= max_rows: return True
-        except Exception: pass
-        return False
-
-    def _append_row(self, path, fieldnames, row):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        write_header = not os.path.exists(path)
-        with open(path, "a", newline="", encoding="utf-8") as fh:
-            w = csv.DictWriter(fh, fieldnames=fieldnames)
-            if write_header: w.writeheader()
-            w.writerow(row)
-
-    def append_planned(self, rows):
-        if self.CONFIG["LOGGING"].get("retain_mode","off") == "off": return
-        if not self.CONFIG["LOGGING"].get("write_planned", True): return
-        base = os.path.join(self.daily_dir(), "Planned.csv")
-        target = self._next_chunk_path(base) if self._needs_rollover(base) else base
-        fns = ["Date","JobID","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","FullCode"]
-        with open(target, "a", newline="", encoding="utf-8") as fh:
-            w = csv.DictWriter(fh, fieldnames=fns)
-            if fh.tell() == 0: w.writeheader()
-            w.writerows(rows)
-
-    def _completed_header(self):
-        return ["Time","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","Serial Number","Result"]
-
-    def append_completed_many(self, rows, result="OK"):
-        # This function handles the daily rotating logs and the "Completed Today" log
-        fns = self._completed_header()
-        
-        now_t = datetime.now().strftime("%H:%M:%S")
-        out_rows = []
-        for r in rows:
-            row_to_write = {k: r.get(k, '') for k in fns}
-            row_to_write.update({
-                "Time": now_t,
-                "Serial Number": r.get("FullCode", ""),
-                "Result": result
-            })
-            out_rows.append(row_to_write)
-        
-        # Write to "Completed Today" file
-        path_today = self.WORKING_COMPLETED_TODAY
-        os.makedirs(os.path.dirname(path_today), exist_ok=True)
-        write_header_today = not os.path.exists(path_today) or os.path.getsize(path_today) == 0
-        with open(path_today, "a", newline="", encoding="utf-8") as fh:
-            w = csv.DictWriter(fh, fieldnames=fns)
-            if write_header_today: w.writeheader()
-            w.writerows(out_rows)
-
-        # Write to daily rotating logs if retention is not off
-        if self.CONFIG["LOGGING"].get("retain_mode", "off") != "off":
-            base = os.path.join(self.daily_dir(), "Completed.csv")
-            path_daily = self._next_chunk_path(base) if self._needs_rollover(base) else base
-            os.makedirs(os.path.dirname(path_daily), exist_ok=True)
-            write_header_daily = not os.path.exists(path_daily)
-            with open(path_daily, "a", newline="", encoding="utf-8") as fh:
-                w = csv.DictWriter(fh, fieldnames=fns)
-                if write_header_daily: w.writeheader()
-                w.writerows(out_rows)
-
-    def append_history_csv(self, rows, result="OK"):
-        # --- MODIFIED: Handles the persistent All_Jobs_History.csv ---
-        if not self.CONFIG["HISTORY"].get("enabled", False): return
-        hist_path = self.CONFIG.get("FILE_PATHS", {}).get("entire_history_path", "").strip()
-        if not hist_path: return
-
-        os.makedirs(os.path.dirname(hist_path), exist_ok=True)
-        write_header = not os.path.exists(hist_path) or os.path.getsize(hist_path) == 0
-
-        # Simplified columns as requested for the master history log
-        cols = ["DateTime", "PartNumber", "Serial Number", "JobName", "Result"]
-
-        now_dt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        out_rows = []
-        for r in rows:
-            row_to_write = {
-                "DateTime": now_dt,
-                "PartNumber": r.get("PartNumber", ""),
-                "Serial Number": r.get("FullCode", ""),
-                "JobName": r.get("JobName", ""),
-                "Result": result
-            }
-            out_rows.append(row_to_write)
-
-        with open(hist_path, "a", newline="", encoding="utf-8") as fh:
-            w = csv.DictWriter(fh, fieldnames=cols)
-            if write_header:
-                w.writeheader()
-            w.writerows(out_rows)
-
-    def read_working_batch(self):
-        if not os.path.exists(self.WORKING_BATCH): return []
-        with open(self.WORKING_BATCH, "r", newline="", encoding="utf-8") as f:
-            return list(csv.DictReader(f))
-
-    def write_working_batch(self, rows):
-        fns = ["Date","JobID","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","FullCode"]
-        with open(self.WORKING_BATCH, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=fns)
-            w.writeheader(); w.writerows(rows)
-
-    def write_lightburn_batch(self, codes):
-        with open(self.LB_BATCH, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["CODE"]); [w.writerow([c]) for c in codes]
-
-    def build_preview_rows(self):
-        if not self.selected_job.get(): return [], []
-        key = self.selected_job.get(); cfg = self.CONFIG["JOBS"][key]
-        job_name = cfg.get("display_name", key)
-        dc = today_code()
-        
-        try: n = max(1, int(self.batch_var.get()))
-        except Exception: n = cfg["default_batch"]
-        
-        start_ser = self.compute_next_serial_from_completed(cfg["part_number"])
-        rows, codes = [], []
-        
-        for i in range(n):
-            s5 = serial5(start_ser + i)
-            fc = build_fullcode(cfg, dc, s5)
-            rows.append({
-                "Date": datetime.now().strftime("%Y-%m-%d"), 
-                "JobID": key, 
-                "JobName": job_name, 
-                "PartNumber": cfg.get("part_number"), 
-                "Revision": cfg.get("revision"),
-                "Version": cfg.get("version"),
-                "Cavity": cfg.get("cavity"),
-                "Machine": cfg.get("machine"),
-                "DateCode": dc, 
-                "Serial5": s5, 
-                "FullCode": fc
-            })
-            codes.append(fc)
-        return rows, codes
-
-    def refresh_preview_upnext_and_lb(self):
-        rows, codes = self.build_preview_rows()
-        self.upnext_list.delete(0, tk.END)
-        for r in rows[:self.CONFIG["UI"]["up_next_tail"]]:
-            self.upnext_list.insert(tk.END, f'{r["FullCode"]}')
-        try: self.left_hdr.config(text=f"Up Next (Preview / Current Batch) [{len(rows)}]")
-        except Exception: pass
-        self.write_lightburn_batch(codes)
-
-    def _current_job_lb_path(self):
-        try: return self.CONFIG["JOBS"][self.selected_job.get()]["lightburn_file"]
-        except Exception: return ""
-
-    def _open_lightburn_file(self, path):
-        if not path or not os.path.exists(path):
-            messagebox.showerror("LightBurn File", f"File not found:\n{path}"); return False
-        try:
-            exe = (self.CONFIG.get("LIGHTBURN", {}) or {}).get("exe_path", "").strip()
-            if IS_WINDOWS and exe and os.path.exists(exe):
-                subprocess.Popen([exe, path], shell=False)
-            else:
-                if IS_WINDOWS: os.startfile(path)
-                elif platform.system()=="Darwin": subprocess.Popen(["open", path])
-                else: subprocess.Popen(["xdg-open", path])
-            return True
-        except Exception as e:
-            messagebox.showerror("Open File", f"Could not open LightBurn file.\n{e}")
-            return False
-
-    def _open_and_position_lb_for_current_job(self):
-        lb_path = self._current_job_lb_path()
-        if not lb_path or not os.path.exists(lb_path):
-            self.status_var.set("LightBurn project missing for current job. Open Settings → Jobs to fix path.")
-            return
-        ok = self._open_lightburn_file(lb_path)
-        if not ok: return
-        delay_ms = int(self.CONFIG.get("LIGHTBURN", {}).get("post_open_delay_sec", 3) * 1000)
-        self.after(delay_ms, self._position_lb_small_bottom_right)
-
-    def _position_lb_small_bottom_right(self):
-        if not IS_WINDOWS: return
-        hwnd = _find_lightburn_window()
-        if not hwnd: return
-
-    def _force_foreground(self, hwnd):
-        if not IS_WINDOWS or not hwnd:
-            return
-        try:
-            ShowWindow(hwnd, SW_RESTORE)
-            BringWindowToTop(hwnd)
-            SetForegroundWindow(hwnd)
-            SetFocus(hwnd)
-            time.sleep(0.05)
-            cur_tid = kernel32.GetCurrentThreadId()
-            pid = wintypes.DWORD()
-            target_tid = user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
-            if target_tid and target_tid != cur_tid:
-                AttachThreadInput(cur_tid, target_tid, True)
-                try:
-                    BringWindowToTop(hwnd)
-                    SetForegroundWindow(hwnd)
-                    SetFocus(hwnd)
-                finally:
-                    AttachThreadInput(cur_tid, target_tid, False)
-        except Exception:
-            pass
-
-    def _reenable_start_button(self):
-        self.is_engraving = False
-        self.update_door_ui()
-
-    def _check_and_start_job_automatically(self):
-        if self.is_engraving:
-            return
-
-        if self.selected_job.get() and self.door_closed:
-            print("Auto-start conditions met. Starting laser flow.")
-            self.start_laser_flow()
-
-    def _trigger_laser_start(self):
-        if not self.is_engraving: return
-
-        self.status_var.set("Sending START pulse to laser...")
-        self.pulse_relay_by_name("Start", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Start")])
-
-        job_cfg = self.CONFIG["JOBS"][self.selected_job.get()]
-        job_delay_sec = job_cfg.get("job_delay_sec", 1)
-        self.status_var.set(f"Job is running... Will complete in {job_delay_sec} seconds.")
-
-        self.after(int(job_delay_sec * 1000), self._on_job_timer_complete)
-
-    def _on_job_timer_complete(self):
-        if not self.is_engraving:
-            print("Job timer finished, but engraving state is false. Ignoring.")
-            return
-
-        print(f"Job timer of {self.CONFIG['JOBS'][self.selected_job.get()].get('job_delay_sec')}s has completed.")
-
-        if self.CONFIG["SIMULATE"]["batch_done_on_done"]:
-            self.complete_whole_batch()
-        else:
-            self.complete_one_item()
-
-    def start_laser_flow(self):
-        if self.is_engraving: return
-        if not self.door_closed: return
-        if not self.selected_job.get(): return
-        rows, codes = self.build_preview_rows()
-        if not rows: return
-
-        self.write_working_batch(rows)
-        self.append_planned(rows)
-        self.is_engraving = True
-        self.update_door_ui()
-        self.banner_engraving()
-
-        job_cfg = self.CONFIG["JOBS"][self.selected_job.get()]
-        air_before_sec = job_cfg.get("air_before_sec", 0)
-
-        lb_path = self._current_job_lb_path()
-        if lb_path and os.path.exists(lb_path):
-            self._open_lightburn_file(lb_path)
-            delay_ms = int(self.CONFIG.get("LIGHTBURN", {}).get("post_open_delay_sec", 3) * 1000)
-            self.after(delay_ms, self._position_lb_small_bottom_right)
-
-        self.status_var.set(f"Pulsing air, then waiting {air_before_sec}s...")
-        self.pulse_relay_by_name("Air", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Air")])
-        self.set_relay_by_name("Stack Light", 1)
-
-        self.after(int(air_before_sec * 1000), self._trigger_laser_start)
-
-    def abort_stop_flow(self):
-        self.status_var.set("Aborting job. Stopping all processes.")
-        self.set_relay_by_name("Air", 0)
-        self.set_relay_by_name("Door Lock", 0)
-        self.set_relay_by_name("Stack Light", 0)
-        self.cancel_batch()
-        self._reenable_start_button()
-
-    def _run_focus_cycle(self):
-        if not self.selected_job.get(): return
-
-        job_cfg = self.CONFIG["JOBS"][self.selected_job.get()]
-        focus_x = float(job_cfg.get("focus_height", 0.0))
-
-        self.status_var.set(f"Sending Auto Focus pulse...")
-        self.pulse_relay_by_name("Auto Focus", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Auto Focus")])
-
-        if messagebox.askyesno("Focus Check", f"Was the Height set to {focus_x}?"):
-            self.status_var.set(f"Focus confirmed ({focus_x}).")
-        else:
-            self.status_var.set("Focus NOT confirmed. Retrying...")
-            self.after(100, self._run_focus_cycle)
-
-    def do_autofocus(self):
-        if not self.af_enabled:
-            self.status_var.set("Autofocus is disabled in settings.")
-            return
-
-        if self.is_engraving:
-            messagebox.showwarning("Job Running", "Cannot run Auto Focus while a job is in progress.")
-            return
-
-        if not self.selected_job.get():
-            messagebox.showwarning("No Job", "Please select a job first.")
-            return
-
-        if messagebox.askyesno("Auto Focus", "Do you want to run Auto Focus for this job?"):
-            self._run_focus_cycle()
-        else:
-            self.status_var.set("Auto Focus skipped by user.")
-
-    def open_door_pulse(self):
-        if self.is_engraving:
-            messagebox.showwarning("Job Running", "Cannot open the door while a job is in progress.")
-            return
-        self.pulse_relay_by_name("Door Lock", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Door Lock")])
-        self.status_var.set("Door unlocked for a brief moment.")
-
-    def sim_done(self):
-        if self.CONFIG["SIMULATE"]["batch_done_on_done"]:
-            self.complete_whole_batch(result="SIM")
-        else:
-            self.complete_one_item(result="SIM")
-
-    def cancel_batch(self):
-        if os.path.exists(self.WORKING_BATCH): os.remove(self.WORKING_BATCH)
-        self.write_lightburn_batch([]); self.refresh_preview_upnext_and_lb()
-        self.status_var.set("Batch aborted / canceled. Queue cleared."); self.banner_warning()
-        self.refresh_next_serial_label()
-        self._reenable_start_button()
+        self._apply_job_visibility_for_pin_selection(active_key=self.active_job or None)
 
     def _update_input_status_display(self):
         status_parts = []
-        input_names = self.CONFIG["INPUTS"]["names"]
+        input_names = self.CC.input_names
 
         for i in range(len(input_names)):
             name = input_names[i]
-            if i == 3:
+            if i == self.CC.door_input:
                 state_text = "Closed" if self.door_closed else "Open"
             else:
                 if self.input_state[i] == 0:
@@ -1270,151 +437,6 @@ class App(tk.Tk):
 
         self.input_status_var.set(" | ".join(status_parts))
 
-    def on_serial_line(self, line):
-        line = (line or "").strip()
-        if not line: return
-        if not line.upper().startswith("INFO:"):
-            print(f"[RX] {line}")
-
-        if line.upper().startswith("RELAY:"):
-            try:
-                _, rest = line.split(":",1)
-                idx, v = rest.split(":")
-                i = int(idx.strip()); val = int(v.strip())
-                if 0 <= i < len(self.CONFIG["RELAYS"]["names"]):
-                    self.relay_state[i] = 1 if val else 0
-            except Exception: pass
-            return
-
-        if line.upper().startswith("INPUT:"):
-            try:
-                _, rest = line.split(":", 1)
-                idx_str, val_str = rest.split(":")
-                ii = int(idx_str.strip())
-                val = int(val_str.strip())
-
-                if self.input_override[ii]: return
-                self.input_state[ii] = val
-
-                if ii == 3:
-                    is_closed = (val == 0)
-                    if is_closed != self.door_closed:
-                        self.door_closed = is_closed
-                        self.update_door_ui()
-                        self._check_and_start_job_automatically()
-
-                self._maybe_select_job_from_input_pattern()
-                self._update_input_status_display()
-            except Exception:
-                print(f"[ERROR] Failed to parse INPUT line: {line}")
-            return
-
-    def _run_end_of_job_actions(self):
-        self.status_var.set("Finalizing: Pulsing air, unlocking door, resetting stack light.")
-        self.pulse_relay_by_name("Air", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Air")])
-
-        if self.CONFIG.get("MACHINE", {}).get("open_door_on_complete", True):
-            self.pulse_relay_by_name("Door Lock", self.CONFIG["RELAYS"]["pulse_ms"][self.CONFIG["RELAYS"]["names"].index("Door Lock")])
-        else:
-            self.status_var.set("Job complete. Manual door open required.")
-
-        self.set_relay_by_name("Stack Light", 0)
-
-    # --- NEW FUNCTION ---
-    def _close_lightburn_window(self):
-        """Finds the LightBurn window and sends a close message."""
-        if not IS_WINDOWS: return
-        hwnd = _find_lightburn_window()
-        if hwnd:
-            print("Found LightBurn window. Sending close message.")
-            PostMessageW(hwnd, WM_CLOSE, 0, 0)
-        else:
-            print("Could not find LightBurn window to close.")
-
-    def _finalize_single_completion(self):
-        self._run_end_of_job_actions()
-        if os.path.exists(self.WORKING_BATCH): os.remove(self.WORKING_BATCH)
-        self.refresh_preview_upnext_and_lb()
-        self.status_var.set("Batch complete."); self.banner_ok()
-        self.beep_batch_complete()
-        self.refresh_next_serial_label()
-        self._reenable_start_button()
-        # --- MODIFIED: Check if LightBurn should be closed ---
-        if self.CONFIG.get("LIGHTBURN", {}).get("close_on_complete", False):
-            self.after(500, self._close_lightburn_window)
-
-    def _finalize_batch_completion(self):
-        self._run_end_of_job_actions()
-        if os.path.exists(self.WORKING_BATCH): os.remove(self.WORKING_BATCH)
-        self.refresh_preview_upnext_and_lb(); self.refresh_next_serial_label()
-        self.status_var.set("Batch complete (all items written)."); self.banner_ok()
-        self.beep_batch_complete()
-        self._reenable_start_button()
-        # --- MODIFIED: Check if LightBurn should be closed ---
-        if self.CONFIG.get("LIGHTBURN", {}).get("close_on_complete", False):
-            self.after(500, self._close_lightburn_window)
-
-    def complete_one_item(self, result="OK"):
-        rows = self.read_working_batch()
-        if not rows:
-            self.status_var.set("Idle. (No items in queue)"); self.banner_idle(); return
-        head, rest = rows[0], rows[1:]
-        self.append_completed_many([head], result=result)
-        self.append_history_csv([head], result=result)
-        if rest:
-            self.write_working_batch(rest); self.write_lightburn_batch([r["FullCode"] for r in rest])
-            self.status_var.set("Next ready…"); self.banner_engraving()
-        else:
-            try:
-                job_key = head['JobID']
-                job_cfg = self.CONFIG["JOBS"][job_key]
-            except KeyError:
-                job_cfg = self.CONFIG["JOBS"].get(self.selected_job.get(), {})
-
-            air_after_sec = job_cfg.get("air_after_sec", 0)
-            self.status_var.set(f"Final item complete. Waiting for post-job delay ({air_after_sec}s)...")
-            self.after(int(air_after_sec * 1000), self._finalize_single_completion)
-
-    def complete_whole_batch(self, result="OK"):
-        rows = self.read_working_batch()
-        if not rows:
-            self.status_var.set("Idle. (No items in queue)"); self.banner_idle(); return
-        self.append_completed_many(rows, result=result)
-        self.append_history_csv(rows, result=result)
-
-        try:
-            job_key = rows[0]['JobID']
-            job_cfg = self.CONFIG["JOBS"][job_key]
-        except (IndexError, KeyError):
-            job_cfg = self.CONFIG["JOBS"].get(self.selected_job.get(), {})
-
-        air_after_sec = job_cfg.get("air_after_sec", 0)
-        self.status_var.set(f"Batch complete. Waiting for post-job delay ({air_after_sec}s)...")
-        self.after(int(air_after_sec * 1000), self._finalize_batch_completion)
-
-    def beep_batch_complete(self):
-        try:
-            if IS_WINDOWS:
-                import winsound; winsound.MessageBeep(winsound.MB_ICONASTERISK)
-            else:
-                print("\a", end="", flush=True)
-        except Exception: pass
-
-    def open_lightburn_file(self, path):
-        return self._open_lightburn_file(path)
-
-    def set_job_default_batch(self):
-        if not self.selected_job.get():
-            messagebox.showinfo("No Job", "No job selected yet."); return
-        key = self.selected_job.get()
-        try: n = max(1, int(self.batch_var.get() or 0))
-        except Exception: n = 1
-        self.CONFIG["JOBS"][key]["default_batch"] = n
-        self.save_config()
-        disp = self.CONFIG["JOBS"][key].get("display_name", key)
-        self.status_var.set(f"Default batch for {disp} set to {n}.")
-        self.refresh_preview_upnext_and_lb()
-
     def open_settings(self):
         win = tk.Toplevel(self); win.title("Settings"); win.geometry("1140x820")
         win.attributes('-topmost', True)
@@ -1447,11 +469,11 @@ class App(tk.Tk):
         if not self._io_status_labels: return
 
         try:
-            input_names = self.CONFIG["INPUTS"]["names"]
+            input_names = self.CC.input_names
 
             for i, label in self._io_status_labels.items():
                 if i < len(input_names):
-                    if i == 3:
+                    if i == self.CC.door_input:
                         if self.door_closed:
                             label.config(text="Closed", bg="#27ae60", fg="white")
                         else:
@@ -1481,6 +503,16 @@ class App(tk.Tk):
         canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
         canvas.configure(yscrollcommand=scrollbar.set)
 
+        adaptive = self.CONFIG.get("ADAPTIVE_TIMING", {})
+        adaptive_frame = ttk.Frame(jobs_tab)
+        adaptive_frame.pack(side="top", fill="x", padx=6, pady=(6, 0))
+        self._adaptive_mode_var = tk.StringVar(value=adaptive.get("mode", "suggest"))
+        self._adaptive_margin_var = tk.DoubleVar(value=float(adaptive.get("margin_pct", 15)))
+        ttk.Label(adaptive_frame, text="Adaptive Timing:").pack(side="left")
+        ttk.Combobox(adaptive_frame, textvariable=self._adaptive_mode_var, width=8, values=["off", "suggest", "apply"], state="readonly").pack(side="left", padx=6)
+        ttk.Label(adaptive_frame, text="Safety Margin (%):").pack(side="left", padx=(12, 0))
+        ttk.Entry(adaptive_frame, textvariable=self._adaptive_margin_var, width=6).pack(side="left", padx=6)
+
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         
@@ -1536,59 +568,94 @@ class App(tk.Tk):
             ttk.Entry(scrollable_frame, textvariable=color_var, width=8).grid(row=row+4, column=7, sticky="w", padx=6)
             
             # Row 5: Delays
-            jd_var = tk.IntVar(value=int(jcfg.get("job_delay_sec", 0)))
-            ab_var = tk.IntVar(value=int(jcfg.get("air_before_sec", 0)))
-            aa_var = tk.IntVar(value=int(jcfg.get("air_after_sec", 0)))
+            jd_var = tk.DoubleVar(value=float(jcfg.get("job_delay_sec", 0)))
+            ab_var = tk.DoubleVar(value=float(jcfg.get("air_before_sec", 0)))
+            aa_var = tk.DoubleVar(value=float(jcfg.get("air_after_sec", 0)))
             ttk.Label(scrollable_frame, text="Job Delay (s):").grid(row=row+5, column=0, sticky="e")
             ttk.Entry(scrollable_frame, textvariable=jd_var, width=8).grid(row=row+5, column=1, sticky="w", padx=6)
             ttk.Label(scrollable_frame, text="Air Before (s):").grid(row=row+5, column=2, sticky="e")
             ttk.Entry(scrollable_frame, textvariable=ab_var, width=8).grid(row=row+5, column=3, sticky="w", padx=6)
             ttk.Label(scrollable_frame, text="Air After (s):").grid(row=row+5, column=4, sticky="e")
             ttk.Entry(scrollable_frame, textvariable=aa_var, width=8).grid(row=row+5, column=5, sticky="w", padx=6)
+            fid_var = tk.StringVar(value=str(jcfg.get("fixture_id", "")))
+            ttk.Label(scrollable_frame, text="Fixture ID:").grid(row=row+5, column=6, sticky="e")
+            ttk.Entry(scrollable_frame, textvariable=fid_var, width=8).grid(row=row+5, column=7, sticky="w", padx=6)
+
+            # Row 6: Measured timing
+            stats = self.adaptive.get(key)
+            if stats:
+                ttk.Label(scrollable_frame, text=self._adaptive_text(stats), foreground="#555").grid(row=row+6, column=0, columnspan=7, sticky="w", padx=6)
+                if stats["suggested_ms"] is not None:
+                    ttk.Button(scrollable_frame, text="Use Suggested", command=lambda v=jd_var, ms=stats["suggested_ms"]: v.set(ms / 1000)).grid(row=row+6, column=7, sticky="w")
 
             # Separator and row increment
-            ttk.Separator(scrollable_frame, orient="horizontal").grid(row=row+6, column=0, columnspan=8, sticky="ew", pady=10)
-            self._job_entries[key] = (dn_var, pn_var, rev_var, ver_var, cav_var, mach_var, db_var, lb_var, fx_var, sp_var, jd_var, ab_var, aa_var, color_var)
-            row += 7
+            ttk.Separator(scrollable_frame, orient="horizontal").grid(row=row+7, column=0, columnspan=8, sticky="ew", pady=10)
+            self._job_entries[key] = (dn_var, pn_var, rev_var, ver_var, cav_var, mach_var, db_var, lb_var, fx_var, sp_var, jd_var, ab_var, aa_var, color_var, fid_var)
+            row += 8
         
         ttk.Button(jobs_tab, text="Save", command=lambda: self._save_jobs_settings(jobs_tab)).pack(side="bottom", pady=10)
 
     def _save_jobs_settings(self, jobs_tab):
+        jobs = copy.deepcopy(self.CONFIG["JOBS"])
+        colors = {}
         for key, tpl in self._job_entries.items():
-            (dn_var, pn_var, rev_var, ver_var, cav_var, mach_var, db_var, lb_var, fx_var, sp_var, jd_var, ab_var, aa_var, color_var) = tpl
+            (dn_var, pn_var, rev_var, ver_var, cav_var, mach_var, db_var, lb_var, fx_var, sp_var, jd_var, ab_var, aa_var, color_var, fid_var) = tpl
             
             # Save all values to config dictionary
-            self.CONFIG["JOBS"][key]["display_name"] = dn_var.get().strip() or key
-            self.CONFIG["JOBS"][key]["part_number"] = pn_var.get().strip()
-            self.CONFIG["JOBS"][key]["version"] = ver_var.get().strip().upper()[:1] or "A"
-            self.CONFIG["JOBS"][key]["lightburn_file"] = lb_var.get().strip()
-            self.CONFIG["JOBS"][key]["select_pattern"] = sp_var.get().strip() or ""
-            self.CONFIG["UI"]["job_button_colors"][key] = color_var.get().strip() or "#bdc3c7"
+            jobs[key]["display_name"] = dn_var.get().strip() or key
+            jobs[key]["part_number"] = pn_var.get().strip()
+            jobs[key]["version"] = ver_var.get().strip().upper()[:1] or "A"
+            jobs[key]["lightburn_file"] = lb_var.get().strip()
+            jobs[key]["select_pattern"] = sp_var.get().strip() or ""
+            colors[key] = color_var.get().strip() or "#bdc3c7"
+            fid = fid_var.get().strip()
+            try: jobs[key]["fixture_id"] = int(fid) if fid else ""
+            except ValueError: jobs[key]["fixture_id"] = fid
             
             # Safely save integer/float values
-            try: self.CONFIG["JOBS"][key]["revision"] = int(rev_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["revision"] = 0
-            try: self.CONFIG["JOBS"][key]["cavity"] = int(cav_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["cavity"] = 0
-            try: self.CONFIG["JOBS"][key]["machine"] = int(mach_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["machine"] = 1
-            try: self.CONFIG["JOBS"][key]["default_batch"] = max(1, int(db_var.get()))
-            except Exception: self.CONFIG["JOBS"][key]["default_batch"] = 1
-            try: self.CONFIG["JOBS"][key]["focus_height"] = float(fx_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["focus_height"] = 0.0
-            try: self.CONFIG["JOBS"][key]["job_delay_sec"] = int(jd_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["job_delay_sec"] = 0
-            try: self.CONFIG["JOBS"][key]["air_before_sec"] = int(ab_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["air_before_sec"] = 0
-            try: self.CONFIG["JOBS"][key]["air_after_sec"] = int(aa_var.get())
-            except Exception: self.CONFIG["JOBS"][key]["air_after_sec"] = 0
-            
+            try: jobs[key]["revision"] = int(rev_var.get())
+            except Exception: jobs[key]["revision"] = 0
+            try: jobs[key]["cavity"] = int(cav_var.get())
+            except Exception: jobs[key]["cavity"] = 0
+            try: jobs[key]["machine"] = int(mach_var.get())
+            except Exception: jobs[key]["machine"] = 1
+            try: jobs[key]["default_batch"] = max(1, int(db_var.get()))
+            except Exception: jobs[key]["default_batch"] = 1
+            try: jobs[key]["focus_height"] = float(fx_var.get())
+            except Exception: jobs[key]["focus_height"] = 0.0
+            try: jobs[key]["job_delay_sec"] = round(float(jd_var.get()), 1)
+            except Exception: jobs[key]["job_delay_sec"] = 0
+            try: jobs[key]["air_before_sec"] = round(float(ab_var.get()), 1)
+            except Exception: jobs[key]["air_before_sec"] = 0
+            try: jobs[key]["air_after_sec"] = round(float(aa_var.get()), 1)
+            except Exception: jobs[key]["air_after_sec"] = 0
+
+        _, errors = build_job_select_table(dict(self.CONFIG, JOBS=jobs))
+        if errors:
+            messagebox.showerror("Job Select", "Job settings not saved:\n\n" + "\n".join(errors), parent=jobs_tab)
+            return
+        self.CONFIG["JOBS"] = jobs
+        self.CONFIG["UI"]["job_button_colors"].update(colors)
+        adaptive = self.CONFIG.setdefault("ADAPTIVE_TIMING", {})
+        adaptive["mode"] = self._adaptive_mode_var.get() or "suggest"
+        try: adaptive["margin_pct"] = max(0.0, float(self._adaptive_margin_var.get()))
+        except Exception: pass
+
         if self.save_config():
             messagebox.showinfo("Saved", "Job settings saved.", parent=jobs_tab)
-            self.refresh_preview_upnext_and_lb()
-            self._rebuild_job_buttons()
-            self._apply_job_visibility_for_pin_selection()
-            
+
+    @staticmethod
+    def _adaptive_text(stats):
+        if not stats["n"]:
+            return "Measured: no job-done signal seen yet."
+        text = (f"Measured engrave (n={stats['n']}): p50 {stats['p50_ms'] / 1000:.1f}s, "
+                f"p{round(stats['pct'] * 100)} {stats['p_ms'] / 1000:.1f}s, max {stats['max_ms'] / 1000:.1f}s.")
+        if stats["suggested_ms"] is None:
+            return text + " Not enough cycles for a suggestion yet."
+        text += f" Suggested delay {stats['suggested_ms'] / 1000:g}s (now {stats['configured_ms'] / 1000:g}s)"
+        if stats["gain_pct"] is not None: text += f", {stats['gain_pct']:+g}% batches/hour"
+        return text + "."
+
     def _build_system_settings_tab(self, sys_tab):
         for w in sys_tab.winfo_children(): w.destroy()
         self._root_var = tk.StringVar(value=self.CONFIG["ROOT"])
@@ -1613,8 +680,7 @@ class App(tk.Tk):
         # self.CONFIG["MACHINE"]["open_door_on_complete"] = bool(self._open_door_var.get())
         if self.save_config():
             messagebox.showinfo("Saved", "System settings saved.", parent=sys_tab)
-            self.DIRS, self.LB_BATCH, self.WORKING_BATCH, self.WORKING_COMPLETED_TODAY = self.derive_paths(); self.ensure_dirs()
-            
+
     def _build_lightburn_settings_tab(self, lb_tab):
         for w in lb_tab.winfo_children(): w.destroy()
         self._lb_exe_var = tk.StringVar(value=self.CONFIG["LIGHTBURN"].get("exe_path",""))
@@ -1622,6 +688,11 @@ class App(tk.Tk):
         self._lb_post_delay = tk.IntVar(value=int(self.CONFIG["LIGHTBURN"].get("post_open_delay_sec",3)))
         # --- ADDED: Variable for the new checkbox ---
         self._lb_close_on_complete_var = tk.BooleanVar(value=self.CONFIG["LIGHTBURN"].get("close_on_complete", False))
+        self._lb_control_var = tk.StringVar(value=self.CONFIG["LIGHTBURN"].get("control", "window"))
+        self._lb_udp_start_var = tk.BooleanVar(value=self.CONFIG["LIGHTBURN"].get("udp_start", False))
+        self._lb_project_mode_var = tk.StringVar(value=self.CONFIG["LIGHTBURN"].get("project_mode", "csv"))
+        self._lb_token_var = tk.StringVar(value=self.CONFIG["LIGHTBURN"].get("template_token", "{CODE}"))
+        self._lb_position_var = tk.BooleanVar(value=self.CONFIG["LIGHTBURN"].get("enable_positioning", False))
 
         ttk.Label(lb_tab, text="LightBurn EXE (optional):").grid(row=0, column=0, sticky="e")
         ttk.Entry(lb_tab, textvariable=self._lb_exe_var, width=70).grid(row=0, column=1, sticky="w", padx=6)
@@ -1631,8 +702,16 @@ class App(tk.Tk):
         
         # --- ADDED: New checkbox widget ---
         ttk.Checkbutton(lb_tab, text="Close LightBurn when job is finished", variable=self._lb_close_on_complete_var).grid(row=2, column=1, sticky="w", pady=4)
+        ttk.Label(lb_tab, text="Control:").grid(row=3, column=0, sticky="e")
+        ttk.Combobox(lb_tab, textvariable=self._lb_control_var, width=10, values=["window", "udp"], state="readonly").grid(row=3, column=1, sticky="w", padx=6)
+        ttk.Checkbutton(lb_tab, text="Send START over UDP (Start relay is the fallback)", variable=self._lb_udp_start_var).grid(row=4, column=1, sticky="w", pady=4)
+        ttk.Label(lb_tab, text="Codes via:").grid(row=5, column=0, sticky="e")
+        ttk.Combobox(lb_tab, textvariable=self._lb_project_mode_var, width=10, values=["csv", "template"], state="readonly").grid(row=5, column=1, sticky="w", padx=6)
+        ttk.Label(lb_tab, text="Template token:").grid(row=6, column=0, sticky="e")
+        ttk.Entry(lb_tab, textvariable=self._lb_token_var, width=12).grid(row=6, column=1, sticky="w", padx=6)
+        ttk.Checkbutton(lb_tab, text="Move the LightBurn window to the bottom-right corner", variable=self._lb_position_var).grid(row=7, column=1, sticky="w", pady=4)
         
-        ttk.Button(lb_tab, text="Save", command=lambda: self._save_lightburn_settings(lb_tab)).grid(row=3, column=1, sticky="e", pady=10)
+        ttk.Button(lb_tab, text="Save", command=lambda: self._save_lightburn_settings(lb_tab)).grid(row=8, column=1, sticky="e", pady=10)
 
     def _save_lightburn_settings(self, lb_tab):
         self.CONFIG["LIGHTBURN"]["exe_path"] = self._lb_exe_var.get().strip()
@@ -1640,6 +719,11 @@ class App(tk.Tk):
         self.CONFIG["LIGHTBURN"]["post_open_delay_sec"] = int(self._lb_post_delay.get())
         # --- ADDED: Save the new setting ---
         self.CONFIG["LIGHTBURN"]["close_on_complete"] = bool(self._lb_close_on_complete_var.get())
+        self.CONFIG["LIGHTBURN"]["control"] = self._lb_control_var.get() or "window"
+        self.CONFIG["LIGHTBURN"]["udp_start"] = bool(self._lb_udp_start_var.get())
+        self.CONFIG["LIGHTBURN"]["project_mode"] = self._lb_project_mode_var.get() or "csv"
+        self.CONFIG["LIGHTBURN"]["enable_positioning"] = bool(self._lb_position_var.get())
+        self.CONFIG["LIGHTBURN"]["template_token"] = self._lb_token_var.get().strip() or "{CODE}"
         
         if self.save_config():
             messagebox.showinfo("Saved", "LightBurn settings saved.", parent=lb_tab)
@@ -1683,14 +767,6 @@ class App(tk.Tk):
         
         if self.save_config():
             messagebox.showinfo("Saved", "Serial and Simulate settings saved.", parent=ser_tab)
-            if self.CONFIG["SIMULATE"]["enabled"]:
-                self.update_conn_pill("SIMULATE", warn=True)
-            elif self.CONFIG["SERIAL"]["enabled"]:
-                self.serial.enabled = True
-                self.serial.baud = self.CONFIG["SERIAL"]["baud"]
-            else:
-                self.serial.enabled = False; self.update_conn_pill("Disabled", warn=True)
-            self.update_af_button_state()
 
     def update_af_button_state(self):
         if hasattr(self, 'af_btn'):
@@ -1745,6 +821,35 @@ class App(tk.Tk):
             ttk.Entry(main_frame, textvariable=pinv, width=8).grid(row=row, column=3, sticky="w", padx=6)
             self._input_vars.append((nv, pinv))
             row += 1
+        ttk.Button(main_frame, text="Add Input", command=lambda: self._add_input(io_tab, parent_window)).grid(row=row, column=1, sticky="w", pady=(4,0))
+        row += 1
+        ttk.Separator(main_frame, orient="horizontal").grid(row=row, column=0, columnspan=10, sticky="ew", pady=12)
+        row += 1
+        ttk.Label(main_frame, text="Input Roles (input numbers)", font=("Segoe UI", 10, "bold")).grid(row=row, column=0, columnspan=2, sticky="w", pady=(0,6))
+        row += 1
+        select, door, spares = self.CC.select_inputs, self.CC.door_input, self.CC.spare_inputs
+        self._io_select_var = tk.StringVar(value=",".join(str(i+1) for i in select))
+        self._io_door_var = tk.StringVar(value="" if door is None else str(door+1))
+        self._io_spare_var = tk.StringVar(value=",".join(str(i+1) for i in spares))
+        self._io_encoding_var = tk.StringVar(value=self.CONFIG.get("IO_MAP", {}).get("encoding", "pattern"))
+        busy = self.CONFIG.get("IO_MAP", {}).get("busy_input")
+        self._io_busy_var = tk.StringVar(value="" if busy is None else str(busy+1))
+        self._io_done_var = tk.StringVar(value=self.CONFIG.get("JOB_DONE", {}).get("source", "timer"))
+        ttk.Label(main_frame, text="Job Select (MSB first)").grid(row=row, column=0, sticky="e")
+        ttk.Entry(main_frame, textvariable=self._io_select_var, width=22).grid(row=row, column=1, sticky="w", padx=6)
+        ttk.Label(main_frame, text="Encoding").grid(row=row, column=2, sticky="e")
+        ttk.Combobox(main_frame, textvariable=self._io_encoding_var, width=10, values=["pattern", "binary"], state="readonly").grid(row=row, column=3, columnspan=2, sticky="w", padx=6)
+        row += 1
+        ttk.Label(main_frame, text="Door").grid(row=row, column=0, sticky="e")
+        ttk.Entry(main_frame, textvariable=self._io_door_var, width=8).grid(row=row, column=1, sticky="w", padx=6)
+        ttk.Label(main_frame, text="Spares").grid(row=row, column=2, sticky="e")
+        ttk.Entry(main_frame, textvariable=self._io_spare_var, width=22).grid(row=row, column=3, columnspan=3, sticky="w", padx=6)
+        row += 1
+        ttk.Label(main_frame, text="Laser Busy").grid(row=row, column=0, sticky="e")
+        ttk.Entry(main_frame, textvariable=self._io_busy_var, width=8).grid(row=row, column=1, sticky="w", padx=6)
+        ttk.Label(main_frame, text="Job Done By").grid(row=row, column=2, sticky="e")
+        ttk.Combobox(main_frame, textvariable=self._io_done_var, width=10, values=["timer", "serial", "input"], state="readonly").grid(row=row, column=3, columnspan=2, sticky="w", padx=6)
+        row += 1
         ttk.Separator(main_frame, orient="horizontal").grid(row=row, column=0, columnspan=10, sticky="ew", pady=12)
         row += 1
         status_frame = ttk.LabelFrame(main_frame, text="Live Input Status", padding=10)
@@ -1764,19 +869,49 @@ class App(tk.Tk):
         parent_window.bind("<Destroy>", self._stop_io_status_updates, add="+")
         self._start_io_status_updates()
 
+    def _add_input(self, io_tab, parent_window):
+        n = len(self.CONFIG["INPUTS"]["names"])
+        self.CONFIG["INPUTS"]["names"].append(f"Input {n+1}")
+        self.CONFIG["INPUTS"]["pins"].append(0)
+        self.input_state.append(1)
+        self._build_io_settings_tab(io_tab, parent_window)
+
     def _toggle_relay_disable(self, index, var):
         self.CONFIG["RELAYS"]["disabled"][index] = var.get()
+        self.save_config(persist=False)
 
     def _save_io_settings(self, io_tab):
+        def _indices(text):
+            return [int(p) - 1 for p in text.replace(" ", "").split(",") if p]
+        try:
+            door = _indices(self._io_door_var.get())
+            busy = _indices(self._io_busy_var.get())
+            io_map = {
+                "job_select_inputs": _indices(self._io_select_var.get()),
+                "door_input": door[0] if door else None,
+                "spare_inputs": _indices(self._io_spare_var.get()),
+                "busy_input": busy[0] if busy else None,
+                "encoding": self._io_encoding_var.get() or "pattern"
+            }
+        except ValueError:
+            messagebox.showerror("I/O Roles", "Input roles must be comma-separated input numbers.", parent=io_tab)
+            return
+        job_done = dict(self.CONFIG.get("JOB_DONE", {}), source=self._io_done_var.get() or "timer")
+        _, errors = build_job_select_table(dict(self.CONFIG, IO_MAP=io_map, JOB_DONE=job_done))
+        if errors:
+            messagebox.showerror("I/O Roles", "I/O settings not saved:\n\n" + "\n".join(errors), parent=io_tab)
+            return
         self.CONFIG["RELAYS"]["names"] = [v[0].get().strip() for v in self._relay_vars]
         self.CONFIG["RELAYS"]["modes"] = [v[1].get() for v in self._relay_vars]
         self.CONFIG["RELAYS"]["pulse_ms"] = [int(v[2].get()) for v in self._relay_vars]
         self.CONFIG["RELAYS"]["pins"] = [int(v[3].get()) for v in self._relay_vars]
         self.CONFIG["INPUTS"]["names"] = [v[0].get().strip() for v in self._input_vars]
         self.CONFIG["INPUTS"]["pins"] = [int(v[1].get()) for v in self._input_vars]
+        self.CONFIG["IO_MAP"] = io_map
+        self.CONFIG["JOB_DONE"] = job_done
 
         if self.save_config():
-            messagebox.showinfo("Saved", "I/O settings saved. Restart GUI for pin changes to take full effect.", parent=io_tab)
+            messagebox.showinfo("Saved", "I/O settings saved. Pin numbers must also match the ESP32 firmware.", parent=io_tab)
 
     def _build_paths_settings_tab(self, paths_tab):
         for w in paths_tab.winfo_children(): w.destroy()
@@ -1810,6 +945,25 @@ class App(tk.Tk):
 
         ttk.Button(paths_tab, text="Save", command=lambda: self._save_paths_settings(paths_tab)).grid(row=8, column=1, sticky="e", pady=10)
 
+        ttk.Separator(paths_tab, orient="horizontal").grid(row=9, column=0, columnspan=3, sticky="ew", pady=10)
+        today = datetime.now().strftime("%Y-%m-%d")
+        self._export_from_var = tk.StringVar(value=today)
+        self._export_to_var = tk.StringVar(value=today)
+        self._export_hist_var = tk.BooleanVar(value=False)
+        ttk.Label(paths_tab, text="Export Completed (YYYY-MM-DD):").grid(row=10, column=0, sticky="e")
+        export_row = ttk.Frame(paths_tab); export_row.grid(row=10, column=1, sticky="w", padx=6)
+        ttk.Entry(export_row, textvariable=self._export_from_var, width=12).pack(side="left")
+        ttk.Label(export_row, text=" to ").pack(side="left")
+        ttk.Entry(export_row, textvariable=self._export_to_var, width=12).pack(side="left")
+        ttk.Checkbutton(export_row, text="From history file", variable=self._export_hist_var).pack(side="left", padx=8)
+        ttk.Button(paths_tab, text="Export…", command=self._export_completed).grid(row=10, column=2, sticky="w")
+
+    def _export_completed(self):
+        path = filedialog.asksaveasfilename(title="Export Completed", defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        if not path: return
+        self.engine.submit("export_completed", start=self._export_from_var.get().strip(),
+                           end=self._export_to_var.get().strip(), path=path, history=bool(self._export_hist_var.get()))
+
     def _save_paths_settings(self, paths_tab):
         self.CONFIG.setdefault("HISTORY", {})
         self.CONFIG["HISTORY"]["enabled"] = bool(self._hist_en_var.get())
@@ -1821,170 +975,12 @@ class App(tk.Tk):
 
         self.CONFIG.setdefault("AUTOFOCUS", {})
         self.CONFIG["AUTOFOCUS"]["enabled"] = not bool(self._af_disabled_var.get())
-        self.af_enabled = self.CONFIG["AUTOFOCUS"]["enabled"]
 
         self.CONFIG.setdefault("UI", {})
         self.CONFIG["UI"]["show_autofocus_btn"] = bool(self._show_af_btn_var.get())
 
         if self.save_config():
             messagebox.showinfo("Saved", "File Paths & UI settings saved.", parent=paths_tab)
-            self.DIRS, self.LB_BATCH, self.WORKING_BATCH, self.WORKING_COMPLETED_TODAY = self.derive_paths()
-            self.update_af_button_state()
-            self.update_visibility_from_settings()
-
-    def _test_relay(self, index):
-        name = self.CONFIG["RELAYS"]["names"][index]
-        mode = self.CONFIG["RELAYS"]["modes"][index]
-
-        if self.CONFIG["RELAYS"]["disabled"][index]:
-            self.status_var.set(f"Warning: {name} is disabled in settings.")
-            return
-
-        if self.CONFIG["SIMULATE"]["enabled"]:
-            if mode == "pulse":
-                ms = int(self.CONFIG["RELAYS"]["pulse_ms"][index])
-                self.pulse_relay_by_name(name, ms)
-                self.status_var.set(f"Simulating {name}: Pulse for {ms}ms.")
-            elif mode == "switch":
-                current_state = self.relay_state[index]
-                new_state = 1 - current_state
-                self.set_relay_by_name(name, new_state)
-                self.status_var.set(f"Simulating {name}: Toggled to {'ON' if new_state else 'OFF'}.")
-        else:
-            if mode == "pulse":
-                ms = int(self.CONFIG["RELAYS"]["pulse_ms"][index])
-                ok = self.serial.pulse(index, ms)
-                self.status_var.set(f"Testing {name}: Sent PULSE {index} {ms}." if ok else f"Failed to send PULSE to {name}.")
-            elif mode == "switch":
-                current_state = self.relay_state[index]
-                new_state = 1 - current_state
-                ok = self.serial.relay_set(index, new_state)
-                if ok:
-                    self.relay_state[index] = new_state
-                self.status_var.set(f"Testing {name}: Sent RSET {index} {new_state}." if ok else f"Failed to send RSET to {name}.")
-
-    def poll_serial(self):
-        if self.CONFIG["SERIAL"]["enabled"] and not self.CONFIG["SIMULATE"]["enabled"]:
-            line = self.serial.readline()
-            if line: self.on_serial_line(line)
-        self.after(self.CONFIG["SERIAL"]["poll_ms"], self.poll_serial)
-
-    def sim_toggle_relay(self, i):
-        ms = int(self.CONFIG["RELAYS"]["pulse_ms"][i])
-        name = self.CONFIG["RELAYS"]["names"][i]
-
-        if self.CONFIG["RELAYS"]["disabled"][i]:
-            self.status_var.set(f"Warning: {name} is disabled in settings.")
-            return
-
-        if self.CONFIG["SIMULATE"]["enabled"]:
-            if ms > 0:
-                self.relay_state[i] = 1
-                self.after(ms, lambda: self._sim_relay_off_after_pulse(i))
-                self.status_var.set(f"Simulated pulse on {name} for {ms}ms")
-            else:
-                self.relay_state[i] = 1 - self.relay_state[i]
-                self.status_var.set(f"Simulated toggle on {name} to {'ON' if self.relay_state[i] else 'OFF'}")
-        else:
-            if ms > 0:
-                ok = self.serial.pulse(i, ms)
-            else:
-                ok = self.serial.relay_toggle(i)
-            self.status_var.set(f"Sent {'pulse' if ms>0 else 'toggle'} to {name}." if ok else f"Failed to send to {name}.")
-
-    def _sim_relay_off_after_pulse(self, i):
-        self.relay_state[i] = 0
-
-    def sim_set_input(self, i, value):
-        name = self.CONFIG["INPUTS"]["names"][i]
-        self.input_override[i] = value
-        val = 1 if value else 0
-        self.input_state[i] = val
-        nl = name.lower()
-        if "door" in nl or "sensor" in nl:
-            self.door_closed = bool(val)
-            self.update_door_ui()
-
-        self._maybe_select_job_from_input_pattern()
-
-        if self.CONFIG["SIMULATE"]["enabled"]:
-            self.status_var.set(f"Simulated {name} to {'ON' if value else 'OFF'}")
-        else:
-            ok = self.serial.sim_input(i, val)
-            self.status_var.set(f"Sent sim input to {name}." if ok else f"Failed to send sim input to {name}.")
-
-    def _watch_date_rollover(self):
-        try:
-            if self.CONFIG.get("LAST_DATE_CODE") != today_code():
-                self.filter_completed_today_old_dates()
-                self.CONFIG["LAST_DATE_CODE"] = today_code()
-                self.save_config()
-                self.date_var.set(today_code())
-                self.refresh_next_serial_label()
-        finally:
-            self.after(30_000, self._watch_date_rollover)
-
-    def _get_current_input_pattern(self):
-        pattern = ""
-        for i in range(3):
-            try:
-                state = self.input_state[i]
-                pattern += str(1 - state)
-            except IndexError:
-                self.status_var.set("Error: At least 3 inputs must be configured for job selection.")
-                return None
-        return pattern
-
-    def _check_for_job_select_on_start(self):
-        self._maybe_select_job_from_input_pattern()
-        self.after(200, self._check_for_job_select_on_start)
-
-    def _maybe_select_job_from_input_pattern(self):
-        current_pattern = self._get_current_input_pattern()
-        current_time = int(time.time() * 1000)
-
-        if current_pattern != self.last_job_pattern:
-            self.last_stable_job_time = current_time
-            self.last_job_pattern = current_pattern
-            return
-
-        if current_time - self.last_stable_job_time < self.job_cooldown_ms:
-            return
-
-        if current_pattern is None or current_pattern == "000":
-            if self.selected_job.get():
-                self.selected_job.set("")
-                self.part_var.set("")
-                self.rev_var.set("")
-                self.ver_var.set("")
-                self.cav_var.set("")
-                self.mach_var.set("")
-                self.date_var.set("")
-                self.next_var.set("")
-                self.batch_var.set("")
-                self.upnext_list.delete(0, tk.END)
-                self.left_hdr.config(text="Up Next (Preview / Current Batch) [0]")
-                self.write_lightburn_batch([])
-                self.status_var.set("Idle. Waiting for job sensor input.")
-            self._apply_job_visibility_for_pin_selection(active_key=None)
-            return
-
-        found_key = None
-        for key, jcfg in self.CONFIG["JOBS"].items():
-            sp = jcfg.get("select_pattern")
-            if sp == current_pattern:
-                found_key = key
-                break
-
-        if found_key:
-            if self.selected_job.get() != found_key:
-                self.on_job_clicked(found_key)
-            self._apply_job_visibility_for_pin_selection(active_key=found_key)
-        else:
-            if self.selected_job.get() != "":
-                self.selected_job.set("")
-                self.status_var.set(f"Warning: Input pattern '{current_pattern}' does not match any configured job. Cleared job selection.")
-            self._apply_job_visibility_for_pin_selection(active_key=None)
 
     def _apply_job_visibility_for_pin_selection(self, active_key=None):
         for btn in self.job_btns.values():
@@ -1996,134 +992,11 @@ class App(tk.Tk):
                 self.job_btns[active_key].grid()
             except Exception: pass
 
-        if active_key:
-            self.jobs_frame.config(text=f"Active Job: {self.CONFIG['JOBS'][active_key]['display_name']}")
+        if active_key and active_key in self.CC.jobs:
+            self.jobs_frame.config(text=f"Active Job: {self.CC.jobs[active_key].display_name}")
         else:
             self.jobs_frame.config(text="Active Job: (None Selected)")
 
-    def set_relay_by_name(self, name, val):
-        try:
-            i = self.CONFIG["RELAYS"]["names"].index(name)
-
-            if self.CONFIG["RELAYS"]["disabled"][i]: return
-
-            if self.CONFIG["SIMULATE"]["enabled"]:
-                self.relay_state[i] = val
-            else:
-                ok = self.serial.relay_set(i, val)
-                if ok:
-                    self.relay_state[i] = val
-        except ValueError:
-            pass
-
-    def pulse_relay_by_name(self, name, ms):
-        try:
-            i = self.CONFIG["RELAYS"]["names"].index(name)
-
-            if self.CONFIG["RELAYS"]["disabled"][i]: return
-
-            if self.CONFIG["SIMULATE"]["enabled"]:
-                self.relay_state[i] = 1
-                self.after(ms, lambda: self._sim_relay_off_after_pulse(i))
-            else:
-                ok = self.serial.pulse(i, ms)
-                if ok:
-                    self.relay_state[i] = 1
-        except ValueError:
-            pass
-
-class SerialHelper:
-    def __init__(self, cfg, status_cb, line_cb, master):
-        self.enabled = bool(cfg.get("enabled", False))
-        self.baud = int(cfg.get("baud", 115200))
-        self._status_cb = status_cb; self._line_cb = line_cb
-        self.ser = None
-        self.master = master
-
-    def _update_status(self, text, ok=False, warn=False):
-        if self._status_cb: self._status_cb(text, ok=ok, warn=warn)
-
-    def try_open_manual(self, port_name):
-        self.close()
-
-        if not self.enabled:
-            self._update_status("Disabled (in Settings)", warn=True)
-            return False
-
-        try:
-            self.ser = serial.Serial(port_name, self.baud, timeout=2)
-
-            print(f"Connecting to {port_name}. Waiting for ESP32 initialization...")
-            time.sleep(2)
-
-            self.ser.reset_input_buffer()
-
-            if self.ser.is_open:
-                print("Performing handshake...")
-                self.ser.write(b'PING\n')
-                response = self.ser.readline().decode('utf-8').strip()
-                print(f"Handshake response: '{response}'")
-
-                if response == "READY":
-                    print("✅ Handshake successful!")
-                    self._update_status(f"Connected ({port_name})", ok=True)
-                    return True
-                else:
-                    print("❌ Handshake failed.")
-                    messagebox.showerror(
-                        "Handshake Error",
-                        f"The device on {port_name} did not respond correctly.\n\n"
-                        f"Expected 'READY', but received '{response}'.\n\n"
-                        "Please check the board and its firmware."
-                    )
-                    self.close()
-                    return False
-            return False
-
-        except Exception as e:
-            self.ser = None
-            self._update_status("Disconnected", warn=False)
-            messagebox.showerror("Serial Connection Error", f"Could not open serial port {port_name}: {e}")
-            return False
-
-    def close(self):
-        try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()
-                self.ser = None
-        except Exception: pass
-        self._update_status("Disconnected", warn=True)
-
-    def _write(self, data: bytes):
-        try:
-            if self.ser and self.ser.is_open:
-                self.ser.write(data);
-                return True
-            else:
-                self._update_status("Not Connected", warn=False)
-                return False
-        except Exception:
-            self.close()
-            return False
-
-    def get_all_states(self): return self._write(b"GETSTATE\n")
-    def relay_set(self, i, v): return self._write(f"RSET {int(i)} {1 if v else 0}\n".encode())
-    def relay_toggle(self, i): return self._write(f"RTGL {int(i)}\n".encode())
-    def pulse(self, i, ms): return self._write(f"PULSE {int(i)} {int(ms)}\n".encode())
-    def sim_input(self, i, v): return self._write(f"SIMI {int(i)} {1 if v else 0}\n".encode())
-
-    def readline(self):
-        if not self.enabled or not self.ser or not self.ser.is_open: return ""
-        try:
-            line = self.ser.readline().decode(errors="ignore").strip()
-            if line and self._line_cb: self._line_cb(line)
-            return line
-        except serial.SerialException:
-            self.close()
-            return ""
-        except Exception:
-            return ""
-
 if __name__ == "__main__":
     try:
         try:
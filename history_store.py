@@ -0,0 +1,196 @@
+"""All_Jobs_History split into monthly partitions.
+
+For a configured history path LOGS/All_Jobs_History.csv the partitions are
+LOGS/All_Jobs_History_<YYYY-MM>.csv, and LOGS/All_Jobs_History.manifest.json
+records, per partition, its first and last DateTime, row count and size:
+
+  {"partitions": {"2026-10": {"file": "All_Jobs_History_2026-10.csv", "first": "2026-10-01 06:02:11",
+                              "last": "2026-10-19 14:40:03", "rows": 1834, "bytes": 96311}},
+   "legacy": {...}}
+
+A single-file history from before partitioning stays where it is and is
+listed as "legacy". Range queries open only the partitions whose time range
+overlaps the query. A partition may be gzipped to .csv.gz once its month is
+over; readers pick up whichever form exists. An entry whose size no longer
+matches its file (a crash between append and manifest write, compression,
+a restored backup) is recounted from the file on next load.
+
+Use history_store(path) for the one store per history in this process: the
+engine, exports and retention then share its lock and manifest. The first
+manifest() scans files without holding that lock, so an append made
+meanwhile only writes its rows and the load recounts that partition.
+"""
+import csv, glob, gzip, json, os, threading
+from datetime import datetime
+
+HISTORY_FIELDS = ["DateTime", "PartNumber", "Serial Number", "JobName", "Result"]
+
+def _open(path):
+    if path.lower().endswith(".gz"): return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, "r", newline="", encoding="utf-8")
+
+def _month_index(month):
+    y, m = month.split("-")
+    return int(y) * 12 + int(m) - 1
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def history_store(path):
+    """The shared HistoryStore for path."""
+    key = os.path.normcase(os.path.abspath(path))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None: store = _stores[key] = HistoryStore(path)
+        return store
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.folder, name = os.path.split(path)
+        self.stem = os.path.splitext(name)[0]
+        self.manifest_path = os.path.join(self.folder, self.stem + ".manifest.json")
+        self._manifest = None
+        self._lock = threading.Lock()  # the manifest and appends
+        self._load_lock = threading.Lock()  # one load at a time
+
+    def partition_path(self, month):
+        return os.path.join(self.folder, f"{self.stem}_{month}.csv")
+
+    def _resolve(self, path):
+        """The file as it exists now: path, or path.gz once compressed. None if neither exists."""
+        if os.path.exists(path + ".gz"): return path + ".gz"
+        return path if os.path.exists(path) else None
+
+    # ---------- Manifest ----------
+    def _scan(self, path):
+        entry = {"file": os.path.basename(path), "first": "", "last": "", "rows": 0, "bytes": 0}
+        found = self._resolve(path)
+        if not found: return entry
+        entry["bytes"] = os.path.getsize(found)  # before reading: rows appended meanwhile show as a mismatch
+        with _open(found) as fh:
+            for row in csv.DictReader(fh):
+                t = row.get("DateTime") or ""
+                if not entry["first"] or t < entry["first"]: entry["first"] = t
+                if t > entry["last"]: entry["last"] = t
+                entry["rows"] += 1
+        return entry
+
+    def _on_disk(self):
+        months = set()
+        for p in glob.glob(os.path.join(self.folder, self.stem + "_????-??.csv*")):
+            if p.endswith((".csv", ".csv.gz")): months.add(os.path.basename(p)[len(self.stem) + 1:][:7])
+        return months
+
+    def _recount(self, parts, months):
+        """Brings the entries for months in line with their files. Returns True if any changed."""
+        changed = False
+        for month in sorted(months):
+            found = self._resolve(self.partition_path(month))
+            if not found:
+                if parts.pop(month, None) is not None: changed = True
+            elif parts.get(month, {}).get("bytes") != os.path.getsize(found):
+                parts[month] = self._scan(self.partition_path(month)); changed = True
+        return changed
+
+    def _build(self):
+        """Reads the saved manifest and recounts what no longer matches the files. Returns (manifest, changed)."""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f: m = json.load(f)
+        except (OSError, ValueError):
+            m = {}
+        parts = m.get("partitions") if isinstance(m.get("partitions"), dict) else {}
+        changed = self._recount(parts, self._on_disk() | set(parts))
+        legacy = m.get("legacy")
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            if not legacy or legacy.get("bytes") != os.path.getsize(self.path):
+                legacy = self._scan(self.path); changed = True
+        elif legacy:
+            legacy = None; changed = True
+        return {"partitions": parts, "legacy": legacy}, changed
+
+    def _load(self):
+        """Loads the manifest unless it is loaded. The scans run without _lock, so appends go on."""
+        with self._load_lock:
+            with self._lock:
+                if self._manifest is not None: return
+            m, changed = self._build()
+            with self._lock:
+                # Partitions appended to while the scan ran are recounted (usually just this month's).
+                changed = self._recount(m["partitions"], self._on_disk() | set(m["partitions"])) or changed
+                m["partitions"] = dict(sorted(m["partitions"].items()))
+                self._manifest = m
+                if changed:
+                    try: self._save()
+                    except OSError as e: print(f"[HISTORY] Could not save {os.path.basename(self.manifest_path)}: {e}")
+
+    def _save(self):
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"  # another process (log_reader) may save too
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=1)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+
+    def manifest(self):
+        self._load()
+        with self._lock: return json.loads(json.dumps(self._manifest))
+
+    # ---------- Writing ----------
+    def append(self, rows):
+        """Appends rows (dicts with HISTORY_FIELDS) to the partition of their DateTime month."""
+        by_month = {}
+        for r in rows: by_month.setdefault(r["DateTime"][:7], []).append(r)
+        with self._lock:
+            loaded = self._manifest is not None  # if not, the load counts these rows from the files
+            for month, month_rows in sorted(by_month.items()):
+                path = self.partition_path(month)
+                if os.path.exists(path + ".gz"):
+                    raise OSError(f"{os.path.basename(path)} is already compressed; not appending to a closed month.")
+                os.makedirs(self.folder or ".", exist_ok=True)
+                with open(path, "a", newline="", encoding="utf-8") as fh:
+                    w = csv.DictWriter(fh, fieldnames=HISTORY_FIELDS)
+                    if fh.tell() == 0: w.writeheader()
+                    w.writerows(month_rows)
+                if not loaded: continue
+                entry = self._manifest["partitions"].setdefault(month, {"file": os.path.basename(path), "first": "", "last": "", "rows": 0})
+                times = [r["DateTime"] for r in month_rows]
+                entry["first"] = min([t for t in (entry["first"], *times) if t])
+                entry["last"] = max([entry["last"], *times])
+                entry["rows"] += len(month_rows)
+                entry["bytes"] = os.path.getsize(path)
+            if not loaded: return
+            self._manifest["partitions"] = dict(sorted(self._manifest["partitions"].items()))
+            self._save()
+
+    # ---------- Reading ----------
+    def files(self, start=None, end=None):
+        """The history files overlapping start..end (dates, inclusive; None is open-ended), oldest first."""
+        lo = start.isoformat() if start else ""
+        hi = (end.isoformat() if end else "9999") + "\uffff"
+        m = self.manifest()
+        entries = ([(self.path, m["legacy"])] if m["legacy"] else []) + \
+                  [(self.partition_path(month), e) for month, e in m["partitions"].items()]
+        out = []
+        for path, e in entries:
+            if e["rows"] and (e["last"] < lo or e["first"] > hi): continue
+            found = self._resolve(path)
+            if found: out.append(found)
+        return out
+
+    def iter_rows(self, start=None, end=None):
+        lo = start.isoformat() if start else ""
+        hi = end.isoformat() if end else "9999"
+        for path in self.files(start, end):
+            try: fh = _open(path)
+            except FileNotFoundError:
+                if not os.path.exists(path + ".gz"): continue
+                fh = _open(path + ".gz")  # compressed since it was listed
+            with fh:
+                for row in csv.DictReader(fh):
+                    if lo <= (row.get("DateTime") or "")[:10] <= hi: yield row
+
+    def closed_partitions(self, keep_months):
+        """Plain-CSV partitions at least keep_months months older than the current one, for compression."""
+        now = _month_index(datetime.now().strftime("%Y-%m"))
+        return [self.partition_path(month) for month in self.manifest()["partitions"]
+                if now - _month_index(month) >= max(1, keep_months) and os.path.exists(self.partition_path(month))]
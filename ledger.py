@@ -0,0 +1,186 @@
+"""Append-only engraving ledger, and the CSV views derived from it.
+
+With LOGGING.store "ledger", planned and completed items are written once,
+to LOGS/<year>/<yymmdd>/Ledger.csv (columns LEDGER_FIELDS; Kind is "planned"
+or "completed"). That append is the only log write per item.
+
+The other files become views of the ledger:
+  daily Completed*.csv  not written; log_reader reads completed rows from the ledger
+  All_Jobs_History      appended by LedgerViews on a background thread (it outlives the
+                        day folders, so it is always kept)
+  Completed_Today.csv   kept live by LedgerViews, or written on demand by materialize_today()
+
+LedgerViews records how far it has read as a day and byte offset in
+LOGS/Ledger.views.json and reads only complete lines, so a view is never
+more than one catch-up behind and a restart resumes where it stopped.
+"""
+import csv, io, json, os, threading, time
+from datetime import date, datetime, timedelta
+from log_reader import COMPLETED_FIELDS, LEDGER_FIELDS, day_folder, iter_file
+
+def ledger_path(logs_dir, day):
+    return os.path.join(day_folder(logs_dir, day), "Ledger.csv")
+
+def completed_view_row(row):
+    out = {k: row.get(k, "") for k in COMPLETED_FIELDS}
+    out["Time"] = (row.get("DateTime") or "")[11:]
+    return out
+
+def history_view_row(row):
+    return {"DateTime": row.get("DateTime", ""), "PartNumber": row.get("PartNumber", ""),
+            "Serial Number": row.get("Serial Number", ""), "JobName": row.get("JobName", ""), "Result": row.get("Result", "")}
+
+def _write_csv_atomic(path, fields, rows):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as fh:
+        w = csv.DictWriter(fh, fieldnames=fields)
+        w.writeheader(); w.writerows(rows)
+        fh.flush(); os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+def materialize_today(logs_dir, path):
+    """Rewrites path (Completed_Today.csv) from today's ledger. Returns the number of rows."""
+    rows = [completed_view_row(r) for r in iter_file(ledger_path(logs_dir, date.today()))
+            if r.get("Kind") == "completed"]
+    _write_csv_atomic(path, COMPLETED_FIELDS, rows)
+    return len(rows)
+
+
+class Ledger:
+    def __init__(self, logs_dir):
+        self.logs_dir = logs_dir
+
+    def append(self, kind, rows, result="", day=None):
+        """Appends batch rows (BATCH_FIELDS dicts) to day's ledger (default today) as one write + fsync."""
+        now = datetime.now()
+        path = ledger_path(self.logs_dir, day or now.date())
+        stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        if not os.path.exists(path) or os.path.getsize(path) == 0: w.writerow(LEDGER_FIELDS)
+        for r in rows:
+            w.writerow([kind, stamp, r.get("JobID", ""), r.get("JobName", ""), r.get("PartNumber", ""),
+                        r.get("Revision", ""), r.get("Version", ""), r.get("Cavity", ""), r.get("Machine", ""),
+                        r.get("DateCode", ""), r.get("Serial5", ""), r.get("FullCode", ""), result])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", newline="", encoding="utf-8") as fh:
+            fh.write(buf.getvalue())
+            fh.flush(); os.fsync(fh.fileno())
+
+
+class LedgerViews:
+    """Keeps the views derived from the ledger up to date on a background thread.
+
+    history_sink(rows) receives new completed items as history rows. If today_path
+    is set, Completed_Today.csv there is kept live too (rebuilt when the day changes).
+    poke() after each ledger append; passes are debounced by debounce_ms.
+    """
+    def __init__(self, logs_dir, history_sink, today_path=None, debounce_ms=500):
+        self.logs_dir = logs_dir
+        self.history_sink = history_sink
+        self.today_path = today_path
+        self.debounce_s = debounce_ms / 1000.0
+        self.state_path = os.path.join(logs_dir, "Ledger.views.json")
+        self.passes = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="LedgerViews", daemon=True)
+        self._thread.start()
+
+    def poke(self): self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def _run(self):
+        self._pass()
+        while True:
+            self._wake.wait()
+            if self._stopped: return
+            time.sleep(self.debounce_s)
+            self._wake.clear()
+            self._pass()
+
+    def _pass(self):
+        try: self.catch_up()
+        except (OSError, ValueError, csv.Error) as e: print(f"[LEDGER] Could not update views: {e}")
+        self.passes += 1
+
+    # ---------- State ----------
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f: state = json.load(f)
+            date.fromisoformat(state["day"]); int(state["offset"])
+            return state
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_state(self, state):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+
+    # ---------- Reading ----------
+    @staticmethod
+    def _parse(data):
+        return [dict(zip(LEDGER_FIELDS, rec)) for rec in csv.reader(io.StringIO(data.decode("utf-8")))
+                if rec and rec != LEDGER_FIELDS]
+
+    def _read_from(self, path, offset):
+        """Returns (rows, new_offset): the complete ledger lines of path after byte offset."""
+        if not os.path.exists(path): return [], offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        cut = data.rfind(b"\n") + 1
+        return self._parse(data[:cut]), offset + cut
+
+    def catch_up(self):
+        today = date.today()
+        state = self._load_state()
+        if state is None:
+            # No record of what the views hold: assume history is current and rebuild today's view.
+            state = {"day": today.isoformat(), "offset": 0, "view_day": ""}
+            path = ledger_path(self.logs_dir, today)
+            state["offset"] = os.path.getsize(path) if os.path.exists(path) else 0
+            print("[LEDGER] No view state; history is assumed current up to now.")
+        day, offset = date.fromisoformat(state["day"]), int(state["offset"])
+        tail = state.get("tail")
+        if tail:  # a batch that ran past midnight still logs to the day it started
+            rows, tail["offset"] = self._read_from(ledger_path(self.logs_dir, date.fromisoformat(tail["day"])), int(tail["offset"]))
+            done = [r for r in rows if r.get("Kind") == "completed"]
+            if done: self.history_sink([history_view_row(r) for r in done])
+        while True:
+            rows, offset = self._read_from(ledger_path(self.logs_dir, day), offset)
+            done = [r for r in rows if r.get("Kind") == "completed"]
+            if done: self.history_sink([history_view_row(r) for r in done])
+            if self.today_path and day == today:
+                if state.get("view_day") != today.isoformat():
+                    self._rebuild_today(offset)
+                    state["view_day"] = today.isoformat()
+                elif done:
+                    self._append_today([completed_view_row(r) for r in done])
+            state.update(day=day.isoformat(), offset=offset)
+            self._save_state(state)
+            if day >= today: break
+            state["tail"] = {"day": day.isoformat(), "offset": offset}
+            day, offset = day + timedelta(days=1), 0
+
+    def _rebuild_today(self, upto):
+        """Rewrites Completed_Today from today's ledger up to byte upto (what the state says has been read)."""
+        path, data = ledger_path(self.logs_dir, date.today()), b""
+        if os.path.exists(path):
+            with open(path, "rb") as f: data = f.read(upto)
+        rows = [completed_view_row(r) for r in self._parse(data) if r.get("Kind") == "completed"]
+        _write_csv_atomic(self.today_path, COMPLETED_FIELDS, rows)
+
+    def _append_today(self, rows):
+        os.makedirs(os.path.dirname(self.today_path) or ".", exist_ok=True)
+        with open(self.today_path, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=COMPLETED_FIELDS)
+            if fh.tell() == 0: w.writeheader()
+            w.writerows(rows)
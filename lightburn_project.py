@@ -0,0 +1,80 @@
+"""Per-batch LightBurn projects generated from a job's .lbrn2 template.
+
+A template is an ordinary LightBurn project whose text objects contain a
+placeholder token (default "{CODE}"). Each such object, in document order,
+is one code slot: the batch's first code goes into the first slot, and so on.
+Slots left over when the batch is smaller than the fixture are blanked.
+
+A template is parsed once and kept as the serialized file split around its
+slots, so writing a batch is a stream of cached chunks and escaped codes to
+a temp file that is then renamed over the target. LightBurn never sees a
+half-written project. The cache is keyed by path and revalidated with one
+os.stat(), so an edited template is picked up on its next use.
+"""
+import os, threading
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+DEFAULT_TOKEN = "{CODE}"
+_SLOT = "\x1fSLOT\x1f"
+
+class LbrnTemplate:
+    """A parsed template: chunks[i] is the file text before slot i; chunks[-1] follows the last slot."""
+    def __init__(self, path, token=DEFAULT_TOKEN):
+        self.path, self.token = path, token
+        tree = ET.parse(path)
+        slots = 0
+        for el in tree.getroot().iter():
+            text = el.get("Str")
+            if text is None or token not in text: continue
+            # Keep any fixed text around the token, e.g. "SN {CODE}".
+            before, _, after = text.partition(token)
+            el.set("Str", before + _SLOT + after)
+            slots += 1
+        if not slots:
+            raise ValueError(f"{os.path.basename(path)} has no text object containing {token}.")
+        body = ET.tostring(tree.getroot(), encoding="unicode")
+        self.chunks = ('<?xml version="1.0" encoding="UTF-8"?>\n' + body).split(_SLOT)
+        self.slots = slots
+
+    def write(self, path, codes):
+        """Writes a project with codes in the slots, via temp file + fsync + rename."""
+        if len(codes) > self.slots:
+            raise ValueError(f"{len(codes)} codes do not fit {os.path.basename(self.path)} ({self.slots} slots).")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            for i, chunk in enumerate(self.chunks[:-1]):
+                f.write(chunk)
+                if i < len(codes): f.write(escape(codes[i], {'"': "&quot;"}))
+            f.write(self.chunks[-1])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return path
+
+
+class TemplateCache:
+    """load(path) returns the cached LbrnTemplate for path, reparsing only when the file changed."""
+    def __init__(self, token=DEFAULT_TOKEN):
+        self.token = token
+        self._cache = {}  # path -> (mtime_ns, size, template)
+        self._lock = threading.Lock()
+        self.parses = 0
+
+    def load(self, path):
+        st = os.stat(path)
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size and hit[2].token == self.token:
+                return hit[2]
+        template = LbrnTemplate(path, self.token)
+        with self._lock:
+            self._cache[key] = (st.st_mtime_ns, st.st_size, template)
+            self.parses += 1
+        return template
+
+    def set_token(self, token):
+        with self._lock:
+            if token != self.token: self.token, self._cache = token, {}
@@ -0,0 +1,136 @@
+"""LightBurn's UDP command interface.
+
+LightBurn listens for plain-text commands on UDP port 19840 and answers on
+port 19841 of the sender's host. The station uses:
+
+  PING               "OK" while LightBurn is running
+  LOADFILE:<path>    load a project; "OK" once loaded
+  START              start the loaded job
+
+LightBurnUdp sends one command at a time from a worker thread, so nothing
+waits on the caller's thread. StandIn answers like LightBurn for tests and
+bench setups:
+
+  python lightburn_udp.py [--port 19840] [--reply-port 19841] [--fail LOADFILE]
+"""
+import queue, socket, threading, time
+
+LB_COMMAND_PORT = 19840
+LB_REPLY_PORT = 19841
+
+class LightBurnUdp:
+    """Client for LightBurn's UDP port. send(command, on_reply) returns at once;
+    on_reply(reply, rtt_ms) is called from the worker thread, with reply None if
+    LightBurn did not answer within timeout_ms."""
+    def __init__(self, host="127.0.0.1", port=LB_COMMAND_PORT, reply_port=LB_REPLY_PORT, timeout_ms=1000):
+        self.host, self.port, self.reply_port = host, port, reply_port
+        self.timeout_s = timeout_ms / 1000.0
+        self._jobs = queue.Queue()
+        self._sock = None
+        self._thread = threading.Thread(target=self._run, name="LightBurnUdp", daemon=True)
+        self._thread.start()
+
+    def send(self, command, on_reply):
+        self._jobs.put((command, on_reply))
+
+    def close(self):
+        self._jobs.put(None)
+
+    def _socket(self):
+        if self._sock is None:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("", self.reply_port))
+            self._sock = s
+        return self._sock
+
+    def _exchange(self, command):
+        s = self._socket()
+        s.settimeout(0)
+        try:
+            while True: s.recv(4096)  # drop replies that arrived after an earlier timeout
+        except (BlockingIOError, socket.timeout, OSError):
+            pass
+        s.settimeout(self.timeout_s)
+        s.sendto(command.encode("utf-8"), (self.host, self.port))
+        try:
+            return s.recv(4096).decode("utf-8", "replace").strip()
+        except (socket.timeout, ConnectionResetError):
+            return None
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: break
+            command, on_reply = job
+            t0 = time.monotonic()
+            try:
+                reply = self._exchange(command)
+            except OSError as e:
+                print(f"[LB-UDP] {command.split(':', 1)[0]} failed: {e}")
+                reply = None
+            try: on_reply(reply, round((time.monotonic() - t0) * 1000))
+            except Exception as e: print(f"[LB-UDP] Reply handler failed: {e}")
+        if self._sock: self._sock.close()
+
+def reply_ok(reply):
+    return bool(reply) and reply.upper().startswith("OK")
+
+
+class StandIn:
+    """Answers LightBurn UDP commands on localhost. fail holds command names to answer with an error;
+    load_ms delays the LOADFILE reply like a real project load."""
+    def __init__(self, port=LB_COMMAND_PORT, reply_port=LB_REPLY_PORT, fail=(), load_ms=0):
+        self.port, self.reply_port = port, reply_port
+        self.fail = {f.upper() for f in fail}
+        self.load_ms = load_ms
+        self.received = []
+        self.loaded = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", port))
+        self._sock.settimeout(0.2)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="LightBurnStandIn", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(1.0)
+        self._sock.close()
+
+    def _run(self):
+        while self._running:
+            try: data, (host, _) = self._sock.recvfrom(4096)
+            except socket.timeout: continue
+            except OSError: return
+            command = data.decode("utf-8", "replace").strip()
+            name, _, arg = command.partition(":")
+            self.received.append(command)
+            print(f"[STANDIN] {command}")
+            if name.upper() in self.fail:
+                reply = "!ERROR"
+            elif name.upper() == "LOADFILE":
+                time.sleep(self.load_ms / 1000.0)
+                self.loaded, reply = arg, "OK"
+            else:
+                reply = "OK"
+            self._sock.sendto(reply.encode("utf-8"), (host, self.reply_port))
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Local stand-in for LightBurn's UDP command port.")
+    ap.add_argument("--port", type=int, default=LB_COMMAND_PORT)
+    ap.add_argument("--reply-port", type=int, default=LB_REPLY_PORT)
+    ap.add_argument("--fail", action="append", default=[], help="command to answer with an error (repeatable)")
+    ap.add_argument("--load-ms", type=int, default=0)
+    args = ap.parse_args()
+    standin = StandIn(args.port, args.reply_port, args.fail, args.load_ms).start()
+    print(f"[STANDIN] Listening on 127.0.0.1:{args.port}, replying to port {args.reply_port}. Ctrl+C to stop.")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        standin.stop()
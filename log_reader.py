@@ -0,0 +1,103 @@
+"""Streaming reads over the station's completed-item logs.
+
+Completed items are written to LOGS/<year>/<yymmdd>/Completed.csv, then
+Completed_2.csv, Completed_3.csv, ... as each chunk fills, or, with
+LOGGING.store "ledger", to that folder's Ledger.csv. Retention may gzip
+old ones to .csv.gz. When history is enabled they also go to the monthly
+partitions of All_Jobs_History.csv (see history_store.py). iter_completed()
+and iter_history() yield one row dict at a time over a date range, opening
+one file at a time, so memory stays flat no matter how much is on disk.
+
+  python log_reader.py LOGS --from 2026-10-01 --to 2026-10-19 [--part PN] [--count]
+  python log_reader.py LOGS --history LOGS/All_Jobs_History.csv --from 2026-10-01
+"""
+import csv, glob, gzip, os, sys
+from datetime import date, datetime, timedelta
+
+from history_store import HISTORY_FIELDS, history_store
+
+COMPLETED_FIELDS = ["Time","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","Serial Number","Result"]
+LEDGER_FIELDS = ["Kind","DateTime","JobID","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","Serial Number","Result"]
+
+def open_log(path):
+    if path.lower().endswith(".gz"): return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, "r", newline="", encoding="utf-8")
+
+def chunk_index(path):
+    """Completed.csv -> 1, Completed_3.csv(.gz) -> 3."""
+    name = os.path.basename(path)
+    if name.lower().endswith(".gz"): name = name[:-3]
+    stem = os.path.splitext(name)[0]
+    try: return int(stem.rsplit("_", 1)[1]) if "_" in stem else 1
+    except ValueError: return 1
+
+def day_folder(logs_dir, day):
+    return os.path.join(logs_dir, day.strftime("%Y"), day.strftime("%y%m%d"))
+
+def day_chunks(logs_dir, day, stem="Completed"):
+    """The chunk files for one day in write order. Where a chunk exists both plain and
+    gzipped (compression finishing), the .gz is the complete one."""
+    folder = day_folder(logs_dir, day)
+    chunks = {}
+    for path in glob.glob(os.path.join(folder, stem + "*.csv")) + glob.glob(os.path.join(folder, stem + "*.csv.gz")):
+        key = path[:-3] if path.lower().endswith(".gz") else path
+        if key not in chunks or path.lower().endswith(".gz"): chunks[key] = path
+    return sorted(chunks.values(), key=chunk_index)
+
+def _days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+def iter_file(path):
+    try:
+        fh = open_log(path)
+    except FileNotFoundError:
+        if path.lower().endswith(".gz") or not os.path.exists(path + ".gz"): return
+        fh = open_log(path + ".gz")  # compressed between listing and opening
+    with fh:
+        yield from csv.DictReader(fh)
+
+def iter_completed(logs_dir, start, end=None, stem="Completed"):
+    """Yields the rows logged in the day folders from start to end (dates, inclusive), oldest first.
+    Completed items are read from the Completed chunks and from the day's Ledger.csv (see ledger.py)."""
+    for day in _days(start, end or start):
+        for path in day_chunks(logs_dir, day, stem):
+            yield from iter_file(path)
+        if stem != "Completed": continue
+        for path in day_chunks(logs_dir, day, "Ledger"):
+            for row in iter_file(path):
+                if row.get("Kind") != "completed": continue
+                row["Time"] = (row.get("DateTime") or "")[11:]
+                yield row
+
+def iter_history(path, start, end=None):
+    """Yields the history rows whose DateTime falls on start..end (inclusive), reading only the
+    monthly partitions (and legacy single file) that overlap the range."""
+    if not path: return
+    yield from history_store(path).iter_rows(start, end or start)
+
+
+if __name__ == "__main__":
+    import argparse
+    parse_day = lambda s: datetime.strptime(s, "%Y-%m-%d").date()
+    ap = argparse.ArgumentParser(description="Print completed items from the station logs as CSV.")
+    ap.add_argument("logs", help="the station's LOGS folder")
+    ap.add_argument("--from", dest="start", type=parse_day, default=date.today(), help="YYYY-MM-DD (default today)")
+    ap.add_argument("--to", dest="end", type=parse_day, default=None, help="YYYY-MM-DD (default --from)")
+    ap.add_argument("--history", metavar="CSV", help="read this All_Jobs_History.csv instead of the day folders")
+    ap.add_argument("--part", help="only this part number")
+    ap.add_argument("--count", action="store_true", help="print the number of matching rows only")
+    args = ap.parse_args()
+    if args.history:
+        rows, fields = iter_history(args.history, args.start, args.end), HISTORY_FIELDS
+    else:
+        rows, fields = iter_completed(args.logs, args.start, args.end), COMPLETED_FIELDS
+    if args.part: rows = (r for r in rows if r.get("PartNumber") == args.part)
+    if args.count:
+        print(sum(1 for _ in rows))
+    else:
+        w = csv.DictWriter(sys.stdout, fieldnames=fields, extrasaction="ignore")
+        w.writeheader()
+        for r in rows: w.writerow(r)
@@ -0,0 +1,200 @@
+"""Copies the station's local log tree to the network share in the background.
+
+With SYNC.local_root set, every log file is written under local_root and
+mirrored to the same relative path under ROOT. Files are appended to (the
+CSV logs) or replaced whole (temp file + rename); LogSync tells them apart
+by inode and size. For each file, LogSync.json in local_root records the
+inode, size and mtime and how many bytes the share has:
+
+  {"LOGS/2026/261019/Completed.csv": {"ino": 1234, "size": 96311, "mtime": 1760..., "offset": 96311}}
+
+A grown file sends only the new bytes, resuming from what the share already
+holds, so an interrupted copy picks up where it stopped. A replaced file
+is copied whole (to a temp file, renamed on the share). A file removed
+locally, by retention for example, is removed from the share.
+
+A share copy holding bytes this station did not send (more than the
+recorded offset, written by another writer or while sync was off) is never
+overwritten. If it is a prefix of the local file only the rest is appended;
+otherwise the local file goes to <name>.<host>-conflict<ext> beside it from
+then on, and the status lists it under "conflicts". While the
+share is unreachable, passes fail fast and are retried; nothing on the
+station waits for it. Files still being staged (.tmp, .next) are left alone.
+"""
+import json, os, shutil, socket, threading, time
+
+STATE_NAME = "LogSync.json"
+
+class LogSync:
+    def __init__(self, local_root, remote_root, interval_ms=2000, on_status=None):
+        self.local_root = local_root
+        self.remote_root = remote_root
+        self.interval_s = max(0.2, interval_ms / 1000.0)
+        self.on_status = on_status
+        self.state_path = os.path.join(local_root, STATE_NAME)
+        self.state = self._load_state()
+        self.status = {}
+        self.bytes_sent = 0
+        self.passes = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="LogSync", daemon=True)
+        self._thread.start()
+
+    def poke(self): self._wake.set()
+
+    def stop(self):
+        """Ends the thread after one last pass."""
+        self._stopped = True
+        self._wake.set()
+
+    # ---------- State ----------
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f: state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    @staticmethod
+    def _skipped(rel):
+        return rel.endswith((".tmp", ".next"))
+
+    @staticmethod
+    def _entry(st, offset, target=None):
+        entry = {"ino": st.st_ino, "size": st.st_size, "mtime": st.st_mtime_ns, "offset": offset}
+        if target: entry["target"] = target
+        return entry
+
+    def _remote(self, rel):
+        entry = self.state.get(rel) or {}
+        return os.path.join(self.remote_root, *entry.get("target", rel).split("/"))
+
+    @staticmethod
+    def _conflict_name(rel):
+        stem, ext = os.path.splitext(rel)
+        return f"{stem}.{socket.gethostname() or 'station'}-conflict{ext}"
+
+    @staticmethod
+    def _same_bytes(a, b, start, end):
+        """Whether files a and b hold the same bytes in [start, end)."""
+        with open(a, "rb") as fa, open(b, "rb") as fb:
+            fa.seek(start); fb.seek(start)
+            while start < end:
+                n = min(1 << 16, end - start)
+                if fa.read(n) != fb.read(n): return False
+                start += n
+        return True
+
+    # ---------- Seeding ----------
+    def seed(self, folders):
+        """Copies the share's files in folders (paths relative to the roots, not recursive) that are
+        missing locally, so a station switching to local-first starts from what the share has.
+        Returns the number of files copied."""
+        n = 0
+        for rel_dir in folders:
+            remote_dir = os.path.join(self.remote_root, rel_dir)
+            if not os.path.isdir(remote_dir): continue
+            for name in os.listdir(remote_dir):
+                rel = os.path.join(rel_dir, name)
+                local, remote = os.path.join(self.local_root, rel), os.path.join(remote_dir, name)
+                if self._skipped(rel.replace(os.sep, "/")) or not os.path.isfile(remote) or os.path.exists(local): continue
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                shutil.copy2(remote, local)
+                self.state[rel.replace(os.sep, "/")] = self._entry(os.stat(local), os.path.getsize(local))
+                n += 1
+        if n: self._save_state()
+        return n
+
+    # ---------- Syncing ----------
+    def _local_files(self):
+        for folder, _, names in os.walk(self.local_root):
+            for name in names:
+                path = os.path.join(folder, name)
+                rel = os.path.relpath(path, self.local_root).replace(os.sep, "/")
+                if name != STATE_NAME and not self._skipped(rel): yield rel, path
+
+    def _append(self, path, remote, have, size):
+        with open(path, "rb") as src, open(remote, "ab") as dst:
+            src.seek(have)
+            shutil.copyfileobj(src, dst, 1 << 16)
+        self.bytes_sent += size - have
+
+    def _send(self, rel, path, st):
+        """Brings the share's copy of rel up to date. Returns the new state entry."""
+        prev = self.state.get(rel) or {}
+        target = prev.get("target")
+        remote = self._remote(rel)
+        have = os.path.getsize(remote) if os.path.exists(remote) else -1
+        offset = prev.get("offset", 0)
+        # Resume an append when the share holds exactly what we sent, or more of the same bytes.
+        resume = 0 <= have <= st.st_size and (have == offset and prev.get("ino") == st.st_ino)
+        if have > offset:
+            resume = have <= st.st_size and self._same_bytes(path, remote, offset, have)
+            if not resume:  # bytes on the share that did not come from here: keep them, send ours beside them
+                target = self._conflict_name(rel)
+                print(f"[SYNC] {rel} on the share has rows this station did not write; sending it to {target}.")
+                remote = os.path.join(self.remote_root, *target.split("/"))
+                have = os.path.getsize(remote) if os.path.exists(remote) else -1
+                resume = 0 <= have <= st.st_size and self._same_bytes(path, remote, 0, have)
+        if resume:
+            self._append(path, remote, have, st.st_size)
+        else:
+            os.makedirs(os.path.dirname(remote), exist_ok=True)
+            tmp = remote + ".tmp"
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, remote)
+            self.bytes_sent += st.st_size
+        return self._entry(st, st.st_size, target)
+
+    def sync_once(self):
+        """One pass: sends what changed, removes what went away. Returns the number of files still behind."""
+        seen, behind, changed, error = set(), 0, False, ""
+        for rel, path in self._local_files():
+            try: st = os.stat(path)
+            except OSError: continue
+            seen.add(rel)
+            prev = self.state.get(rel)
+            if prev and (prev["ino"], prev["size"], prev["mtime"]) == (st.st_ino, st.st_size, st.st_mtime_ns): continue
+            if error:
+                behind += 1; continue
+            try:
+                self.state[rel] = self._send(rel, path, st); changed = True
+            except OSError as e:
+                error, behind = str(e), behind + 1
+        if not error:
+            for rel in [r for r in self.state if r not in seen]:
+                try:
+                    remote = self._remote(rel)
+                    if os.path.exists(remote): os.remove(remote)
+                    del self.state[rel]; changed = True
+                except OSError as e:
+                    error = str(e); break
+        if changed: self._save_state()
+        self.passes += 1
+        status = {"ok": not error, "behind": behind, "error": error,
+                  "conflicts": sorted(e["target"] for e in self.state.values() if e.get("target")),
+                  "last_ok": time.strftime("%Y-%m-%d %H:%M:%S") if not error else self.status.get("last_ok", "")}
+        if any(status[k] != self.status.get(k) for k in ("ok", "behind", "error", "conflicts")):
+            if error and not self.status.get("error"): print(f"[SYNC] Share unreachable, logging locally: {error}")
+            elif not error and self.status.get("error"): print("[SYNC] Share reachable again; caught up.")
+            if self.on_status: self.on_status(dict(status))
+        self.status = status
+        return behind
+
+    def _run(self):
+        while True:
+            try: self.sync_once()
+            except OSError as e: print(f"[SYNC] Pass failed: {e}")
+            if self._stopped: return
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
@@ -0,0 +1,263 @@
+"""Serial numbers leased in blocks from one authority shared by all stations.
+
+Without it, each station takes its next serial from its own logs, so two
+stations running the same part number on the same day can issue the same
+codes. With it, serials for a (part number, date code) come from blocks
+leased from an authority that never hands out a number twice:
+
+  BlockAuthority   the counters, in a JSON file written before each lease is answered;
+                   used directly it is the in-process stand-in (one station, tests)
+  AllocatorServer  serves a BlockAuthority on the LAN:  POST /lease  {"part", "date", "n", "floor", "station"}
+                   -> {"start", "end"}; GET /blocks lists the counters
+  HttpAuthority    the client for it
+  SerialAllocator  the station side. It keeps the block in use plus a pre-reserved one
+                   on disk, so taking serials is local and O(1), and refills in the
+                   background. If the authority is unreachable, batches carry on from
+                   the reserve.
+
+  python serial_allocator.py SerialAuthority.json --host 0.0.0.0 --port 8766
+"""
+import asyncio, json, os, threading, time, urllib.request
+
+def block_key(part, date_code): return f"{part}|{date_code}"
+
+class BlockAuthority:
+    def __init__(self, path, keep_days=7):
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f: self.next = {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            self.next = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.next, f, indent=1, sort_keys=True)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def lease(self, part, date_code, n, floor=1, station=""):
+        """Returns (start, end), inclusive: n serials nobody else has been given. floor is the
+        station's own next serial, so numbers logged before the authority was used are skipped."""
+        key = block_key(part, date_code)
+        with self._lock:
+            start = max(self.next.get(key, 1), int(floor))
+            self.next[key] = start + n
+            # Date codes sort as yymmdd; a week of them is plenty for batches running past midnight.
+            codes = sorted({k.rsplit("|", 1)[1] for k in self.next})
+            old = set(codes[:-self.keep_days]) if len(codes) > self.keep_days else set()
+            for k in [k for k in self.next if k.rsplit("|", 1)[1] in old]: del self.next[k]
+            self._save()
+        print(f"[SERIAL] Leased {key} {start}-{start + n - 1} to {station or 'local'}.")
+        return start, start + n - 1
+
+    def blocks(self):
+        with self._lock: return dict(self.next)
+
+
+class HttpAuthority:
+    """BlockAuthority.lease() against an AllocatorServer. Raises OSError when it cannot be reached."""
+    def __init__(self, url, timeout=2.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def lease(self, part, date_code, n, floor=1, station=""):
+        body = json.dumps({"part": part, "date": date_code, "n": n, "floor": floor, "station": station}).encode("utf-8")
+        req = urllib.request.Request(self.url + "/lease", data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp: reply = json.loads(resp.read())
+            return int(reply["start"]), int(reply["end"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise OSError(f"bad reply from {self.url}: {e}")
+
+
+class AllocatorServer:
+    """Serves a BlockAuthority over HTTP on its own thread. start()/stop() may be called from any thread."""
+    def __init__(self, authority, host="0.0.0.0", port=8766):
+        self.authority = authority
+        self.host, self.port = host, port
+        self._loop = None
+        self._thread = None
+        self._stopped = None
+
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="AllocatorServer", daemon=True)
+        self._thread.start()
+        ready.wait(5.0)
+
+    def stop(self, timeout=5.0):
+        loop, self._loop = self._loop, None
+        if loop and self._stopped:
+            try: loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError: pass  # already closed
+        if self._thread: self._thread.join(timeout)
+
+    def _run(self, ready):
+        try:
+            asyncio.run(self._main(ready))
+        except Exception as e:
+            print(f"[SERIAL] Server stopped: {e}")
+        finally:
+            ready.set()
+
+    async def _main(self, ready):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[SERIAL] Serving serial blocks on http://{self.host}:{self.port}/lease")
+        ready.set()
+        async with server:
+            await self._stopped.wait()
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            lines = head.decode("latin-1").split("\r\n")
+            method, path = lines[0].split(" ")[:2]
+            headers = dict(ln.split(":", 1) for ln in lines[1:] if ":" in ln)
+            length = int({k.strip().lower(): v for k, v in headers.items()}.get("content-length", 0))
+            body = await asyncio.wait_for(reader.readexactly(length), 10) if length else b""
+            if method == "POST" and path == "/lease":
+                req = json.loads(body)
+                n = int(req["n"])
+                if not (req.get("part") and req.get("date")) or not 0 < n <= 100000: raise ValueError("bad lease request")
+                # The lease writes the counter file; keep that off the event loop.
+                start, end = await asyncio.get_running_loop().run_in_executor(None, self.authority.lease, str(req["part"]), str(req["date"]),
+                                                                              n, int(req.get("floor") or 1), str(req.get("station") or ""))
+                await self._respond(writer, 200, json.dumps({"start": start, "end": end}))
+            elif method == "GET" and path == "/blocks":
+                await self._respond(writer, 200, json.dumps(self.authority.blocks()))
+            else:
+                await self._respond(writer, 404, json.dumps({"error": "not found"}))
+        except (KeyError, TypeError, ValueError) as e:
+            await self._respond(writer, 400, json.dumps({"error": str(e)}))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, code, body):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[code]
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {code} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                     "Cache-Control: no-store\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+
+class SerialAllocator:
+    """The station's leased blocks, kept in path as {key: [[next, end], ...]} (first block in use).
+
+    peek(key, n) is the start take(key, n) would return, or None if the blocks on hand cannot
+    hold n more serials. Only one thread (the engine's) takes. prepare() leases in the background
+    whenever fewer than block_size serials are left, so one block is always held in reserve.
+    prepare(..., ahead=True) only makes sure n are on hand: the station uses it for tomorrow's
+    date code, and for parts it has not run today, so their first batch needs no lease either.
+    """
+    RETRY_S = 10.0
+
+    def __init__(self, authority, path, station="", block_size=200, on_lease=None):
+        self.authority = authority
+        self.path = path
+        self.station = station
+        self.block_size = max(1, int(block_size))
+        self.on_lease = on_lease
+        self.error = ""
+        self.leases = 0
+        self._lock = threading.Lock()
+        self._leasing = set()
+        self._retry_at = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.blocks = {k: [list(map(int, b)) for b in v] for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError, TypeError):
+            self.blocks = {}
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.blocks, f)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _start_for(self, blocks, n):
+        """(index of the block serving n serials, its start), merging a block into the next when they touch."""
+        for i, (nxt, end) in enumerate(blocks):
+            if end - nxt + 1 >= n: return i, nxt
+            if i + 1 < len(blocks) and blocks[i + 1][0] == end + 1 and blocks[i + 1][1] - nxt + 1 >= n: return i, nxt
+        return None, None
+
+    def remaining(self, key):
+        with self._lock: return sum(end - nxt + 1 for nxt, end in self.blocks.get(key, []))
+
+    def peek(self, key, n):
+        with self._lock: return self._start_for(self.blocks.get(key, []), n)[1]
+
+    def take(self, key, n):
+        """Consumes n consecutive serials and returns the first, or None if none are on hand."""
+        with self._lock:
+            blocks = self.blocks.get(key, [])
+            i, start = self._start_for(blocks, n)
+            if start is None: return None
+            del blocks[:i]  # too small for a batch: the rest of those blocks is skipped
+            last = start + n - 1
+            while blocks and blocks[0][1] <= last: blocks.pop(0)
+            if blocks: blocks[0][0] = max(blocks[0][0], last + 1)
+            # Only today's keys are kept; a finished day's leftovers are never used again.
+            date_code = key.rsplit("|", 1)[1]
+            self.blocks = {k: v for k, v in self.blocks.items() if k.rsplit("|", 1)[1] >= date_code}
+            self.blocks[key] = blocks
+            self._save()
+        return start
+
+    def prepare(self, part, date_code, n, floor=None, ahead=False):
+        """Starts a background lease if fewer than n + block_size serials (n, ahead) are on hand for
+        the key. floor() is called (on the lease thread) for a key this station has no blocks for yet."""
+        key = block_key(part, date_code)
+        with self._lock:
+            have = sum(end - nxt + 1 for nxt, end in self.blocks.get(key, []))
+            want = n if ahead else n + self.block_size
+            if have >= want or key in self._leasing or time.monotonic() < self._retry_at.get(key, 0): return
+            self._leasing.add(key)
+            first = key not in self.blocks
+        threading.Thread(target=self._lease, args=(part, date_code, key, max(n, self.block_size), floor if first else None),
+                         name="SerialLease", daemon=True).start()
+
+    def _lease(self, part, date_code, key, size, floor):
+        try:
+            try:
+                start, end = self.authority.lease(part, date_code, size, floor() if floor else 1, self.station)
+            except Exception as e:  # OSError when unreachable; anything else is retried the same way
+                with self._lock:
+                    self._retry_at[key] = time.monotonic() + self.RETRY_S
+                    if self.error != str(e): print(f"[SERIAL] Could not lease a block for {key}: {e}")
+                    self.error = str(e)
+                return
+            with self._lock:
+                self.blocks.setdefault(key, []).append([start, end])
+                self.blocks[key].sort()
+                self.error = ""
+                self.leases += 1
+                try: self._save()
+                except OSError as e: print(f"[SERIAL] Could not save {os.path.basename(self.path)}: {e}")
+        finally:
+            with self._lock: self._leasing.discard(key)
+        if self.on_lease: self.on_lease(key)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Serve serial blocks to the stations on this network.")
+    ap.add_argument("path", help="the counter file, e.g. SerialAuthority.json")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8766)
+    args = ap.parse_args()
+    server = AllocatorServer(BlockAuthority(args.path), args.host, args.port)
+    server.start()
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
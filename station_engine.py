@@ -0,0 +1,3296 @@
+"""Headless station engine for the LightBurn Serial GUI.
+
+Owns the ESP32 serial link, job/batch state, relay sequencing and all log
+and config file I/O on its own thread. Nothing here imports tkinter: a front
+end sends commands with StationEngine.submit() and reads events from the
+queue returned by StationEngine.subscribe().
+"""
+import os, io, json, csv, gzip, subprocess, platform, glob, shutil, time, copy, threading, queue, hashlib, heapq, itertools, collections
+from datetime import datetime, timedelta, date
+from types import MappingProxyType
+from station_status import StatusServer
+from lightburn_udp import LightBurnUdp, reply_ok
+from history_store import history_store
+from ledger import Ledger, LedgerViews, materialize_today
+from log_reader import COMPLETED_FIELDS, HISTORY_FIELDS, iter_completed, iter_file, iter_history
+from lightburn_project import DEFAULT_TOKEN, TemplateCache
+from log_sync import LogSync
+from serial_allocator import AllocatorServer, BlockAuthority, HttpAuthority, SerialAllocator, block_key
+from window_backend import IS_WINDOWS, WindowManager, WindowWorker, default_backend
+try:
+    import serial
+except ImportError:  # simulate mode and tooling run without pyserial
+    serial = None
+
+
+# ---------- New centralized base directory ----------
+# This is the single source of truth for the application's root folder.
+APP_BASE_DIR = "C:/Users/asmlzr/Documents/LaserSerials"
+
+
+# ----------------- Default Config -----------------
+def serial5(n): return f"{n:05d}"
+
+class DateContext:
+    """A day as the station uses it: the date, its yymmdd code and its log folder.
+    The engine builds one per day and swaps in the next at local midnight."""
+    __slots__ = ("day", "code", "year")
+    def __init__(self, day=None):
+        self.day = day or date.today()
+        self.code = self.day.strftime("%y%m%d")
+        self.year = self.day.strftime("%Y")
+
+    def folder(self, logs_dir): return os.path.join(logs_dir, self.year, self.code)
+
+    @staticmethod
+    def ms_to_midnight(now=None):
+        now = now or datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return max(0, int((midnight - now).total_seconds() * 1000))
+
+DEFAULT_CONFIG = {
+    "ROOT": APP_BASE_DIR,
+    "JOBS": {
+        "Job 8": {
+            "display_name": "Idler 1",
+            "part_number": "PN123",
+            "revision": 1,
+            "version": "A",
+            "cavity": 1,
+            "machine": 1,
+            "default_batch": 28,
+            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobA.lbrn2"),
+            "focus_height": 0.0,
+            "select_pattern": "100",
+            "job_delay_sec": 5,
+            "air_before_sec": 5,
+            "air_after_sec": 5
+        },
+        "Job 9": {
+            "display_name": "Idler 2",
+            "part_number": "PN456",
+            "revision": 2,
+            "version": "B",
+            "cavity": 0,
+            "machine": 2,
+            "default_batch": 9,
+            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobB.lbrn2"),
+            "focus_height": 0.0,
+            "select_pattern": "010",
+            "job_delay_sec": 5,
+            "air_before_sec": 5,
+            "air_after_sec": 5
+        },
+        "Job 10": {
+            "display_name": "Idler 3",
+            "part_number": "PN789",
+            "revision": 1,
+            "version": "C",
+            "cavity": 2,
+            "machine": 1,
+            "default_batch": 28,
+            "lightburn_file": os.path.join(APP_BASE_DIR, "Jobs", "JobC.lbrn2"),
+            "focus_height": 0.0,
+            "select_pattern": "110",
+            "job_delay_sec": 5,
+            "air_before_sec": 5,
+            "air_after_sec": 5
+        },
+        "Job 11": {
+            "display_name": "Job 11",
+            "part_number": "PN000",
+            "revision": 0,
+            "version": "A",
+            "cavity": 0,
+            "machine": 1,
+            "default_batch": 28,
+            "lightburn_file": "",
+            "focus_height": 0.0,
+            "select_pattern": "111",
+            "job_delay_sec": 5,
+            "air_before_sec": 5,
+            "air_after_sec": 5
+        },
+        "Job 12": {
+            "display_name": "Job 12",
+            "part_number": "PN000",
+            "revision": 0,
+            "version": "A",
+            "cavity": 0,
+            "machine": 1,
+            "default_batch": 28,
+            "lightburn_file": "",
+            "focus_height": 0.0,
+            "select_pattern": "011",
+            "job_delay_sec": 5,
+            "air_before_sec": 5,
+            "air_after_sec": 5
+        }
+    },
+    "OPEN_LB_FILE_ON_START": True,
+    "LIGHTBURN": {
+        "exe_path": "",
+        "start_delay_sec": 2,
+        "post_open_delay_sec": 3,
+        "enable_start_hotkey": True,
+        "test_hotkey_with_notepad": False,
+        "close_on_complete": False, # <-- NEW SETTING
+        # Once LightBurn is open, move its window to the bottom-right corner at this size.
+        "enable_positioning": False,
+        "window_width": 520,
+        "window_height": 380,
+        "window_margin": 8,
+        # "udp" loads projects (and, with udp_start, starts jobs) over LightBurn's UDP command
+        # port, falling back to launching the file / pulsing the Start relay if it does not answer.
+        "control": "window",
+        "udp_host": "127.0.0.1",
+        "udp_port": 19840,
+        "udp_reply_port": 19841,
+        "udp_timeout_ms": 1000,
+        "udp_start": False,
+        # "template" writes a project per batch from the job's .lbrn2: each text object containing
+        # template_token gets one code. "csv" feeds the codes to variable text through NextBatch.csv.
+        "project_mode": "csv",
+        "template_token": DEFAULT_TOKEN
+    },
+    "SERIAL": {
+        "enabled": True,
+        "port": "COM3",
+        "baud": 115200,
+        "done_token": "DONE",
+        "poll_ms": 10,
+        "auto_connect": True
+    },
+    "ESP32_PINS": {
+        "board": "esp32-c6-evb",
+        "relays": [10, 11, 22, 23, 9],
+        "opto_inputs": [1, 2, 3, 15],
+    },
+    "RELAYS": {
+        "names": ["Auto Focus", "Air", "Start", "Door Lock", "Stack Light"],
+        "modes": ["pulse", "pulse", "pulse", "pulse", "switch"],
+        "pulse_ms": [250, 250, 250, 250, 0],
+        "pins": [10, 11, 22, 23, 9],
+        "disabled": [False, False, False, False, False]
+    },
+    "INPUTS": {
+        "names": ["Job Sensor 1", "Job Sensor 2", "Job Sensor 3", "Door Sensor"],
+        "pins": [1, 2, 3, 17]
+    },
+    # Role of each input index. Job-select bits are listed MSB first.
+    # encoding "pattern" matches each job's select_pattern; "binary" matches its fixture_id.
+    "IO_MAP": {
+        "job_select_inputs": [0, 1, 2],
+        "door_input": 3,
+        "spare_inputs": [],
+        "busy_input": None,
+        "encoding": "pattern"
+    },
+    "SIMULATE": {
+        "enabled": False,
+        "batch_done_on_done": True
+    },
+    "UI": {
+        "up_next_tail": 28,
+        "show_autofocus_btn": True,
+        "job_button_colors": {
+            "Job 8": "#2ecc71",
+            "Job 9": "#3498db",
+            "Job 10": "#e67e22",
+            "Job 11": "#9b59b6",
+            "Job 12": "#7f8c8d"
+        }
+    },
+    "LOGGING": {
+        "daily_max_rows": 20000,
+        "retain_mode": "off",
+        "retain_days": 7,
+        # Day folders outside retention are "delete"d, or "compress"ed to .csv.gz in place;
+        # compressed_keep_days > 0 deletes compressed folders once they are that old.
+        "retain_action": "delete",
+        "compressed_keep_days": 0,
+        # Retention runs in the background after startup, pausing this long between files.
+        "retention_throttle_ms": 20,
+        # "ledger": each item is written once, to the day's Ledger.csv, and Completed_Today.csv /
+        # history become views of it; ledger_views "live" keeps Completed_Today.csv current in the
+        # background, "on_demand" only writes it when asked. "csv" writes every file directly.
+        "store": "csv",
+        "ledger_views": "live",
+        "write_planned": True
+    },
+    "HISTORY": {
+        "enabled": True,
+        # "monthly" writes <history>_<YYYY-MM>.csv plus a manifest next to entire_history_path
+        # (an existing single file stays readable as the legacy partition); "none" appends to it.
+        "partition": "monthly",
+        # > 0: gzip partitions once they are this many months old (by the background retention job).
+        "compress_after_months": 0
+    },
+    "FILE_PATHS": {
+        "next_batch_path": os.path.join(APP_BASE_DIR, "LOGS", "NextBatch.csv"),
+        "completed_today_path": os.path.join(APP_BASE_DIR, "LOGS", "Completed_Today.csv"),
+        "entire_history_path": os.path.join(APP_BASE_DIR, "LOGS", "All_Jobs_History.csv")
+    },
+    "AUTOFOCUS": {
+        "enabled": True
+    },
+    # What ends the engrave step: "timer" waits job_delay_sec; "serial" waits for SERIAL.done_token;
+    # "input" waits for IO_MAP.busy_input to go active and back. A signal that never comes
+    # ends the step after job_delay_sec * timeout_factor, as the timer did.
+    "JOB_DONE": {
+        "source": "timer",
+        "timeout_factor": 1.0
+    },
+    # Learned engrave delays. "suggest" only shows them in Settings -> Jobs; "apply" also runs
+    # with them once a job has min_samples measured cycles. "off" does neither.
+    "ADAPTIVE_TIMING": {
+        "mode": "suggest",
+        "percentile": 95,
+        "margin_pct": 15,
+        "min_samples": 10,
+        "window": 50
+    },
+    "CONFIG_RELOAD": {
+        "enabled": True,
+        "poll_ms": 2000
+    },
+    "STATUS_SERVER": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 8765
+    },
+    # Local-first logging: with local_root set (a local folder), LOGS and the FILE_PATHS logs under
+    # ROOT are written there instead, and copied to ROOT in the background every interval_ms, so a
+    # slow or unreachable share never holds up a job. That includes NextBatch.csv, so LightBurn
+    # projects should read it from under local_root (or use LIGHTBURN_CONTROL.template).
+    "SYNC": {
+        "local_root": "",
+        "interval_ms": 2000
+    },
+    # Serials leased in blocks from one authority shared by the stations (see serial_allocator.py), so
+    # two stations on the same part number never issue the same code. "off" takes the next serial from
+    # this station's logs; "local" keeps the authority in authority_path (a single station, or testing);
+    # "server" leases from url. serve also runs the authority service here, on host:port, from
+    # authority_path (default ROOT/Config/SerialAuthority.json). block_size serials are leased at a
+    # time, and one block is kept in reserve so batches still start while the authority is unreachable.
+    "SERIAL_ALLOCATOR": {
+        "mode": "off",
+        "url": "http://127.0.0.1:8766",
+        "station": "",
+        "block_size": 200,
+        "serve": False,
+        "host": "0.0.0.0",
+        "port": 8766,
+        "authority_path": ""
+    },
+    "LAST_DATE_CODE": DateContext().code
+}
+
+CONFIG_SAVE_COALESCE_MS = 300
+CONFIG_BACKUPS = 3
+
+def config_backup_path(path, n):
+    return f"{path}.bak{n}"
+
+def local_path(cfg, path):
+    """path, moved under SYNC.local_root if that is set and path lies under ROOT."""
+    local, root = (cfg.get("SYNC", {}).get("local_root") or "").strip(), cfg.get("ROOT") or ""
+    if not (local and root and path): return path
+    try: rel = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    except ValueError: return path  # another drive
+    if rel == os.curdir or rel.split(os.sep, 1)[0] == os.pardir: return path
+    return os.path.join(local, rel)
+
+def load_config_file(path):
+    """Loads the config, falling back to the newest readable backup, then to defaults."""
+    candidates = [path] + [config_backup_path(path, n) for n in range(1, CONFIG_BACKUPS + 1)]
+    for candidate in candidates:
+        if not os.path.exists(candidate): continue
+        try:
+            with open(candidate, "r", encoding="utf-8") as f:
+                loaded_config = json.load(f)
+        except Exception as e:
+            print(f"[CONFIG] Could not read {candidate}: {e}")
+            continue
+        if candidate != path:
+            print(f"[CONFIG] Recovered config from backup {candidate}")
+        return deep_merge(DEFAULT_CONFIG, loaded_config)
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+# Keys the station rewrites itself; an external change to these is not a reload.
+RELOAD_IGNORED_KEYS = {"LAST_DATE_CODE"}
+
+def config_diff(old, new):
+    """Returns the changed keys between two configs, as "SECTION" or "SECTION.key" for dict sections."""
+    changed = set()
+    for k in set(old) | set(new):
+        if k in RELOAD_IGNORED_KEYS: continue
+        a, b = old.get(k), new.get(k)
+        if a == b: continue
+        if isinstance(a, dict) and isinstance(b, dict):
+            changed.update(f"{k}.{sub}" for sub in set(a) | set(b) if a.get(sub) != b.get(sub))
+        else:
+            changed.add(k)
+    return changed
+
+def atomic_write_text(path, text):
+    """Writes text to path via temp file + fsync + rename, so readers see the old or new file, never a partial one."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def csv_column_values(path, column):
+    """Returns (header, set of the values in column) of a CSV file, in one streaming pass.
+    The set is None when the file has no such column."""
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        rd = csv.reader(f)
+        header = next(rd, [])
+        if column not in header: return header, None
+        col = header.index(column)
+        return header, {row[col] if col < len(row) else "" for row in rd if row}
+
+class InflightJournal:
+    """Write-ahead snapshot of the batch currently on the machine.
+
+    Rewritten atomically at every job-cycle transition (before the START
+    pulse, after each logged item) and removed when the batch finishes or is
+    aborted. If the file exists at startup the station died mid-job.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, state):
+        atomic_write_text(self.path, json.dumps(dict(state, updated=datetime.now().isoformat(timespec="seconds"))))
+
+    def read(self):
+        if not os.path.exists(self.path): return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: return json.load(f)
+        except Exception as e:
+            print(f"[INFLIGHT] Could not read {self.path}: {e}")
+            return None
+
+    def clear(self):
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile (p in 0..1) of an already sorted list; 0 if empty."""
+    if not sorted_values: return 0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+class PhaseHistory:
+    """Measured job-cycle timings per job, kept in a small JSON file next to the logs.
+
+    engrave:  ms from the START pulse to the laser's done signal (only cycles where one was seen)
+    overhead: ms of the rest of the cycle (LightBurn, air, door), so the cycle time for any
+              engrave delay can be predicted
+    Only the last window samples of each are kept.
+    """
+    def __init__(self, path, window=50):
+        self.path = path
+        self.window = window
+        self.jobs = {}
+        if not os.path.exists(path): return
+        try:
+            with open(path, "r", encoding="utf-8") as f: self.jobs = json.load(f)
+        except Exception as e:
+            print(f"[TIMING] Could not read {path}: {e}")
+
+    def add(self, job, phase, ms):
+        samples = self.jobs.setdefault(job, {}).setdefault(phase, [])
+        samples.append(int(ms))
+        del samples[:-self.window]
+
+    def samples(self, job, phase):
+        return self.jobs.get(job, {}).get(phase, [])
+
+    def save(self):
+        try: atomic_write_text(self.path, json.dumps(self.jobs))
+        except OSError as e: print(f"[TIMING] Could not save {self.path}: {e}")
+
+def suggest_engrave_delay(engrave, overhead, configured_ms, p=0.95, margin_pct=15, min_samples=10):
+    """Returns measured engrave percentiles and, once there are min_samples, the suggested delay
+    (the p-th percentile plus margin_pct, rounded up to 0.1 s) and the throughput gain it gives."""
+    e, o = sorted(engrave), sorted(overhead)
+    out = {"n": len(e), "pct": p, "p50_ms": percentile(e, 0.5), "p_ms": percentile(e, p), "max_ms": e[-1] if e else 0,
+           "configured_ms": configured_ms, "suggested_ms": None, "gain_pct": None}
+    if len(e) < max(1, min_samples): return out
+    suggested = -(-int(out["p_ms"] * (1 + margin_pct / 100.0)) // 100) * 100
+    out["suggested_ms"] = suggested
+    if o:
+        base = percentile(o, 0.5)
+        out["gain_pct"] = round(((base + configured_ms) / max(1, base + suggested) - 1) * 100, 1)
+    return out
+
+class ConfigWriter:
+    """Persists the config JSON on a background thread.
+
+    Saves submitted within coalesce_ms of each other collapse into a single
+    write. Before each write the current file, if it still parses, is rotated
+    into <path>.bak1 .. .bakN so load_config_file() can recover instantly.
+    """
+    def __init__(self, path, coalesce_ms=CONFIG_SAVE_COALESCE_MS, backups=CONFIG_BACKUPS, on_error=None):
+        self.path = path
+        self.coalesce_s = coalesce_ms / 1000.0
+        self.backups = backups
+        self._on_error = on_error
+        self._cond = threading.Condition()
+        self._pending = None
+        self._due = 0.0
+        self._busy = False
+        self._last_written = None
+        self._thread = threading.Thread(target=self._run, name="ConfigWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, cfg):
+        # Serialize on the caller's thread so the dict can keep changing after this returns.
+        text = json.dumps(cfg, indent=2)
+        with self._cond:
+            if self._pending is None:
+                self._due = time.monotonic() + self.coalesce_s
+            self._pending = text
+            self._cond.notify()
+
+    def flush(self, timeout=5.0):
+        """Writes any pending save now and waits for it. Returns False on timeout."""
+        end = time.monotonic() + timeout
+        with self._cond:
+            self._due = 0.0
+            self._cond.notify()
+            while self._pending is not None or self._busy:
+                left = end - time.monotonic()
+                if left <= 0: return False
+                self._cond.wait(left)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                while self._pending is not None and time.monotonic() < self._due:
+                    self._cond.wait(self._due - time.monotonic())
+                text, self._pending, self._busy = self._pending, None, True
+            try:
+                if text != self._last_written:
+                    self._rotate_backups()
+                    atomic_write_text(self.path, text)
+                    self._last_written = text
+            except Exception as e:
+                print(f"[CONFIG] Failed to save config: {e}")
+                if self._on_error: self._on_error(e)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _rotate_backups(self):
+        if self.backups <= 0 or not os.path.exists(self.path): return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: json.load(f)
+        except Exception:
+            return  # never rotate a damaged file over a good backup
+        for n in range(self.backups, 1, -1):
+            older = config_backup_path(self.path, n - 1)
+            if os.path.exists(older): os.replace(older, config_backup_path(self.path, n))
+        shutil.copy2(self.path, config_backup_path(self.path, 1))
+
+# ----------------- Batch Files -----------------
+BATCH_FIELDS = ["Date","JobID","JobName","PartNumber","Revision","Version","Cavity","Machine","DateCode","Serial5","FullCode"]
+
+def batch_rows(job, n, dates, start_serial):
+    """Returns (rows, codes) for n items of job starting at start_serial, dated by the DateContext dates."""
+    rows, codes = [], []
+    day, date_code = dates.day.strftime("%Y-%m-%d"), dates.code
+    for i in range(n):
+        s5 = serial5(start_serial + i)
+        fc = job.fullcode(date_code, s5)
+        rows.append({
+            "Date": day,
+            "JobID": job.key,
+            "JobName": job.display_name,
+            "PartNumber": job.part_number,
+            "Revision": job.revision,
+            "Version": job.version,
+            "Cavity": job.cavity,
+            "Machine": job.machine,
+            "DateCode": date_code,
+            "Serial5": s5,
+            "FullCode": fc
+        })
+        codes.append(fc)
+    return rows, codes
+
+def batch_csv_text(rows):
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=BATCH_FIELDS)
+    w.writeheader(); w.writerows(rows)
+    return buf.getvalue()
+
+def codes_csv_text(codes):
+    buf = io.StringIO()
+    w = csv.writer(buf); w.writerow(["CODE"]); w.writerows([c] for c in codes)
+    return buf.getvalue()
+
+def write_batch_csv(path, rows):
+    atomic_write_text(path, batch_csv_text(rows))
+
+def write_codes_csv(path, codes):
+    atomic_write_text(path, codes_csv_text(codes))
+
+class BatchStager:
+    """Prepares the next batch on a background thread while the current one engraves.
+
+    stage(request) replaces any request the worker has not picked up yet. The
+    worker builds the rows (unless the request already has them), writes them to
+    request["work_next"] and, if set, the codes to request["lb_next"] or a project
+    built from the job's template to request["project"], then hands the finished
+    request to deliver(). Only the engine ever moves a staged file
+    into place, with os.replace().
+    """
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._cond = threading.Condition()
+        self._pending = None
+        self._thread = threading.Thread(target=self._run, name="BatchStager", daemon=True)
+        self._thread.start()
+
+    def stage(self, request):
+        with self._cond:
+            self._pending = request
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                req, self._pending = self._pending, None
+            try:
+                if req.get("rows") is None:
+                    req["rows"], req["codes"] = batch_rows(req["job"], req["n"], req["dates"], req["start"])
+                if req.get("work_next"): write_batch_csv(req["work_next"], req["rows"])
+                if req.get("lb_next"): write_codes_csv(req["lb_next"], req["codes"])
+                if req.get("project"): req["templates"].load(req["job"].lightburn_file).write(req["project"], req["codes"])
+            except Exception as e:
+                print(f"[STAGE] Could not stage the next batch: {e}")
+                continue
+            self._deliver(req)
+
+# ----------------- Log Retention -----------------
+RETENTION_START_DELAY_MS = 5000
+
+def retention_plan(logs_dir, mode, retain_days, action="delete", compressed_keep_days=0, keep=()):
+    """Returns [(op, folder)] for retention under logs_dir. op is "delete" or "compress".
+
+    Day folders are logs_dir/<year>/<yymmdd>; today's is never touched. "off" also
+    deletes every other folder under logs_dir except those in keep. With action
+    "compress", old day folders still holding .csv files are compressed, and
+    compressed ones older than compressed_keep_days (if set) are deleted.
+    """
+    if not os.path.isdir(logs_dir): return []
+    today = date.today()
+    cutoff = today - timedelta(days=max(1, retain_days) - 1)
+    keep = {os.path.normcase(os.path.abspath(k)) for k in keep}
+    plan = []
+    for name in sorted(os.listdir(logs_dir)):
+        path = os.path.join(logs_dir, name)
+        if not os.path.isdir(path) or os.path.normcase(os.path.abspath(path)) in keep: continue
+        if not (len(name) == 4 and name.isdigit()):
+            if mode == "off": plan.append(("delete", path))
+            continue
+        for d in sorted(os.listdir(path)):
+            dpath = os.path.join(path, d)
+            try: day = datetime.strptime(d, "%y%m%d").date()
+            except ValueError: continue
+            if day == today or not os.path.isdir(dpath): continue
+            if mode == "off" or action != "compress":
+                if mode == "off" or mode == "today_only" or day < cutoff: plan.append(("delete", dpath))
+            elif mode == "today_only" or day < cutoff:
+                if compressed_keep_days and day < today - timedelta(days=compressed_keep_days - 1):
+                    plan.append(("delete", dpath))
+                elif any(f.lower().endswith(".csv") for f in os.listdir(dpath)):
+                    plan.append(("compress", dpath))
+    return plan
+
+def gzip_file(path):
+    """Compresses path to path.gz (streamed, via a temp file) and removes the original. Returns bytes saved."""
+    tmp = f"{path}.gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 16)
+    before, after = os.path.getsize(path), os.path.getsize(tmp)
+    os.replace(tmp, f"{path}.gz")
+    os.remove(path)
+    return before - after
+
+class RetentionJob:
+    """Works through a retention plan on a background thread, one file at a time.
+
+    A plan target may be a folder or a single file. more(), if given, is called
+    on the worker first and its targets are added to the plan, for planning that
+    has to read files. throttle_ms is slept between files so retention never
+    competes with the station's own log writes. on_progress(dict) is called from
+    the worker after each target and once more when the job finishes or is cancelled.
+    """
+    def __init__(self, plan, throttle_ms, on_progress, more=None):
+        self.plan = plan
+        self.more = more
+        self.throttle_s = max(0, throttle_ms) / 1000.0
+        self.on_progress = on_progress
+        self.progress = {"running": True, "folders": len(plan), "done": 0, "files": 0, "freed_bytes": 0, "current": ""}
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="Retention", daemon=True)
+        self._thread.start()
+
+    def running(self): return self._thread.is_alive()
+
+    def cancel(self): self._cancel.set()
+
+    def _run(self):
+        p = self.progress
+        if self.more:
+            try: self.plan = self.plan + self.more()
+            except (OSError, ValueError) as e: print(f"[RETAIN] Could not plan: {e}")
+            p["folders"] = len(self.plan)
+        for op, folder in self.plan:
+            if self._cancel.is_set(): break
+            p["current"] = f"{op} {folder}"
+            is_dir = os.path.isdir(folder)
+            walk = os.walk(folder, topdown=False) if is_dir else [(os.path.dirname(folder), [], [os.path.basename(folder)])]
+            for root, dirs, files in walk:
+                for name in files:
+                    if self._cancel.wait(self.throttle_s): break
+                    path = os.path.join(root, name)
+                    try:
+                        if op == "delete":
+                            size = os.path.getsize(path); os.remove(path); p["freed_bytes"] += size
+                        elif name.lower().endswith(".csv"):
+                            p["freed_bytes"] += gzip_file(path)
+                        else:
+                            continue
+                        p["files"] += 1
+                    except OSError as e:
+                        print(f"[RETAIN] Could not {op} {path}: {e}")
+                if op == "delete" and is_dir and not self._cancel.is_set():
+                    try: os.rmdir(root)
+                    except OSError: pass
+            if self._cancel.is_set(): break
+            p["done"] += 1
+            self.on_progress(dict(p))
+        p.update(running=False, current="")
+        self.on_progress(dict(p))
+
+def deep_merge(a, b):
+    """Returns a new dict of b merged over a. Nothing in the result is shared with a or b."""
+    out = copy.deepcopy(a)
+    for k, v in b.items():
+        if k in out and isinstance(out[k], dict) and isinstance(v, dict):
+            out[k] = deep_merge(out[k], v)
+        else:
+            out[k] = copy.deepcopy(v)
+    return out
+
+def _fullcode_prefix_parts(job_cfg):
+    pn = job_cfg.get("part_number")
+    rev = job_cfg.get("revision")
+    ver = job_cfg.get("version")
+    cav = job_cfg.get("cavity")
+    mach = job_cfg.get("machine")
+
+    parts = []
+
+    # Part Number (e.g., "220327-01")
+    if pn:
+        parts.append(str(pn))
+
+    # Revision (R)
+    if rev is not None:  # Check for existence, allowing '0'
+        parts.append(str(rev))
+
+    # Version (V)
+    if ver:
+        parts.append(str(ver))
+
+    # Cavity (C) - No "C" prefix
+    if cav is not None:  # Check for existence, allowing '0'
+        parts.append(str(cav))
+
+    # Machine (M)
+    if mach is not None: # Check for existence, allowing '0'
+        parts.append(str(mach))
+
+    return parts
+
+def build_fullcode(job_cfg, date_code, serial_5_digit_str):
+    """Builds the full serial number string based on the new rules."""
+    parts = _fullcode_prefix_parts(job_cfg)
+
+    # Date Code (YYMMDD)
+    parts.append(str(date_code))
+
+    # Serial Number (XXXXX)
+    parts.append(str(serial_5_digit_str))
+
+    # Join all collected parts with a hyphen
+    return "-".join(parts)
+
+# ----------------- Job Select I/O Map -----------------
+MAX_SELECT_BITS = 8
+
+def io_role_map(cfg):
+    """Returns (select_inputs, door_input, spare_inputs) from IO_MAP, falling back to the legacy 3 + door layout."""
+    io = cfg.get("IO_MAP", {}) or {}
+    select = [int(i) for i in io.get("job_select_inputs", [0, 1, 2])]
+    door = io.get("door_input", 3)
+    door = int(door) if door is not None and door != "" else None
+    spares = [int(i) for i in io.get("spare_inputs", [])]
+    return select, door, spares
+
+def validate_io_map(cfg):
+    """Returns a list of problems with the IO_MAP roles (empty if valid)."""
+    errors = []
+    n_inputs = len(cfg.get("INPUTS", {}).get("names", []))
+    try:
+        select, door, spares = io_role_map(cfg)
+    except (TypeError, ValueError):
+        return ["I/O map input indices must be integers."]
+    if not 1 <= len(select) <= MAX_SELECT_BITS:
+        errors.append(f"Job select needs 1-{MAX_SELECT_BITS} inputs (got {len(select)}).")
+    if len(set(select)) != len(select):
+        errors.append("Job select inputs are listed more than once.")
+    roles = select + ([door] if door is not None else []) + spares
+    for i in roles:
+        if not 0 <= i < n_inputs:
+            errors.append(f"Input index {i} is not configured (have {n_inputs} inputs).")
+    if door is not None and door in select:
+        errors.append(f"Input {door} cannot be both the door and a job select bit.")
+    for i in spares:
+        if i in select or i == door:
+            errors.append(f"Spare input {i} is already assigned another role.")
+    if (cfg.get("IO_MAP", {}) or {}).get("encoding", "pattern") not in ("pattern", "binary"):
+        errors.append("I/O map encoding must be 'pattern' or 'binary'.")
+    busy = busy_input_index(cfg)
+    if busy is not None:
+        if not 0 <= busy < n_inputs:
+            errors.append(f"Laser busy input {busy} is not configured (have {n_inputs} inputs).")
+        if busy in roles:
+            errors.append(f"Laser busy input {busy} is already assigned another role.")
+    source = (cfg.get("JOB_DONE", {}) or {}).get("source", "timer")
+    if source not in ("timer", "serial", "input"):
+        errors.append("Job done source must be 'timer', 'serial' or 'input'.")
+    elif source == "input" and busy is None:
+        errors.append("Job done source 'input' needs a laser busy input.")
+    return errors
+
+def busy_input_index(cfg):
+    """Returns IO_MAP.busy_input (active, 0, while the laser runs) or None."""
+    busy = (cfg.get("IO_MAP", {}) or {}).get("busy_input")
+    try: return int(busy) if busy is not None and busy != "" else None
+    except (TypeError, ValueError): return None
+
+def job_select_pattern(job_cfg, n_bits, encoding):
+    """Returns the input pattern (MSB first) that selects this job, or "" if it has none."""
+    if encoding == "binary":
+        fid = job_cfg.get("fixture_id")
+        if fid is None or fid == "": return ""
+        return format(int(fid), f"0{n_bits}b")
+    return str(job_cfg.get("select_pattern", "") or "").strip()
+
+def build_job_select_table(cfg):
+    """Precomputes the {pattern: job_key} lookup for job selection.
+
+    Returns (table, errors). Jobs with an invalid or colliding pattern are left
+    out of the table and reported in errors; the first job to claim a pattern keeps it.
+    """
+    errors = validate_io_map(cfg)
+    table = {}
+    if errors: return table, errors
+    select, _, _ = io_role_map(cfg)
+    n_bits = len(select)
+    encoding = cfg.get("IO_MAP", {}).get("encoding", "pattern")
+    idle = "0" * n_bits
+    for key, jcfg in cfg.get("JOBS", {}).items():
+        try:
+            sp = job_select_pattern(jcfg, n_bits, encoding)
+        except (TypeError, ValueError):
+            errors.append(f"{key}: fixture ID must be a whole number."); continue
+        if not sp: continue
+        if len(sp) != n_bits or set(sp) - {"0", "1"}:
+            errors.append(f"{key}: pattern '{sp}' must be {n_bits} digits of 0/1."); continue
+        if sp == idle:
+            errors.append(f"{key}: pattern '{sp}' is reserved for 'no fixture'."); continue
+        if sp in table:
+            errors.append(f"{key}: pattern '{sp}' collides with {table[sp]}."); continue
+        table[sp] = key
+    return table, errors
+
+# ----------------- Compiled Config -----------------
+class _Frozen:
+    """Base for compiled config objects: attributes are set once in __init__ and never again."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+class CompiledJob(_Frozen):
+    """One job's settings, coerced to their final types with the serial prefix prebuilt."""
+    __slots__ = ("key", "display_name", "part_number", "revision", "version", "cavity", "machine",
+                 "default_batch", "lightburn_file", "focus_height", "job_delay_ms", "air_before_ms",
+                 "air_after_ms", "code_prefix")
+
+    def __init__(self, key, jcfg):
+        def num(field, default, kind=int):
+            try: return kind(jcfg.get(field, default))
+            except (TypeError, ValueError): return default
+        self._set("key", key)
+        self._set("display_name", jcfg.get("display_name", key))
+        self._set("part_number", jcfg.get("part_number"))
+        self._set("revision", jcfg.get("revision"))
+        self._set("version", jcfg.get("version"))
+        self._set("cavity", jcfg.get("cavity"))
+        self._set("machine", jcfg.get("machine"))
+        self._set("default_batch", max(1, num("default_batch", 1)))
+        self._set("lightburn_file", jcfg.get("lightburn_file", "") or "")
+        self._set("focus_height", num("focus_height", 0.0, float))
+        self._set("job_delay_ms", int(num("job_delay_sec", 1, float) * 1000))
+        self._set("air_before_ms", int(num("air_before_sec", 0, float) * 1000))
+        self._set("air_after_ms", int(num("air_after_sec", 0, float) * 1000))
+        parts = _fullcode_prefix_parts(jcfg)
+        self._set("code_prefix", "-".join(parts) + "-" if parts else "")
+
+    def fullcode(self, date_code, serial_5_digit_str):
+        return f"{self.code_prefix}{date_code}-{serial_5_digit_str}"
+
+class CompiledConfig(_Frozen):
+    """Read-only, validated view of CONFIG for hot paths.
+
+    Built once per load/save and swapped in whole, so callers never search
+    the relay name lists or walk nested dicts while a job is running.
+    Raises ValueError if the config is structurally unusable.
+    """
+    __slots__ = ("raw", "jobs", "relay_names", "relay_index", "relay_pulse_ms", "relay_modes", "relay_disabled",
+                 "input_names", "select_inputs", "door_input", "spare_inputs", "idle_pattern",
+                 "job_select_table", "select_errors", "serial_enabled", "poll_ms", "simulate",
+                 "batch_done_on_done", "up_next_tail", "retain_mode", "retain_days", "retain_action",
+                 "compressed_keep_days", "retention_throttle_ms", "ledger", "ledger_views_live", "daily_max_rows",
+                 "write_planned", "history_enabled", "history_path", "history_partitioned",
+                 "history_compress_months", "open_door_on_complete",
+                 "open_lb_on_start", "lb_exe_path", "lb_start_delay_ms", "lb_post_open_delay_ms",
+                 "lb_close_on_complete", "lb_position", "af_enabled", "reload_enabled", "reload_poll_ms",
+                 "status_enabled", "status_host", "status_port", "busy_input", "done_source", "done_token",
+                 "done_timeout_factor", "adaptive_mode", "adaptive_pct", "adaptive_margin_pct",
+                 "adaptive_min_samples", "adaptive_window", "lb_udp", "lb_udp_start", "lb_template",
+                 "lb_template_token", "sync_local_root", "sync_interval_ms", "alloc_mode", "alloc_url",
+                 "alloc_station", "alloc_block_size", "alloc_serve", "alloc_authority_path")
+
+    def __init__(self, cfg):
+        relays = cfg["RELAYS"]
+        names = tuple(relays["names"])
+        n = len(names)
+        disabled = list(relays.get("disabled", [])) + [False] * n
+        if len(relays["modes"]) != n or len(relays["pulse_ms"]) != n:
+            raise ValueError("RELAYS names, modes and pulse_ms must be the same length.")
+        if len(set(names)) != n:
+            raise ValueError("RELAYS names must be unique.")
+        if len(cfg["INPUTS"]["names"]) != len(cfg["INPUTS"]["pins"]):
+            raise ValueError("INPUTS names and pins must be the same length.")
+        try:
+            select, door, spares = io_role_map(cfg)
+        except (TypeError, ValueError):
+            raise ValueError("IO_MAP input indices must be integers.")
+        table, errors = build_job_select_table(cfg)
+        lb = cfg.get("LIGHTBURN", {}) or {}
+        logging_cfg = cfg.get("LOGGING", {}) or {}
+
+        self._set("raw", cfg)
+        self._set("jobs", MappingProxyType({k: CompiledJob(k, j) for k, j in cfg["JOBS"].items()}))
+        self._set("relay_names", names)
+        self._set("relay_index", MappingProxyType({name: i for i, name in enumerate(names)}))
+        self._set("relay_pulse_ms", tuple(int(ms) for ms in relays["pulse_ms"]))
+        self._set("relay_modes", tuple(relays["modes"]))
+        self._set("relay_disabled", tuple(bool(d) for d in disabled[:n]))
+        self._set("input_names", tuple(cfg["INPUTS"]["names"]))
+        self._set("select_inputs", tuple(select))
+        self._set("door_input", door)
+        self._set("spare_inputs", tuple(spares))
+        self._set("idle_pattern", "0" * len(select))
+        self._set("job_select_table", MappingProxyType(table))
+        self._set("select_errors", tuple(errors))
+        self._set("serial_enabled", bool(cfg["SERIAL"].get("enabled", False)))
+        self._set("poll_ms", max(1, int(cfg["SERIAL"].get("poll_ms", 10))))
+        self._set("simulate", bool(cfg["SIMULATE"].get("enabled", False)))
+        self._set("batch_done_on_done", bool(cfg["SIMULATE"].get("batch_done_on_done", True)))
+        self._set("up_next_tail", int(cfg["UI"].get("up_next_tail", 28)))
+        self._set("retain_mode", logging_cfg.get("retain_mode", "off"))
+        self._set("retain_days", max(1, int(logging_cfg.get("retain_days", 7))))
+        self._set("retain_action", "compress" if logging_cfg.get("retain_action") == "compress" else "delete")
+        self._set("compressed_keep_days", max(0, int(logging_cfg.get("compressed_keep_days", 0))))
+        self._set("retention_throttle_ms", max(0, int(logging_cfg.get("retention_throttle_ms", 20))))
+        self._set("ledger", logging_cfg.get("store", "csv") == "ledger")
+        self._set("ledger_views_live", logging_cfg.get("ledger_views", "live") != "on_demand")
+        self._set("daily_max_rows", int(logging_cfg.get("daily_max_rows", 20000)))
+        self._set("write_planned", bool(logging_cfg.get("write_planned", True)))
+        self._set("history_enabled", bool(cfg.get("HISTORY", {}).get("enabled", False)))
+        self._set("history_path", local_path(cfg, (cfg.get("FILE_PATHS", {}).get("entire_history_path", "") or "").strip()))
+        self._set("history_partitioned", cfg.get("HISTORY", {}).get("partition", "monthly") == "monthly")
+        self._set("history_compress_months", max(0, int(cfg.get("HISTORY", {}).get("compress_after_months", 0))))
+        self._set("open_door_on_complete", bool(cfg.get("MACHINE", {}).get("open_door_on_complete", True)))
+        self._set("open_lb_on_start", bool(cfg.get("OPEN_LB_FILE_ON_START")))
+        self._set("lb_exe_path", (lb.get("exe_path", "") or "").strip())
+        self._set("lb_start_delay_ms", int(float(lb.get("start_delay_sec", 2)) * 1000))
+        self._set("lb_post_open_delay_ms", int(float(lb.get("post_open_delay_sec", 3)) * 1000))
+        self._set("lb_close_on_complete", bool(lb.get("close_on_complete", False)))
+        self._set("lb_position", (int(lb.get("window_width", 520)), int(lb.get("window_height", 380)),
+                                  int(lb.get("window_margin", 8))) if lb.get("enable_positioning", False) else None)
+        udp = lb.get("control", "window") == "udp"
+        self._set("lb_udp", (str(lb.get("udp_host") or "127.0.0.1"), int(lb.get("udp_port", 19840)),
+                             int(lb.get("udp_reply_port", 19841)), max(50, int(lb.get("udp_timeout_ms", 1000)))) if udp else None)
+        self._set("lb_udp_start", udp and bool(lb.get("udp_start", False)))
+        self._set("lb_template", lb.get("project_mode", "csv") == "template")
+        self._set("lb_template_token", str(lb.get("template_token") or DEFAULT_TOKEN))
+        self._set("af_enabled", bool(cfg.get("AUTOFOCUS", {}).get("enabled", True)))
+        self._set("reload_enabled", bool(cfg.get("CONFIG_RELOAD", {}).get("enabled", True)))
+        self._set("reload_poll_ms", max(250, int(cfg.get("CONFIG_RELOAD", {}).get("poll_ms", 2000))))
+        status = cfg.get("STATUS_SERVER", {})
+        self._set("status_enabled", bool(status.get("enabled", False)))
+        self._set("status_host", str(status.get("host") or "127.0.0.1"))
+        self._set("status_port", int(status.get("port", 8765)))
+        sync = cfg.get("SYNC", {}) or {}
+        self._set("sync_local_root", (sync.get("local_root") or "").strip())
+        self._set("sync_interval_ms", max(200, int(sync.get("interval_ms", 2000))))
+        alloc = cfg.get("SERIAL_ALLOCATOR", {}) or {}
+        mode = alloc.get("mode", "off")
+        self._set("alloc_mode", mode if mode in ("off", "local", "server") else "off")
+        self._set("alloc_url", str(alloc.get("url") or "http://127.0.0.1:8766"))
+        self._set("alloc_station", str(alloc.get("station") or platform.node()))
+        self._set("alloc_block_size", max(1, int(alloc.get("block_size", 200))))
+        self._set("alloc_serve", (str(alloc.get("host") or "0.0.0.0"), int(alloc.get("port", 8766))) if alloc.get("serve") else None)
+        self._set("alloc_authority_path", (alloc.get("authority_path") or "").strip()
+                  or os.path.join(cfg.get("ROOT") or ".", "Config", "SerialAuthority.json"))
+        busy = busy_input_index(cfg)
+        self._set("busy_input", busy if busy is not None and 0 <= busy < len(self.input_names) else None)
+        self._set("done_token", str(cfg["SERIAL"].get("done_token") or "").strip().upper())
+        done = cfg.get("JOB_DONE", {}) or {}
+        source = done.get("source", "timer")
+        if (source == "input" and self.busy_input is None) or (source == "serial" and not self.done_token):
+            source = "timer"
+        self._set("done_source", source if source in ("timer", "serial", "input") else "timer")
+        try: self._set("done_timeout_factor", max(1.0, float(done.get("timeout_factor", 1.0))))
+        except (TypeError, ValueError): self._set("done_timeout_factor", 1.0)
+        adaptive = cfg.get("ADAPTIVE_TIMING", {}) or {}
+        mode = adaptive.get("mode", "suggest")
+        self._set("adaptive_mode", mode if mode in ("off", "suggest", "apply") else "off")
+        self._set("adaptive_pct", min(100.0, max(50.0, float(adaptive.get("percentile", 95)))) / 100.0)
+        self._set("adaptive_margin_pct", max(0.0, float(adaptive.get("margin_pct", 15))))
+        self._set("adaptive_min_samples", max(1, int(adaptive.get("min_samples", 10))))
+        self._set("adaptive_window", max(5, int(adaptive.get("window", 50))))
+
+    def job(self, key):
+        return self.jobs.get(key)
+
+
+# ----------------- Serial Link -----------------
+class SerialHelper:
+    """Serial link to the ESP32. Received lines are read on a background thread and passed to line_cb."""
+    def __init__(self, cfg, status_cb, line_cb, error_cb=None, lost_cb=None):
+        self.enabled = bool(cfg.get("enabled", False))
+        self.baud = int(cfg.get("baud", 115200))
+        self._status_cb = status_cb; self._line_cb = line_cb
+        self._error_cb = error_cb; self._lost_cb = lost_cb
+        self.ser = None
+
+    def _update_status(self, text, ok=False, warn=False):
+        if self._status_cb: self._status_cb(text, ok=ok, warn=warn)
+
+    def _error(self, title, message):
+        if self._error_cb: self._error_cb(title, message)
+
+    def is_open(self):
+        return bool(self.ser and self.ser.is_open)
+
+    def try_open_manual(self, port_name):
+        self.close()
+
+        if not self.enabled:
+            self._update_status("Disabled (in Settings)", warn=True)
+            return False
+        if serial is None:
+            self._error("Serial Connection Error", "The 'pyserial' library is not installed.\nInstall it using: pip install pyserial")
+            return False
+
+        try:
+            self.ser = serial.Serial(port_name, self.baud, timeout=2)
+
+            print(f"Connecting to {port_name}. Waiting for ESP32 initialization...")
+            time.sleep(2)
+
+            self.ser.reset_input_buffer()
+
+            if self.ser.is_open:
+                print("Performing handshake...")
+                self.ser.write(b'PING\n')
+                response = self.ser.readline().decode('utf-8').strip()
+                print(f"Handshake response: '{response}'")
+
+                if response == "READY":
+                    print("✅ Handshake successful!")
+                    self._update_status(f"Connected ({port_name})", ok=True)
+                    self._start_reader(self.ser)
+                    return True
+                else:
+                    print("❌ Handshake failed.")
+                    self._error(
+                        "Handshake Error",
+                        f"The device on {port_name} did not respond correctly.\n\n"
+                        f"Expected 'READY', but received '{response}'.\n\n"
+                        "Please check the board and its firmware."
+                    )
+                    self.close()
+                    return False
+            return False
+
+        except Exception as e:
+            self.ser = None
+            self._update_status("Disconnected", warn=False)
+            self._error("Serial Connection Error", f"Could not open serial port {port_name}: {e}")
+            return False
+
+    def _start_reader(self, ser):
+        def run():
+            while ser.is_open:
+                try:
+                    line = ser.readline().decode(errors="ignore").strip()
+                except Exception:
+                    break
+                if line and self._line_cb: self._line_cb(line)
+            if ser is self.ser and self._lost_cb: self._lost_cb()
+        threading.Thread(target=run, name="SerialReader", daemon=True).start()
+
+    def close(self):
+        ser, self.ser = self.ser, None
+        try:
+            if ser and ser.is_open:
+                ser.close()
+        except Exception: pass
+        self._update_status("Disconnected", warn=True)
+
+    def _write(self, data: bytes):
+        try:
+            if self.ser and self.ser.is_open:
+                self.ser.write(data);
+                return True
+            else:
+                self._update_status("Not Connected", warn=False)
+                return False
+        except Exception:
+            self.close()
+            return False
+
+    def get_all_states(self): return self._write(b"GETSTATE\n")
+    def relay_set(self, i, v): return self._write(f"RSET {int(i)} {1 if v else 0}\n".encode())
+    def relay_toggle(self, i): return self._write(f"RTGL {int(i)}\n".encode())
+    def pulse(self, i, ms): return self._write(f"PULSE {int(i)} {int(ms)}\n".encode())
+    def sim_input(self, i, v): return self._write(f"SIMI {int(i)} {1 if v else 0}\n".encode())
+
+# ----------------- Machine Timing -----------------
+JITTER_SAMPLES = 500
+
+class JitterStats:
+    """Scheduled-vs-actual lateness (ms) of one named timer."""
+    __slots__ = ("count", "total", "worst", "recent")
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.recent = collections.deque(maxlen=JITTER_SAMPLES)
+
+    def add(self, late_ms):
+        self.count += 1
+        self.total += late_ms
+        self.worst = max(self.worst, late_ms)
+        self.recent.append(late_ms)
+
+    def summary(self):
+        r = sorted(self.recent)
+        return {"count": self.count, "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+                "p50_ms": round(percentile(r, 0.50), 3), "p99_ms": round(percentile(r, 0.99), 3),
+                "max_ms": round(self.worst, 3)}
+
+class TimerWheel:
+    """Dedicated monotonic timer thread for all machine timing.
+
+    Due timers are handed to deliver(entry), which queues them on the engine
+    ahead of pending commands. The engine calls ran(entry) when it starts the
+    callback, so the lateness of every timer is recorded per name.
+    """
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._jitter = {}
+        self._jitter_lock = threading.Lock()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="TimerWheel", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread: self._thread.join(timeout)
+
+    def schedule(self, ms, fn, args=(), token=None, name=None):
+        """Returns the timer entry [due, seq, fn, args, token, name]."""
+        entry = [time.monotonic() + max(0, ms) / 1000.0, next(self._seq), fn, args, token,
+                 name or getattr(fn, "__name__", "timer")]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry: self._cond.notify()
+        return entry
+
+    def ran(self, entry):
+        late_ms = (time.monotonic() - entry[0]) * 1000.0
+        with self._jitter_lock:
+            stats = self._jitter.get(entry[5])
+            if stats is None: stats = self._jitter[entry[5]] = JitterStats()
+            stats.add(late_ms)
+
+    def report(self):
+        """Returns {timer name: lateness summary}. Safe to call from any thread."""
+        with self._jitter_lock:
+            return {name: stats.summary() for name, stats in self._jitter.items()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if not self._running: return
+                entry = heapq.heappop(self._heap)
+            token = entry[4]
+            if token is not None and token.cancelled: continue
+            self._deliver(entry)
+
+# ----------------- Job Recipes -----------------
+class CancelToken:
+    """Shared by every timer of one recipe run; cancel() drops all of them at once."""
+    __slots__ = ("cancelled", "reason")
+    def __init__(self):
+        self.cancelled = False
+        self.reason = ""
+
+    def cancel(self, reason=""):
+        self.cancelled = True
+        self.reason = reason
+
+class Step:
+    """One recipe step. It starts when every earlier step has finished, or, with
+    overlap=True, together with the step before it."""
+    __slots__ = ("name", "kind", "overlap", "args")
+    def __init__(self, name, kind, overlap=False, **args):
+        self.name, self.kind, self.overlap, self.args = name, kind, overlap, args
+
+class RecipeRun:
+    """Runs a list of Steps on the engine thread and records when each one started and ended.
+
+    Kinds: pulse(relay, ms=None, journal=None), set(relay, value), wait(ms, watch=None),
+    wait_input(input, value, timeout_ms=None), wait_done(source, ms, input=None),
+    task(fn), log(), call(fn). A task calls fn(token, done) and ends when done()
+    is called, from any thread. wait_done ends on the job-done signal from
+    source ("serial" or "input"), or after ms if it never comes; a wait with
+    watch=source only notes when that signal came. Either stores signal_ms.
+    Any step may carry status="..." to show when it starts. A log or call step
+    that returns False ends the run there without running the remaining steps;
+    one that raises is logged, recorded with its error, and the run goes on.
+    """
+    def __init__(self, engine, name, steps, on_done=None):
+        self.engine, self.name, self.steps, self.on_done = engine, name, list(steps), on_done
+        self.token = CancelToken()
+        self.records = []
+        self.finished = False
+        self._next = 0
+        self._open = 0
+        self._waiters = []
+        self._done_wait = None
+        self._t0 = None
+
+    def _ms(self):
+        return round((time.monotonic() - self._t0) * 1000)
+
+    def start(self):
+        self._t0 = time.monotonic()
+        self._advance()
+        return self
+
+    def cancel(self, reason=""):
+        if self.finished: return
+        self.token.cancel(reason)
+        self._waiters.clear()
+        self._done_wait = None
+        self._finish()
+
+    def has_pending_steps(self):
+        return not self.finished and self._next < len(self.steps)
+
+    def poll_inputs(self):
+        """Ends wait_input steps whose input has reached the wanted value."""
+        state = self.engine.input_state
+        for w in [w for w in self._waiters if state[w[1]] == w[2]]:
+            self._waiters.remove(w)
+            self._end(w[0])
+        d = self._done_wait
+        if d and d["source"] == "input":
+            if state[d["input"]] == 0: d["busy_seen"] = True
+            elif d["busy_seen"]: self.signal_done("input")
+
+    def signal_done(self, source):
+        """Ends the open wait_done step if it listens to source; "sim" ends any. Returns True if one ended."""
+        d = self._done_wait
+        if not d or (source != "sim" and source != d["source"]): return False
+        self._done_wait = None
+        rec = d["rec"]
+        rec["signal_ms"] = self._ms() - rec["start_ms"]
+        if d["ends"]:
+            rec["done_by"] = source
+            self._end(rec)
+        return True
+
+    def _watch(self, rec, source, input_index, ends):
+        self._done_wait = {"rec": rec, "source": source, "input": input_index, "busy_seen": False, "ends": ends}
+        self.poll_inputs()  # the laser may already report busy
+
+    def _advance(self):
+        while self._next < len(self.steps) and not self.token.cancelled:
+            step = self.steps[self._next]
+            if self._open and not step.overlap: return
+            self._next += 1
+            self._begin(step)
+        if not self._open and not self.finished:
+            self._finish()
+
+    def _begin(self, step):
+        e, a = self.engine, step.args
+        rec = {"step": step.name, "kind": step.kind, "start_ms": self._ms(), "end_ms": None}
+        if step.kind in ("wait", "wait_done", "pulse") and a.get("ms") is not None: rec["planned_ms"] = a["ms"]
+        self.records.append(rec)
+        self._open += 1
+        if a.get("status"): e.set_status(a["status"])
+
+        if step.kind == "wait":
+            e.call_later(a["ms"], self._end, rec, token=self.token, name=f"{self.name}.{step.name}")
+            if a.get("watch"): self._watch(rec, a["watch"], a.get("input"), ends=False)
+            return
+        if step.kind == "wait_input":
+            if e.input_state[a["input"]] != a["value"]:
+                self._waiters.append((rec, a["input"], a["value"]))
+                if a.get("timeout_ms") is not None:
+                    e.call_later(a["timeout_ms"], self._timeout, rec, token=self.token, name=f"{self.name}.{step.name}")
+                return
+            result = None
+        elif step.kind == "wait_done":
+            e.call_later(a["ms"], self._timeout, rec, token=self.token, name=f"{self.name}.{step.name}")
+            self._watch(rec, a["source"], a.get("input"), ends=True)
+            return
+        elif step.kind == "pulse":
+            if a.get("journal"): e._snapshot(a["journal"])  # write-ahead before the relay fires
+            e.pulse_relay_by_name(a["relay"], a.get("ms"))
+            result = None
+        elif step.kind == "set":
+            e.set_relay_by_name(a["relay"], a["value"])
+            result = None
+        elif step.kind == "task":
+            a["fn"](self.token, lambda: e.call_soon(self._end, rec))
+            return
+        elif step.kind in ("log", "call"):
+            try: result = e._log_cycle_items() if step.kind == "log" else a["fn"]()
+            except Exception as ex:
+                rec["error"] = f"{type(ex).__name__}: {ex}"
+                print(f"[RECIPE] {self.name}.{step.name} failed: {rec['error']}")
+                result = None
+        else:
+            raise ValueError(f"Unknown recipe step kind: {step.kind}")
+        self._close(rec)
+        if result is False: self._next = len(self.steps)
+
+    def _close(self, rec):
+        rec["end_ms"] = self._ms()
+        self._open -= 1
+        if self._done_wait and self._done_wait["rec"] is rec: self._done_wait = None
+
+    def _end(self, rec):
+        if rec["end_ms"] is not None or self.token.cancelled: return
+        self._close(rec)
+        self._advance()
+
+    def _timeout(self, rec):
+        self._waiters = [w for w in self._waiters if w[0] is not rec]
+        if self._done_wait and self._done_wait["rec"] is rec: rec["done_by"] = "timeout"
+        rec["timed_out"] = True
+        self._end(rec)
+
+    def _finish(self):
+        self.finished = True
+        steps = " ".join(f"{r['step']}@{r['start_ms']}+{(r['end_ms'] if r['end_ms'] is not None else r['start_ms']) - r['start_ms']}"
+                         for r in self.records)
+        outcome = f"cancelled ({self.token.reason})" if self.token.cancelled else "done"
+        print(f"[RECIPE] {self.name} {outcome} in {self._ms()} ms: {steps}")
+        if self.on_done: self.on_done(self)
+
+# ----------------- LightBurn Process -----------------
+LB_READY_POLL_MS = 100
+
+class LightBurnProcess:
+    """The LightBurn instance this station launched.
+
+    launch() starts the exe with a project and remembers the process and
+    project, so a later open of the same project can be skipped while that
+    process is still running. Launching another project closes the tracked
+    process first, so there is never more than one. probe(proc) says whether
+    it is ready (by default: still running); mark_ready() records the
+    launch-to-ready time.
+    """
+    CLOSE_WAIT_S = 1.0
+
+    def __init__(self, probe=None):
+        self.probe = probe or (lambda proc: proc.poll() is None)
+        self.proc = None
+        self.project = None
+        self.launched_at = None
+        self.ready_ms = None
+
+    @staticmethod
+    def _norm(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def has_loaded(self, path):
+        return self.running() and self.project == self._norm(path)
+
+    def close(self):
+        """Ends the tracked process, forcibly if it has not exited within CLOSE_WAIT_S."""
+        proc, self.proc, self.project = self.proc, None, None
+        if proc is None or proc.poll() is not None: return
+        proc.terminate()
+        try: proc.wait(self.CLOSE_WAIT_S)
+        except subprocess.TimeoutExpired: proc.kill()
+
+    def launch(self, exe, path):
+        if self.running():
+            print(f"[LB] Closing LightBurn (pid {self.proc.pid}) to open {os.path.basename(path)}.")
+            self.close()
+        self.proc = subprocess.Popen([exe, path], shell=False)
+        self.project = self._norm(path)
+        self.launched_at = time.monotonic()
+        self.ready_ms = None
+        return self.proc.pid
+
+    def mark_ready(self):
+        if self.ready_ms is None: self.ready_ms = round((time.monotonic() - self.launched_at) * 1000)
+        return self.ready_ms
+
+    def info(self):
+        if not self.running(): return {}
+        return {"pid": self.proc.pid, "project": os.path.basename(self.project), "ready_ms": self.ready_ms}
+
+# ----------------- Station Engine -----------------
+BANNER_IDLE = ("Idle", "#7f8c8d")
+BANNER_ENGRAVING = ("Engraving… please wait", "#c0392b")
+BANNER_WARNING = ("Warning", "#f39c12")
+BANNER_OK = ("Complete", "#27ae60")
+
+class StationEngine:
+    """Runs the station: serial link, job selection, relay sequencing, batches and logs.
+
+    All state lives on the engine thread. Front ends talk to it over a local
+    message channel: submit(command, **args) queues a command, and each queue
+    from subscribe() receives (event, payload) tuples of plain values:
+
+      ("state",  {changed keys})   status, banner, conn, connected, door_closed,
+                                   is_engraving, job, job_details, batch_size,
+                                   next_serial, preview, inputs, relays, batch,
+                                   cycle, adaptive, lightburn
+      ("config", {"config": dict}) the running config after every change
+      ("prompt", {"kind": ...})    autofocus / focus_check / recovery questions
+      ("error",  {"title", "message"})
+
+    A front end that stops reading (e.g. a modal dialog) never delays a relay
+    sequence: timers run on a TimerWheel thread and serial input on a reader
+    thread, and both are handed to the engine thread, not the UI thread.
+    """
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self._inbox = queue.PriorityQueue()
+        self._inbox_seq = itertools.count()
+        self.timers = TimerWheel(lambda entry: self._post(("timer", entry), priority=0))
+        self._subscribers = []
+        self._sub_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.state = {}
+        self._state_lock = threading.Lock()
+        self.counters = {"items_completed": 0, "batches_completed": 0, "batches_aborted": 0,
+                         "serial_lines": 0, "config_reloads": 0, "done_timeouts": 0,
+                         "stage_hits": 0, "stage_misses": 0, "lb_launches": 0, "lb_reuses": 0,
+                         "lb_projects": 0, "batch_writes": 0, "batch_writes_skipped": 0,
+                         "ledger_writes": 0}
+        self.status_server = None
+
+        self.config_writer = ConfigWriter(config_path, on_error=lambda e: self.emit("error", title="Save Config", message=f"Failed to save config:\n{e}"))
+        self.CONFIG = load_config_file(config_path)
+        if not self._apply_config():
+            self.CONFIG = copy.deepcopy(DEFAULT_CONFIG); self._apply_config()
+        self._applied_config = copy.deepcopy(self.CONFIG)
+        self._config_file_sig = None
+        self._config_file_hash = None
+        self.DIRS, self.LB_BATCH, self.WORKING_BATCH, self.WORKING_COMPLETED_TODAY = self.derive_paths()
+
+        self.relay_state = [0] * len(self.CC.relay_names)
+        self.input_state = [1] * len(self.CC.input_names)
+        self.input_override = [False] * len(self.CC.input_names)
+
+        self.door_closed = False
+        self.is_engraving = False
+        self.is_startup_complete = False
+        self.focus_pending = False
+        self.selected_job = ""
+        self.last_valid_job = ""
+        self.batch_size_text = ""
+        self.last_job_pattern = ""
+        self.last_stable_job_time = 0
+        self.job_cooldown_ms = 500
+        self.inflight = {}
+        self.dates = DateContext()
+        self._rollover_pending = False
+        self._pending_recovery = None
+        self.pending_prompt = None
+        self.cycle = None
+        self.cycle_records = []
+        self._cycle_sample = None
+        self.phase_history = self._load_phase_history()
+        self.staged = None
+        self._stage_gen = 0
+        self.stager = BatchStager(lambda staged: self._post(("staged", staged)))
+        self.windows = WindowManager(default_backend())
+        self.window_worker = WindowWorker()
+        self.lightburn = LightBurnProcess(probe=self._lightburn_has_window)
+        self.lb_udp = None
+        self.templates = TemplateCache()
+        self._batch_file_sigs = {}
+        self.retention = None
+        self.history = None
+        self.ledger = None
+        self.ledger_views = None
+        self.sync = None
+        self.allocator = None
+        self.alloc_server = None
+        self._working_rows = []
+        self._lb_udp_project = None
+
+        self.serial = SerialHelper(self.CONFIG["SERIAL"], self.update_conn_pill,
+                                   lambda line: self._post(("line", line)),
+                                   lambda title, message: self.emit("error", title=title, message=message),
+                                   lambda: self._post(("serial_lost",)))
+
+    # ---------- Channel ----------
+    def subscribe(self, replay=True):
+        """Returns a new event queue. Unless replay is False it first receives the full current state and config."""
+        q = queue.Queue()
+        with self._sub_lock:
+            self._subscribers.append(q)
+        if replay: self.submit("resend_state", target=q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._sub_lock:
+            if q in self._subscribers: self._subscribers.remove(q)
+
+    def snapshot(self):
+        """Returns a JSON-ready copy of the published state and counters. Safe to call from any thread."""
+        with self._state_lock:
+            state = copy.deepcopy(self.state)
+        cc = self.CC
+        return {"state": state, "counters": dict(self.counters), "timing": self.timers.report(),
+                "windows": {"calls": self.window_worker.stats(), "cache_hits": self.windows.hits,
+                            "cache_misses": self.windows.misses},
+                "input_names": list(cc.input_names), "relay_names": list(cc.relay_names),
+                "serials": {"leases": self.allocator.leases, "error": self.allocator.error} if self.allocator else {}}
+
+    def submit(self, command, **args):
+        """Queues a command for the engine thread. Safe to call from any thread."""
+        self._post(("cmd", command, args))
+
+    def _post(self, item, priority=1):
+        """Queues an item for the engine thread. Due timers (priority 0) go ahead of commands and serial lines."""
+        self._inbox.put((priority, next(self._inbox_seq), item))
+
+    def emit(self, event, **payload):
+        with self._sub_lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers: q.put((event, payload))
+
+    def start(self):
+        self._running = True
+        self.timers.start()
+        self._thread = threading.Thread(target=self._run, name="StationEngine", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self.submit("shutdown")
+        if self._thread: self._thread.join(timeout)
+        self.timers.stop()
+        if self.lb_udp: self.lb_udp.close()
+        self.window_worker.stop()
+        if self.retention: self.retention.cancel()
+        if self.ledger_views: self.ledger_views.stop()
+        if self.sync: self.sync.stop()
+        if self.alloc_server: self.alloc_server.stop()
+        if self.status_server: self.status_server.stop()
+        self.config_writer.flush()
+
+    def _run(self):
+        self._startup()
+        while self._running:
+            _, _, item = self._inbox.get()
+            self._dispatch(item)
+
+    def _dispatch(self, item):
+        try:
+            if item[0] == "cmd":
+                _, command, args = item
+                handler = getattr(self, f"cmd_{command}", None)
+                if handler is None:
+                    print(f"[ENGINE] Unknown command: {command}"); return
+                handler(**args)
+            elif item[0] == "timer":
+                self._run_timer(item[1])
+            elif item[0] == "staged":
+                self._on_staged(item[1])
+            elif item[0] == "call":
+                item[1](*item[2])
+            elif item[0] == "line":
+                self.on_serial_line(item[1])
+            elif item[0] == "serial_lost":
+                if self.serial.ser and not self.serial.ser.is_open:
+                    self.serial.close()
+        except Exception as e:
+            print(f"[ENGINE] Error handling {item[:2]}: {e}")
+
+    # ---------- Timers ----------
+    def call_later(self, ms, fn, *args, token=None, name=None):
+        """Runs fn(*args) on the engine thread after ms milliseconds, unless token has been cancelled by then.
+        Lateness is recorded under name (default: the function name)."""
+        return self.timers.schedule(ms, fn, args, token=token, name=name)
+
+    def call_soon(self, fn, *args):
+        """Runs fn(*args) on the engine thread. Safe to call from any thread."""
+        self._post(("call", fn, args))
+
+    def _run_timer(self, entry):
+        _, _, fn, args, token, name = entry
+        if token is not None and token.cancelled: return
+        self.timers.ran(entry)
+        try: fn(*args)
+        except Exception as e: print(f"[ENGINE] Timer {name} failed: {e}")
+
+    # ---------- State publishing ----------
+    def _set(self, **changes):
+        changed = {k: v for k, v in changes.items() if self.state.get(k) != v}
+        if not changed: return
+        with self._state_lock:
+            self.state.update(changed)
+        self.emit("state", **changed)
+
+    def set_status(self, text): self._set(status=text)
+    def set_banner(self, text, color): self._set(banner=(text, color))
+    def banner_idle(self): self.set_banner(*BANNER_IDLE)
+    def banner_engraving(self): self.set_banner(*BANNER_ENGRAVING)
+    def banner_warning(self): self.set_banner(*BANNER_WARNING)
+    def banner_ok(self): self.set_banner(*BANNER_OK)
+
+    def update_conn_pill(self, text, ok=False, warn=False):
+        self._set(conn={"text": text, "ok": ok, "warn": warn}, connected=self.serial.is_open() if hasattr(self, "serial") else False)
+
+    def _publish_io(self):
+        self._set(inputs=list(self.input_state), relays=list(self.relay_state), door_closed=self.door_closed)
+
+    def _publish_engraving(self):
+        self._set(is_engraving=self.is_engraving)
+
+    def _emit_config(self):
+        self.emit("config", config=copy.deepcopy(self.CONFIG))
+
+    def cmd_resend_state(self, target):
+        target.put(("config", {"config": copy.deepcopy(self.CONFIG)}))
+        target.put(("state", dict(self.state)))
+        if self.pending_prompt: target.put(("prompt", dict(self.pending_prompt)))
+
+    def cmd_shutdown(self):
+        self._running = False
+        self.serial.close()
+
+    # ---------- Startup ----------
+    def _startup(self):
+        self.ensure_dirs()
+        self._apply_sync()  # pulls today's logs from the share first if the local copy is new
+        self._apply_allocator()
+        self._pending_recovery = self._reconcile_inflight()  # before old rows are filtered out of Completed_Today
+        self.filter_completed_today_old_dates()
+        self.enforce_retention_on_startup()
+        self._apply_ledger()
+        store = self._history_store()
+        if store:  # load (or build) the manifest off the engine thread before the first append needs it
+            threading.Thread(target=store.manifest, name="HistoryManifest", daemon=True).start()
+
+        self._set(status="Idle.", banner=BANNER_IDLE, is_engraving=False, job="", job_details={},
+                  batch_size="", next_serial="", preview={"codes": [], "total": 0})
+        self._publish_io()
+        if not self.CC.serial_enabled or self.CC.simulate:
+            self.update_conn_pill("SIMULATE" if self.CC.simulate else "Disabled", warn=True)
+        else:
+            self.update_conn_pill("Disconnected", warn=True)
+
+        if self.CONFIG.get("LAST_DATE_CODE") != self.dates.code:
+            self.CONFIG["LAST_DATE_CODE"] = self.dates.code
+            self.save_config()
+        self._schedule_midnight()
+        self.call_later(100, self._check_for_job_select_on_start)
+        self.call_later(self.CC.reload_poll_ms, self._watch_config_file)
+        self._apply_status_server()
+        self._apply_lightburn_control()
+        self._publish_adaptive()
+        if self._pending_recovery:
+            self._offer_inflight_recovery()
+        if self.CC.open_lb_on_start:
+            self.call_later(self.CC.lb_start_delay_ms, self._open_and_position_lb_for_current_job)
+
+    # ---------- Serial connection ----------
+    def cmd_connect(self, port):
+        if self.serial.try_open_manual(port):
+            self.initialize_relays_off()
+            self.call_later(250, self.serial.get_all_states)
+            if self.CONFIG["SERIAL"].get("port") != port:
+                self.CONFIG["SERIAL"]["port"] = port
+                self.save_config()
+
+    def cmd_disconnect(self):
+        self.serial.close()
+        print("Disconnected from serial port via GUI.")
+
+    def initialize_relays_off(self):
+        print("Sending initial RSET 0 commands to ensure all relays are OFF...")
+
+        if not self.serial.is_open():
+            print("Error: Serial connection lost, cannot send RSET commands.")
+            return
+
+        for i in range(len(self.CC.relay_names)):
+            command = f"RSET {i} 0\n"
+            try:
+                self.serial.ser.write(command.encode('utf-8'))
+                time.sleep(0.01)
+            except Exception as e:
+                print(f"Error sending RSET OFF command for Relay {i}: {e}")
+
+        print("Initial relays state set to OFF.")
+
+    # ---------- Config ----------
+    def _apply_config(self):
+        """Compiles CONFIG and swaps the result in as self.CC. Returns False (keeping the old CC) if invalid."""
+        try:
+            cc = CompiledConfig(self.CONFIG)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[CONFIG] Invalid config: {e}")
+            return False
+        for e in cc.select_errors: print(f"[CONFIG] Job select: {e}")
+        self.CC = cc
+        return True
+
+    def save_config(self):
+        """Validates CONFIG, queues it for writing and applies the changes. Returns an error string or None."""
+        try:
+            cc = CompiledConfig(self.CONFIG)
+        except (KeyError, TypeError, ValueError) as e:
+            return f"Config is not valid, not saved:\n{e}"
+        try:
+            self.config_writer.submit(self.CONFIG)
+        except (TypeError, ValueError) as e:
+            return f"Failed to save config:\n{e}"
+        self._swap_config(self.CONFIG, cc)
+        return None
+
+    def cmd_save_config(self, config, persist=True):
+        """Replaces the running config with one edited by a front end."""
+        if persist:
+            old = self.CONFIG
+            self.CONFIG = config
+            error = self.save_config()
+            if error:
+                self.CONFIG = old
+                self.emit("error", title="Save Config", message=error)
+                self._emit_config()
+            return
+        try:
+            cc = CompiledConfig(config)
+        except (KeyError, TypeError, ValueError) as e:
+            self.emit("error", title="Config", message=f"Config is not valid:\n{e}"); return
+        self._swap_config(config, cc)
+
+    def _swap_config(self, cfg, cc):
+        self.CONFIG, self.CC = cfg, cc
+        changed = config_diff(self._applied_config, self.CONFIG)
+        self._applied_config = copy.deepcopy(self.CONFIG)
+        self._emit_config()  # front ends see the new config before the state changes it causes
+        self._apply_config_changes(changed)
+
+    def _watch_config_file(self):
+        try:
+            if self.CC.reload_enabled: self._check_config_file()
+        finally:
+            self.call_later(self.CC.reload_poll_ms, self._watch_config_file)
+
+    def _check_config_file(self):
+        """Reloads gui_config.json if it was changed by someone else, applying only the diff."""
+        try: st = os.stat(self.config_path)
+        except OSError: return
+        sig = (st.st_mtime_ns, st.st_size)
+        if sig == self._config_file_sig: return
+        if self.is_engraving: return  # leave sig unchanged so the reload is picked up after the job
+        try:
+            with open(self.config_path, "rb") as f: data = f.read()
+        except OSError: return
+        self._config_file_sig = sig
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == self._config_file_hash: return
+        self._config_file_hash = digest
+        try:
+            new_cfg = deep_merge(DEFAULT_CONFIG, json.loads(data.decode("utf-8")))
+            cc = CompiledConfig(new_cfg)
+        except Exception as e:
+            print(f"[CONFIG] Ignoring external config change: {e}")
+            self.set_status("Warning: gui_config.json changed but is not valid; keeping current settings.")
+            return
+        changed = config_diff(self._applied_config, new_cfg)
+        if not changed: return
+        print(f"[CONFIG] Reloading changed settings: {', '.join(sorted(changed))}")
+        self.counters["config_reloads"] += 1
+        self._swap_config(new_cfg, cc)
+        self.set_status(f"Settings reloaded from file ({len(changed)} change(s)).")
+
+    def _apply_config_changes(self, changed):
+        """Brings the running station in line with the current CC, touching only what changed."""
+        if not changed: return
+        sections = {c.split(".", 1)[0] for c in changed}
+
+        if sections & {"ROOT", "FILE_PATHS", "SYNC"}:
+            self.DIRS, self.LB_BATCH, self.WORKING_BATCH, self.WORKING_COMPLETED_TODAY = self.derive_paths()
+            self.ensure_dirs()
+            self._apply_sync()
+        if sections & {"ROOT", "FILE_PATHS", "SYNC", "SERIAL_ALLOCATOR"}:
+            self._apply_allocator()
+
+        n_relays, n_inputs = len(self.CC.relay_names), len(self.CC.input_names)
+        self.relay_state = (self.relay_state + [0] * n_relays)[:n_relays]
+        self.input_state = (self.input_state + [1] * n_inputs)[:n_inputs]
+        self.input_override = (self.input_override + [False] * n_inputs)[:n_inputs]
+        self._publish_io()
+
+        key = self.selected_job
+        if "JOBS" in sections:
+            if key and key not in self.CC.jobs:
+                self.selected_job = ""
+                self._set(job="", job_details={})
+                self.set_status(f"Job '{key}' was removed from settings. Cleared job selection.")
+                key = ""
+            elif key:
+                self._show_job_details(key)
+        if key and not self.is_engraving and ({f"JOBS.{key}", "FILE_PATHS.next_batch_path", "ROOT", "LOGGING.retain_mode"} & changed):
+            self.refresh_next_serial_label()
+            self.refresh_preview_upnext_and_lb()
+
+        if sections & {"IO_MAP", "INPUTS"}:
+            self.last_job_pattern = ""
+        if sections & {"SERIAL", "SIMULATE"}:
+            self._apply_serial_changes(changed)
+        if "STATUS_SERVER" in sections:
+            self._apply_status_server()
+        if "LIGHTBURN" in sections:
+            self._apply_lightburn_control()
+        if sections & {"ROOT", "FILE_PATHS", "LOGGING", "SYNC"}:
+            self._apply_ledger()
+        if sections & {"ROOT", "FILE_PATHS", "SYNC"} or "ADAPTIVE_TIMING.window" in changed:
+            self.phase_history = self._load_phase_history()
+        if sections & {"ROOT", "FILE_PATHS", "SYNC", "JOBS", "ADAPTIVE_TIMING"}:
+            self._publish_adaptive()
+
+    def _apply_serial_changes(self, changed):
+        cfg = self.CONFIG["SERIAL"]
+        ser = self.serial.ser
+        connected = self.serial.is_open()
+        self.serial.enabled = self.CC.serial_enabled
+        self.serial.baud = int(cfg.get("baud", 115200))
+        if self.CC.simulate:
+            self.update_conn_pill("SIMULATE", warn=True)
+        elif not self.CC.serial_enabled:
+            if connected: self.serial.close()
+            self.update_conn_pill("Disabled", warn=True)
+        elif connected and (ser.port != cfg.get("port") or ser.baudrate != self.serial.baud):
+            # Only reconnect when the link itself changed, not for unrelated SERIAL keys.
+            print(f"Serial settings changed. Reconnecting to {cfg.get('port')} @ {self.serial.baud}...")
+            if self.serial.try_open_manual(cfg.get("port")):
+                self.initialize_relays_off()
+                self.call_later(250, self.serial.get_all_states)
+
+    def _apply_status_server(self):
+        """Starts, stops or moves the read-only status endpoint to match the config."""
+        cc, server = self.CC, self.status_server
+        if server and (not cc.status_enabled or (server.host, server.port) != (cc.status_host, cc.status_port)):
+            server.stop(); self.status_server = server = None
+        if cc.status_enabled and not server:
+            self.status_server = StatusServer(self, cc.status_host, cc.status_port)
+            self.status_server.start()
+
+    def _apply_lightburn_control(self):
+        """Opens or closes the LightBurn UDP client to match LIGHTBURN.control."""
+        self.templates.set_token(self.CC.lb_template_token)
+        udp, want = self.lb_udp, self.CC.lb_udp
+        if udp and (udp.host, udp.port, udp.reply_port, round(udp.timeout_s * 1000)) != want:
+            udp.close(); self.lb_udp = udp = None
+        if want and not udp:
+            self.lb_udp = LightBurnUdp(*want)
+            self._lb_udp_project = None
+
+    # ---------- Paths & retention ----------
+    def derive_paths(self):
+        ROOT = self.CONFIG["ROOT"]
+        DIRS = {
+            "config": os.path.join(ROOT, "Config"),
+            "logs": local_path(self.CONFIG, os.path.join(ROOT, "LOGS")),
+            "jobs": os.path.join(ROOT, "Jobs")
+        }
+
+        # Use paths from config, with updated defaults pointing to LOGS
+        file_paths = self.CONFIG.get("FILE_PATHS", {})
+        LB_BATCH = local_path(self.CONFIG, file_paths.get("next_batch_path", os.path.join(ROOT, "LOGS", "NextBatch.csv")))
+        WORKING_BATCH = os.path.join(DIRS["logs"], "CurrentBatch.csv") # Intermediate file
+        WORKING_COMPLETED_TODAY = local_path(self.CONFIG, file_paths.get("completed_today_path", os.path.join(DIRS["logs"], "Completed_Today.csv")))
+
+        return DIRS, LB_BATCH, WORKING_BATCH, WORKING_COMPLETED_TODAY
+
+    def ensure_dirs(self):
+        for d in self.DIRS.values(): os.makedirs(d, exist_ok=True)
+        os.makedirs(self.daily_dir(), exist_ok=True)
+
+    def daily_dir(self, dates=None):
+        return (dates or self.dates).folder(self.DIRS["logs"])
+
+    def _batch_dates(self, rows):
+        """The DateContext of the day a batch was started (its DateCode), so a batch running past
+        midnight is logged under one day."""
+        dc = rows[0].get("DateCode") if rows else ""
+        if not dc or dc == self.dates.code: return self.dates
+        try: return DateContext(datetime.strptime(dc, "%y%m%d").date())
+        except ValueError: return self.dates
+
+    def enforce_retention_on_startup(self):
+        """With retention off, removes the loose files under LOGS (except history and station state) right away,
+        since the station reads some of them at startup. Folders are left to the background job."""
+        if self.CC.retain_mode == "off":
+            logs_dir = self.DIRS.get("logs")
+            hist_path = self.CONFIG.get("FILE_PATHS", {}).get("entire_history_path")
+            if logs_dir and os.path.exists(logs_dir):
+                hist_filename = os.path.basename(hist_path) if hist_path else "All_Jobs_History.csv"
+                hist_stem = os.path.splitext(hist_filename)[0].lower()
+                for item in os.listdir(logs_dir):
+                    item_path = os.path.join(logs_dir, item)
+                    # history, its partitions and manifest, ledger view state, leased serials, the in-flight
+                    # journal, learned timings, log sync state
+                    keep = (hist_stem, "ledger.", "serialblocks.", "inflight.", "phasehistory.", "logsync.")
+                    if item.lower().startswith(keep) or os.path.isdir(item_path): continue
+                    try:
+                        os.remove(item_path)
+                    except Exception as e:
+                        print(f"Could not remove log item {item_path}: {e}")
+        self.call_later(RETENTION_START_DELAY_MS, self._start_retention, name="retention")
+
+    def _start_retention(self):
+        """Plans retention for the current LOGGING settings and runs it in the background, one run at a time."""
+        if self.retention and self.retention.running(): return
+        cc = self.CC
+        plan = retention_plan(self.DIRS["logs"], cc.retain_mode, cc.retain_days, cc.retain_action,
+                              cc.compressed_keep_days, keep=[os.path.join(self.DIRS["logs"], "Projects")])
+        store = self._history_store() if cc.history_compress_months else None
+        if not plan and not store: return
+        more = (lambda: [("compress", p) for p in store.closed_partitions(cc.history_compress_months)]) if store else None
+        if plan: print(f"[RETAIN] {len(plan)} log folder(s) to clean up in the background.")
+        self.retention = RetentionJob(plan, cc.retention_throttle_ms,
+                                      lambda progress: self.call_soon(self._on_retention_progress, progress), more)
+
+    def _on_retention_progress(self, progress):
+        self._set(retention=progress)
+        if not progress["running"]:
+            print(f"[RETAIN] Done: {progress['done']}/{progress['folders']} folder(s), {progress['files']} file(s), "
+                  f"{progress['freed_bytes'] / 1e6:.1f} MB freed.")
+
+    def filter_completed_today_old_dates(self):
+        if self.CC.ledger:  # a view of today's ledger; LedgerViews rebuilds it when the day changes
+            if self.ledger_views: self.ledger_views.poke()
+            return
+        path, curr_dc = self.WORKING_COMPLETED_TODAY, self.dates.code
+        if not os.path.exists(path): return
+        # The DateCode column tells whether the file is all today's, all one earlier day's (rename it
+        # away) or mixed (split it, streaming). A RECOVERED batch can leave earlier days mid-file.
+        try:
+            header, codes = csv_column_values(path, "DateCode")
+            if not codes or codes == {curr_dc}: return
+            col = header.index("DateCode")
+            if len(codes) == 1:
+                self._archive_completed_today(path, codes.pop())
+            else:
+                self._split_completed_today(path, header, col, curr_dc)
+            print(f"[ENGINE] {os.path.basename(path)} rolled over to {curr_dc}.")
+        except (OSError, csv.Error) as e:
+            print(f"Error processing Completed_Today.csv: {e}")
+
+    def _completed_archive_path(self, date_code):
+        """Where Completed_Today rows of an earlier day go: Archive_Completed_Today.csv in that day's folder."""
+        try: day = datetime.strptime(date_code, "%y%m%d").date()
+        except ValueError: day = date.fromtimestamp(os.path.getmtime(self.WORKING_COMPLETED_TODAY))
+        name = "Archive_" + os.path.basename(self.WORKING_COMPLETED_TODAY)
+        return os.path.join(self.DIRS["logs"], day.strftime("%Y"), day.strftime("%y%m%d"), name)
+
+    def _fresh_completed_today(self, path):
+        atomic_write_text(path, ",".join(self._completed_header()) + "\r\n")
+
+    def _archive_completed_today(self, path, date_code):
+        """Moves a Completed_Today.csv holding one earlier day into that day's archive and starts a fresh one."""
+        archive = self._completed_archive_path(date_code)
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+        if os.path.exists(archive):  # rotated before (clock change, restored file): add to it
+            with open(path, "rb") as src, open(archive, "ab") as dst:
+                src.readline()
+                shutil.copyfileobj(src, dst, 1 << 16)
+        else:
+            os.replace(path, archive)
+        self._fresh_completed_today(path)
+
+    def _split_completed_today(self, path, header, col, curr_dc):
+        """One streaming pass over a Completed_Today.csv mixing days: today's rows stay, the rest go to their archives."""
+        tmp, archives = f"{path}.tmp", {}
+        try:
+            with open(path, "r", newline="", encoding="utf-8-sig") as src, \
+                 open(tmp, "w", newline="", encoding="utf-8") as keep:
+                kw = csv.writer(keep); kw.writerow(header)
+                rd = csv.reader(src); next(rd, None)
+                for row in rd:
+                    dc = row[col] if col < len(row) else ""
+                    if dc == curr_dc:
+                        kw.writerow(row); continue
+                    if dc not in archives:
+                        apath = self._completed_archive_path(dc)
+                        os.makedirs(os.path.dirname(apath), exist_ok=True)
+                        new = not os.path.exists(apath) or os.path.getsize(apath) == 0
+                        fh = open(apath, "a", newline="", encoding="utf-8")
+                        archives[dc] = (fh, csv.writer(fh))
+                        if new: archives[dc][1].writerow(header)
+                    archives[dc][1].writerow(row)
+                keep.flush(); os.fsync(keep.fileno())
+        finally:
+            for fh, _ in archives.values(): fh.close()
+        os.replace(tmp, path)
+
+    # ---------- In-flight journal ----------
+    def _journal(self):
+        return InflightJournal(os.path.join(self.DIRS["logs"], "InFlight.json"))
+
+    def _snapshot(self, phase, **changes):
+        """Records a job-cycle transition in the in-flight journal."""
+        self.inflight.update(changes, phase=phase, relays=list(self.relay_state))
+        self._set(batch={"job": self.inflight.get("job", ""), "phase": phase,
+                         "total": len(self.inflight.get("rows", [])), "done": self.inflight.get("logged", 0)})
+        try: self._journal().write(self.inflight)
+        except OSError as e: print(f"[INFLIGHT] Could not write snapshot: {e}")
+
+    def _clear_inflight(self):
+        self.inflight = {}
+        self._set(batch={})
+        self._journal().clear()
+        if self._rollover_pending: self.call_soon(self._roll_over_logs)
+
+    def _logged_codes(self, date_code, codes):
+        """Returns which of codes already appear in the completed logs for date_code."""
+        wanted, found = set(codes), set()
+        try: day = datetime.strptime(date_code, "%y%m%d").date()
+        except ValueError: day = self.dates.day
+        sources = [iter_completed(self.DIRS["logs"], day)]
+        if not self.CC.ledger: sources.insert(0, iter_file(self.WORKING_COMPLETED_TODAY))
+        try:
+            for row in itertools.chain(*sources):
+                code = row.get("Serial Number")
+                if code in wanted: found.add(code)
+                if found == wanted: break
+        except (OSError, csv.Error) as e:
+            print(f"[INFLIGHT] Could not scan the completed logs: {e}")
+        return found
+
+    def _reconcile_inflight(self):
+        """Compares a leftover in-flight snapshot with the completed logs. Returns the recovery to offer, or None."""
+        snap = self._journal().read()
+        if not snap: return None
+        rows = snap.get("rows") or []
+        if not rows:
+            self._journal().clear(); return None
+        logged = self._logged_codes(snap.get("date_code", self.dates.code), [r.get("FullCode") for r in rows])
+        unlogged = [r for r in rows if r.get("FullCode") not in logged]
+        if not unlogged:
+            self._journal().clear(); return None
+        return {"snapshot": snap, "unlogged": unlogged}
+
+    # ---------- Serials & logs ----------
+    def compute_next_serial_from_completed(self, pn):
+        mode = self.CC.retain_mode
+        max_ser = 0
+        dates = self.dates
+        if mode == "off" and not self.CC.ledger:
+            rows = iter_file(self.WORKING_COMPLETED_TODAY)
+        else:
+            rows = iter_completed(self.DIRS["logs"], dates.day)
+        for row in rows:
+            if row.get("PartNumber")==pn and row.get("DateCode")==dates.code:
+                try: max_ser = max(max_ser, int(row.get("Serial5","00000")))
+                except: pass
+        return max_ser + 1
+
+    def planned_files_today(self):
+        base = os.path.join(self.daily_dir(), "Planned.csv")
+        pattern = os.path.join(self.daily_dir(), "Planned*.csv")
+        files = sorted(glob.glob(pattern), key=self._completed_sort_key)
+        return files if files else [base]
+
+    @staticmethod
+    def _completed_sort_key(path):
+        name = os.path.basename(path)
+        if "_" in name:
+            try: n = int(name.split("_",1)[1].split(".")[0])
+            except Exception: n = 1
+        else: n = 1
+        return n
+
+    def _next_chunk_path(self, base_path):
+        folder, base = os.path.split(base_path)
+        stem, ext = os.path.splitext(base)
+        existing = sorted(glob.glob(os.path.join(folder, stem+"*.csv")), key=self._completed_sort_key)
+        if not existing: return base_path
+        last = os.path.basename(existing[-1])
+        if "_" in last:
+            try: idx = int(last.split("_",1)[1].split(".")[0]) + 1
+            except Exception: idx = 2
+            return os.path.join(folder, f"{stem}_{idx}.csv")
+        else:
+            return os.path.join(folder, f"{stem}_2.csv")
+
+    def _needs_rollover(self, path):
+        max_rows = self.CC.daily_max_rows
+        if not os.path.exists(path): return False
+        try:
+            with open(path, "r", newline="", encoding="utf-8") as fh:
+                r = csv.reader(fh); next(r, None)
+                for i, _ in enumerate(r, start=1):
+                    if i >= max_rows: return True
+        except Exception: pass
+        return False
+
+    def _append_row(self, path, fieldnames, row):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_header = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=fieldnames)
+            if write_header: w.writeheader()
+            w.writerow(row)
+
+    def append_planned(self, rows):
+        if self.CC.retain_mode == "off": return
+        if not self.CC.write_planned: return
+        if self.ledger:
+            self._append_ledger("planned", rows); return
+        base = os.path.join(self.daily_dir(self._batch_dates(rows)), "Planned.csv")
+        target = self._next_chunk_path(base) if self._needs_rollover(base) else base
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=BATCH_FIELDS)
+            if fh.tell() == 0: w.writeheader()
+            w.writerows(rows)
+
+    def _completed_header(self):
+        return list(COMPLETED_FIELDS)
+
+    def append_completed_many(self, rows, result="OK"):
+        # This function handles the daily rotating logs and the "Completed Today" log
+        fns = self._completed_header()
+        self.counters["items_completed"] += len(rows)
+        if self.ledger:
+            self._append_ledger("completed", rows, result); return
+
+        now_t = datetime.now().strftime("%H:%M:%S")
+        out_rows = []
+        for r in rows:
+            row_to_write = {k: r.get(k, '') for k in fns}
+            row_to_write.update({
+                "Time": now_t,
+                "Serial Number": r.get("FullCode", ""),
+                "Result": result
+            })
+            out_rows.append(row_to_write)
+        
+        # Write to "Completed Today" file
+        path_today = self.WORKING_COMPLETED_TODAY
+        os.makedirs(os.path.dirname(path_today), exist_ok=True)
+        write_header_today = not os.path.exists(path_today) or os.path.getsize(path_today) == 0
+        with open(path_today, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=fns)
+            if write_header_today: w.writeheader()
+            w.writerows(out_rows)
+
+        # Write to daily rotating logs if retention is not off
+        if self.CC.retain_mode != "off":
+            base = os.path.join(self.daily_dir(self._batch_dates(rows)), "Completed.csv")
+            path_daily = self._next_chunk_path(base) if self._needs_rollover(base) else base
+            os.makedirs(os.path.dirname(path_daily), exist_ok=True)
+            write_header_daily = not os.path.exists(path_daily)
+            with open(path_daily, "a", newline="", encoding="utf-8") as fh:
+                w = csv.DictWriter(fh, fieldnames=fns)
+                if write_header_daily: w.writeheader()
+                w.writerows(out_rows)
+
+    def _history_store(self):
+        """The monthly-partitioned history for the configured path, or None when not partitioning."""
+        path = self.CC.history_path
+        if not (self.CC.history_partitioned and path): return None
+        if self.history is None or self.history.path != path: self.history = history_store(path)
+        return self.history
+
+    def append_history_csv(self, rows, result="OK"):
+        # --- MODIFIED: Handles the persistent All_Jobs_History.csv ---
+        if self.ledger: return  # LedgerViews appends history from the ledger
+        if not self.CC.history_enabled: return
+        hist_path = self.CC.history_path
+        if not hist_path: return
+
+        now_dt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        out_rows = []
+        for r in rows:
+            row_to_write = {
+                "DateTime": now_dt,
+                "PartNumber": r.get("PartNumber", ""),
+                "Serial Number": r.get("FullCode", ""),
+                "JobName": r.get("JobName", ""),
+                "Result": result
+            }
+            out_rows.append(row_to_write)
+        self._write_history(out_rows)
+
+    def _write_history(self, out_rows):
+        """Appends history rows to the partitions or the single history file. Also the LedgerViews sink."""
+        hist_path = self.CC.history_path
+        if not (self.CC.history_enabled and hist_path): return
+        store = self._history_store()
+        if store:
+            store.append(out_rows); return
+        # Simplified columns as requested for the master history log
+        cols = HISTORY_FIELDS
+        os.makedirs(os.path.dirname(hist_path), exist_ok=True)
+        write_header = not os.path.exists(hist_path) or os.path.getsize(hist_path) == 0
+        with open(hist_path, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=cols)
+            if write_header:
+                w.writeheader()
+            w.writerows(out_rows)
+
+    # ---------- Log sync ----------
+    def _apply_sync(self):
+        """Starts, restarts or stops the copy of the local logs to the share to match SYNC."""
+        local, remote = self.CC.sync_local_root, self.CONFIG["ROOT"]
+        old = self.sync
+        if old and (old.local_root, old.remote_root, old.interval_s) == (local, remote, self.CC.sync_interval_ms / 1000.0): return
+        if old: old.stop()
+        self.sync = None
+        if not local:
+            self._set(sync={}); return
+        self.sync = LogSync(local, remote, self.CC.sync_interval_ms,
+                            on_status=lambda status: self.call_soon(self._on_sync_status, status))
+        logs = os.path.relpath(self.DIRS["logs"], local)
+        try:
+            n = self.sync.seed([logs, os.path.relpath(self.daily_dir(), local)])
+            if n: print(f"[SYNC] Copied {n} log file(s) from the share to start the local copy.")
+        except OSError as e:
+            print(f"[SYNC] Could not read the share to start the local copy: {e}")
+        self.sync.start()
+
+    def _on_sync_status(self, status):
+        self._set(sync=status)
+
+    # ---------- Ledger ----------
+    def _apply_ledger(self):
+        """Starts or stops the ledger and its view maintainer to match LOGGING.store."""
+        logs, today = self.DIRS["logs"], self.WORKING_COMPLETED_TODAY if self.CC.ledger_views_live else None
+        views = self.ledger_views
+        if views and (not self.CC.ledger or (views.logs_dir, views.today_path) != (logs, today)):
+            views.stop(); self.ledger_views = views = None
+        self.ledger = Ledger(logs) if self.CC.ledger else None
+        if self.ledger and not views:
+            self.ledger_views = LedgerViews(logs, self._write_history, today)
+
+    def _append_ledger(self, kind, rows, result=""):
+        self.ledger.append(kind, rows, result, day=self._batch_dates(rows).day)
+        self.counters["ledger_writes"] += 1
+        if self.ledger_views: self.ledger_views.poke()
+
+    def cmd_materialize_views(self):
+        """Writes Completed_Today.csv from today's ledger now (for ledger_views "on_demand")."""
+        if not self.ledger:
+            self.emit("error", title="Ledger", message="LOGGING.store is not \"ledger\"."); return
+        logs, path = self.DIRS["logs"], self.WORKING_COMPLETED_TODAY
+        def materialize_views():
+            try: n = materialize_today(logs, path)
+            except (OSError, csv.Error) as e:
+                self.emit("error", title="Ledger", message=f"Could not write {os.path.basename(path)}:\n{e}"); return
+            self.emit("info", title="Ledger", message=f"{n} item(s) written to\n{path}")
+        threading.Thread(target=materialize_views, name="Materialize", daemon=True).start()
+        self.ledger_views.poke()
+
+    def read_working_batch(self):
+        if self.ledger: return list(self._working_rows)  # the in-flight journal is what survives a crash
+        if not os.path.exists(self.WORKING_BATCH): return []
+        with open(self.WORKING_BATCH, "r", newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+
+    def write_working_batch(self, rows):
+        if self.ledger: self._working_rows = list(rows); return
+        self._write_batch_file(self.WORKING_BATCH, batch_csv_text(rows))
+
+    def _drop_working_batch(self):
+        self._working_rows = []
+        if os.path.exists(self.WORKING_BATCH): os.remove(self.WORKING_BATCH)
+
+    def write_lightburn_batch(self, codes):
+        """Writes the codes to NextBatch.csv. Returns False if the file could not be written."""
+        if self.CC.lb_template: return True  # each batch gets its own project instead
+        try: self._write_batch_file(self.LB_BATCH, codes_csv_text(codes))
+        except OSError as e:
+            print(f"[LB] Could not write {os.path.basename(self.LB_BATCH)}: {e}")
+            return False
+        return True
+
+    def _swap_in_lightburn_batch(self, staged):
+        """Moves the staged NextBatch.csv into place. Returns False if that failed."""
+        next_path, staged["lb_next"] = staged["lb_next"], None
+        if not next_path: return True
+        try: os.replace(next_path, self.LB_BATCH)
+        except OSError as e:
+            print(f"[LB] Could not swap in the staged {os.path.basename(self.LB_BATCH)}: {e}")
+            return False
+        return True
+
+    def _write_batch_file(self, path, text):
+        """Writes path atomically unless it already holds text. The file's stat is remembered with
+        the hash, so a file replaced or deleted behind our back is always rewritten."""
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        try: st = os.stat(path)
+        except OSError: st = None
+        known = self._batch_file_sigs.get(path)
+        if st and known == (digest, st.st_ino, st.st_mtime_ns, st.st_size):
+            self.counters["batch_writes_skipped"] += 1
+            return False
+        atomic_write_text(path, text)
+        st = os.stat(path)
+        self._batch_file_sigs[path] = (digest, st.st_ino, st.st_mtime_ns, st.st_size)
+        self.counters["batch_writes"] += 1
+        return True
+
+    def _batch_project_path(self, job, date_code, start):
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in job.key)
+        return os.path.join(self.DIRS["logs"], "Projects", f"{name}_{date_code}_{serial5(start)}.lbrn2")
+
+    def _write_batch_project(self, job, rows):
+        """Builds the batch's LightBurn project from the job's template. Returns its path, or None on error."""
+        path = self._batch_project_path(job, rows[0]["DateCode"], int(rows[0]["Serial5"]))
+        try:
+            return self.templates.load(job.lightburn_file).write(path, [r["FullCode"] for r in rows])
+        except (OSError, SyntaxError, ValueError) as e:  # ElementTree.ParseError is a SyntaxError
+            self.emit("error", title="LightBurn Project", message=f"Could not build the batch project.\n{e}")
+            return None
+
+    def _prune_batch_projects(self, keep):
+        folder = os.path.dirname(keep)
+        for path in glob.glob(os.path.join(folder, "*.lbrn2")):
+            if os.path.normcase(path) == os.path.normcase(keep): continue
+            try: os.remove(path)
+            except OSError: pass
+
+    def _batch_size(self, job):
+        try: return max(1, int(self.batch_size_text))
+        except Exception: return job.default_batch
+
+    def build_preview_rows(self, start=None):
+        if not self.selected_job: return [], []
+        job = self.CC.jobs[self.selected_job]
+        start_ser = start or self._next_serial(job)
+        if start_ser is None: return [], []
+        return batch_rows(job, self._batch_size(job), self.dates, start_ser)
+
+    # ---------- Serial allocation ----------
+    def _apply_allocator(self):
+        """Starts or stops block leasing, and the authority service, to match SERIAL_ALLOCATOR."""
+        cc, server = self.CC, self.alloc_server
+        if server and (server.authority.path, (server.host, server.port)) != (cc.alloc_authority_path, cc.alloc_serve):
+            server.stop(); self.alloc_server = server = None
+        if cc.alloc_serve and not server:
+            self.alloc_server = server = AllocatorServer(BlockAuthority(cc.alloc_authority_path), *cc.alloc_serve)
+            server.start()
+        self.allocator = None
+        if cc.alloc_mode == "off": return
+        if cc.alloc_mode == "server": authority = HttpAuthority(cc.alloc_url)
+        elif server: authority = server.authority  # one writer for the counter file
+        else: authority = BlockAuthority(cc.alloc_authority_path)
+        self.allocator = SerialAllocator(authority, os.path.join(self.DIRS["logs"], "SerialBlocks.json"),
+                                         cc.alloc_station, cc.alloc_block_size,
+                                         on_lease=lambda key: self.call_soon(self._on_serial_block, key))
+        self._prepare_serials_ahead()
+
+    def _next_serial(self, job):
+        """The first serial of job's next batch: from the leased blocks when allocating (None if none
+        are on hand yet), else from this station's logs."""
+        pn = job.part_number
+        if not self.allocator: return self.compute_next_serial_from_completed(pn)
+        n, date_code = self._batch_size(job), self.dates.code
+        self.allocator.prepare(pn, date_code, n, floor=lambda: self.compute_next_serial_from_completed(pn))
+        self._prepare_serials_ahead()
+        return self.allocator.peek(block_key(pn, date_code), n)
+
+    def _prepare_serials_ahead(self):
+        """Leases one batch's worth for every job's part number today and tomorrow, so the first batch
+        of a part, or of a new day, runs from the reserve while the authority is unreachable."""
+        tomorrow = DateContext(self.dates.day + timedelta(days=1)).code
+        for job in self.CC.jobs.values():
+            pn = job.part_number
+            if not pn: continue
+            n = self._batch_size(job) if job.key == self.selected_job else job.default_batch
+            self.allocator.prepare(pn, self.dates.code, n, floor=lambda pn=pn: self.compute_next_serial_from_completed(pn), ahead=True)
+            self.allocator.prepare(pn, tomorrow, n, ahead=True)
+
+    def _on_serial_block(self, key):
+        """A lease came in. Fills the preview if it was waiting for serials."""
+        job = self.CC.jobs.get(self.selected_job)
+        if not job or self.inflight or (self.state.get("preview") or {}).get("total"): return
+        if key != block_key(job.part_number, self.dates.code): return
+        self.refresh_next_serial_label()
+        self.refresh_preview_upnext_and_lb()
+
+    # ---------- Next-batch staging ----------
+    def _request_stage(self, job, start, rows=None, codes=None, lb=False):
+        """Stages the batch of job starting at start. lb=True also stages its LightBurn CSV, for when
+        NextBatch.csv still belongs to the batch on the machine."""
+        self._stage_gen += 1
+        self.staged = None
+        template = self.CC.lb_template and bool(job.lightburn_file)
+        dates = self.dates
+        date_code = dates.code
+        self.stager.stage({"gen": self._stage_gen, "job": job, "n": self._batch_size(job), "dates": dates, "date_code": date_code,
+                           "start": start, "rows": rows, "codes": codes,
+                           "work_next": None if self.ledger else self.WORKING_BATCH + ".next",
+                           "lb_next": self.LB_BATCH + ".next" if lb and not self.CC.lb_template else None,
+                           "project": self._batch_project_path(job, date_code, start) if template else None,
+                           "templates": self.templates})
+
+    def _on_staged(self, staged):
+        if staged["gen"] != self._stage_gen: return  # superseded while the worker was busy
+        self.staged = staged
+
+    def _take_staged(self):
+        """Returns the staged batch if it still matches the selection, batch size and date, else None."""
+        staged, self.staged = self.staged, None
+        job = self.CC.jobs.get(self.selected_job)
+        if not staged or not job or staged["job"] is not job: return None
+        if staged["n"] != self._batch_size(job) or staged["date_code"] != self.dates.code: return None
+        return staged
+
+    def _show_next_batch(self):
+        """After a batch: swaps in the staged next batch, or rescans the logs if there is none."""
+        staged = self._take_staged()
+        if not staged or not (staged["lb_next"] or staged["project"]):
+            self.refresh_preview_upnext_and_lb(); self.refresh_next_serial_label()
+            return
+        if not self._swap_in_lightburn_batch(staged):
+            self.refresh_preview_upnext_and_lb(); self.refresh_next_serial_label()
+            return
+        self.staged = staged
+        self._set(preview={"codes": staged["codes"][:self.CC.up_next_tail], "total": len(staged["rows"])},
+                  next_serial=serial5(staged["start"]))
+
+    # ---------- LightBurn ----------
+    def _current_job_lb_path(self):
+        job = self.CC.jobs.get(self.selected_job)
+        return job.lightburn_file if job else ""
+
+    def _open_lightburn_file(self, path):
+        """Opens the project in LightBurn. Returns "reused", "launched" (tracked process), "opened" (shell), or False."""
+        if not path or not os.path.exists(path):
+            self.emit("error", title="LightBurn File", message=f"File not found:\n{path}"); return False
+        lb = self.lightburn
+        if lb.has_loaded(path):
+            self.counters["lb_reuses"] += 1
+            print(f"[LB] {os.path.basename(path)} is already open in LightBurn (pid {lb.proc.pid}). Not reopening.")
+            return "reused"
+        try:
+            exe = self.CC.lb_exe_path
+            if exe and os.path.exists(exe):
+                pid = lb.launch(exe, path)
+                self.counters["lb_launches"] += 1
+                print(f"[LB] Launched LightBurn (pid {pid}) with {os.path.basename(path)}.")
+                self._set(lightburn=lb.info())
+                return "launched"
+            if IS_WINDOWS: os.startfile(path)
+            elif platform.system()=="Darwin": subprocess.Popen(["open", path])
+            else: subprocess.Popen(["xdg-open", path])
+            return "opened"
+        except Exception as e:
+            self.emit("error", title="Open File", message=f"Could not open LightBurn file.\n{e}")
+            return False
+
+    def _open_lightburn_project(self, path, token=None, done=None):
+        """Loads the project over UDP when enabled, else opens the file and positions the window once
+        LightBurn is ready. done(), if given, is called once the UDP load has been answered or the
+        file has been handed to LightBurn."""
+        if self.lb_udp: self._load_via_udp(path, token, done)
+        else: self._open_lightburn_window(path, token, done)
+
+    def _open_lightburn_window(self, path, token=None, done=None):
+        opened = self._open_lightburn_file(path)
+        if opened == "launched":
+            self._when_lightburn_ready(0, token)
+        elif opened == "opened":
+            self.call_later(self.CC.lb_post_open_delay_ms, self._position_lb_small_bottom_right, token=token)
+        if done: done()
+
+    def _load_via_udp(self, path, token, done):
+        norm = os.path.normcase(os.path.abspath(path))
+        if self._lb_udp_project == norm:
+            self.counters["lb_reuses"] += 1
+            print(f"[LB] {os.path.basename(path)} is already loaded in LightBurn. Not reloading.")
+            if done: done()
+            return
+        def on_reply(reply, rtt_ms):
+            if reply_ok(reply):
+                self._lb_udp_project = norm
+                print(f"[LB] UDP LOADFILE {os.path.basename(path)} confirmed in {rtt_ms} ms.")
+                self._set(lightburn=dict(self.lightburn.info(), project=os.path.basename(path), udp_load_ms=rtt_ms))
+                if done: done()
+                return
+            self._lb_udp_project = None
+            print(f"[LB] UDP LOADFILE got {reply!r} after {rtt_ms} ms; opening the file instead.")
+            if token is None or not token.cancelled:
+                self._open_lightburn_window(path, token, done)
+        self.lb_udp.send(f"LOADFILE:{path}", lambda reply, rtt_ms: self.call_soon(on_reply, reply, rtt_ms))
+
+    def _lightburn_has_window(self, proc):
+        """Ready probe, run on the window worker: the process is up and, where windows can be seen, has one."""
+        if proc.poll() is not None: return False
+        return not self.windows.backend.available or self.windows.find_for_pid(proc.pid) is not None
+
+    def _when_lightburn_ready(self, waited_ms, token=None):
+        """Polls the launched LightBurn until it is ready, or post_open_delay_sec has passed."""
+        lb = self.lightburn
+        if not lb.running(): return self._lightburn_probed(False, waited_ms, token)
+        self.window_worker.call(lb.probe, lb.proc,
+                                on_done=lambda ready: self.call_soon(self._lightburn_probed, ready, waited_ms, token))
+
+    def _lightburn_probed(self, ready, waited_ms, token):
+        if token is not None and token.cancelled: return
+        lb = self.lightburn
+        if ready and lb.running():
+            print(f"[LB] LightBurn ready {lb.mark_ready()} ms after launch.")
+            self._set(lightburn=lb.info())
+        elif waited_ms < self.CC.lb_post_open_delay_ms and lb.running():
+            self.call_later(LB_READY_POLL_MS, self._when_lightburn_ready, waited_ms + LB_READY_POLL_MS, token, token=token)
+            return
+        else:
+            print(f"[LB] LightBurn not ready after {waited_ms} ms; continuing.")
+        self._position_lb_small_bottom_right()
+
+    def _open_and_position_lb_for_current_job(self):
+        lb_path = self._current_job_lb_path()
+        if not lb_path or not os.path.exists(lb_path):
+            self.set_status("LightBurn project missing for current job. Open Settings → Jobs to fix path.")
+            return
+        self._open_lightburn_project(lb_path)
+
+    def _lightburn_pid(self):
+        return self.lightburn.proc.pid if self.lightburn.running() else None
+
+    def _position_lb_small_bottom_right(self):
+        """Finds the LightBurn window (caching it for later lookups) and, with enable_positioning, moves it."""
+        if not self.windows.backend.available: return
+        pid, size = self._lightburn_pid(), self.CC.lb_position
+        def position_lightburn():
+            hwnd = self.windows.find(pid, "lightburn")
+            if hwnd and size: self.windows.move_bottom_right(hwnd, *size)
+            return hwnd
+        self.window_worker.call(position_lightburn)
+
+    # ---------- Job cycle ----------
+    def _reenable_start_button(self):
+        self.is_engraving = False
+        self._publish_engraving()
+
+    def _check_and_start_job_automatically(self):
+        if self.is_engraving or self.focus_pending:
+            return
+
+        if self.selected_job and self.door_closed:
+            print("Auto-start conditions met. Starting laser flow.")
+            self.start_laser_flow()
+
+    def job_cycle_recipe(self, job):
+        """Start of a batch: LightBurn, air and stack light together with the air delay, then Start, engrave, log."""
+        return [
+            Step("lightburn", "task", fn=self._open_cycle_lightburn),
+            Step("air_before", "pulse", overlap=True, relay="Air", status=f"Pulsing air, then waiting {job.air_before_ms / 1000:g}s..."),
+            Step("stack_light_on", "set", overlap=True, relay="Stack Light", value=1),
+            Step("air_before_wait", "wait", overlap=True, ms=job.air_before_ms),
+            self._start_step(),
+            self._engrave_step(job),
+            Step("log", "log"),
+        ]
+
+    def _start_step(self):
+        if self.CC.lb_udp_start:
+            return Step("start", "task", fn=self._start_via_udp, status="Sending START to LightBurn...")
+        return Step("start", "pulse", relay="Start", journal="start_sent", status="Sending START pulse to laser...")
+
+    def _engrave_step(self, job):
+        """Waits for the job-done signal, with the job's delay (times timeout_factor) as the fallback.
+        With the timer alone, any done signal that does come is still noted for adaptive timing."""
+        cc = self.CC
+        delay_ms = self._engrave_delay_ms(job)
+        if cc.done_source == "timer":
+            return Step("engrave", "wait", ms=delay_ms, watch="input" if cc.busy_input is not None else "serial",
+                        input=cc.busy_input, status=f"Job is running... Will complete in {delay_ms / 1000:g} seconds.")
+        timeout_ms = int(delay_ms * cc.done_timeout_factor)
+        signal = cc.done_token if cc.done_source == "serial" else cc.input_names[cc.busy_input]
+        return Step("engrave", "wait_done", source=cc.done_source, input=cc.busy_input, ms=timeout_ms,
+                    status=f"Job is running... Waiting for {signal} (timeout {timeout_ms / 1000:g}s).")
+
+    def job_end_recipe(self, air_after_ms, finalize):
+        """End of a batch: post-job delay, then air, door and stack light together, then finalize."""
+        note = None if self.CC.open_door_on_complete else "Job complete. Manual door open required."
+        steps = [
+            Step("air_after_wait", "wait", ms=air_after_ms),
+            Step("air_after", "pulse", relay="Air", status="Finalizing: Pulsing air, unlocking door, resetting stack light."),
+        ]
+        if self.CC.open_door_on_complete:
+            steps.append(Step("door", "pulse", overlap=True, relay="Door Lock"))
+        steps += [
+            Step("stack_light_off", "set", overlap=True, relay="Stack Light", value=0, status=note),
+            Step("finalize", "call", fn=finalize),
+        ]
+        return steps
+
+    def _run_recipe(self, name, steps):
+        if self.cycle and self.cycle.has_pending_steps():
+            self.cycle.cancel(f"superseded by {name}")
+        self.cycle = RecipeRun(self, name, steps, on_done=self._on_recipe_done)
+        return self.cycle.start()
+
+    def _on_recipe_done(self, run):
+        self.cycle_records.extend(dict(r, recipe=run.name) for r in run.records)
+        self._set(cycle=list(self.cycle_records))
+        if run.name == "job_end" and not run.token.cancelled: self._record_cycle_timing()
+
+    # ---------- Adaptive timing ----------
+    def _load_phase_history(self):
+        return PhaseHistory(os.path.join(self.DIRS["logs"], "PhaseHistory.json"), self.CC.adaptive_window)
+
+    def _record_cycle_timing(self):
+        sample, self._cycle_sample = self._cycle_sample, None
+        if not sample or "wait_ms" not in sample: return
+        total_ms = round((time.monotonic() - sample["t0"]) * 1000)
+        self.phase_history.add(sample["job"], "overhead", total_ms - sample["wait_ms"])
+        if sample["engrave_ms"] is not None: self.phase_history.add(sample["job"], "engrave", sample["engrave_ms"])
+        self.phase_history.save()
+        self._publish_adaptive()
+
+    def _adaptive_for(self, job):
+        cc = self.CC
+        return suggest_engrave_delay(self.phase_history.samples(job.key, "engrave"),
+                                     self.phase_history.samples(job.key, "overhead"), job.job_delay_ms,
+                                     cc.adaptive_pct, cc.adaptive_margin_pct, cc.adaptive_min_samples)
+
+    def _engrave_delay_ms(self, job):
+        """The job's engrave delay: the learned one in "apply" mode once there is enough history, else the configured one."""
+        if self.CC.adaptive_mode != "apply": return job.job_delay_ms
+        learned = self._adaptive_for(job)["suggested_ms"]
+        return learned if learned is not None else job.job_delay_ms
+
+    def _publish_adaptive(self):
+        if self.CC.adaptive_mode == "off": self._set(adaptive={}); return
+        self._set(adaptive={key: self._adaptive_for(job) for key, job in self.CC.jobs.items()})
+
+    def _open_cycle_lightburn(self, token, done):
+        lb_path = self.inflight.get("project") or self.CC.jobs[self.selected_job].lightburn_file
+        if not lb_path or not os.path.exists(lb_path): done(); return
+        self._open_lightburn_project(lb_path, token, done)
+
+    def _start_via_udp(self, token, done):
+        """START over UDP; the Start relay is pulsed instead if LightBurn does not confirm."""
+        self._snapshot("start_sent")
+        def on_reply(reply, rtt_ms):
+            if not reply_ok(reply):
+                print(f"[LB] UDP START got {reply!r} after {rtt_ms} ms; pulsing the Start relay instead.")
+                self.pulse_relay_by_name("Start")
+            else:
+                print(f"[LB] UDP START confirmed in {rtt_ms} ms.")
+            done()
+        self.lb_udp.send("START", lambda reply, rtt_ms: self.call_soon(on_reply, reply, rtt_ms))
+
+    def _log_cycle_items(self):
+        job = self.CC.jobs.get(self.inflight.get("job"))
+        rec = next((r for r in self.cycle.records if r["step"] == "engrave"), None) if self.cycle else None
+        if job and rec:
+            done_by = rec.get("done_by", "timer")
+            wait_ms = rec["end_ms"] - rec["start_ms"]
+            laser = f", laser done at {rec['signal_ms'] / 1000:.2f}s" if "signal_ms" in rec else ""
+            print(f"[JOB] {job.display_name}: engrave took {wait_ms / 1000:.2f}s "
+                  f"(configured {job.job_delay_ms / 1000:g}s, ended by {done_by}{laser}).")
+            if self._cycle_sample: self._cycle_sample.update(wait_ms=wait_ms, engrave_ms=rec.get("signal_ms"))
+            if done_by == "timeout":
+                self.counters["done_timeouts"] += 1
+                print(f"[JOB] No {self.CC.done_source} done signal before the timeout; logging the batch as the timer would.")
+
+        if self.CC.batch_done_on_done:
+            self.complete_whole_batch()
+        else:
+            self.complete_one_item()
+
+    def start_laser_flow(self):
+        if self.is_engraving: return
+        if not self.door_closed: return
+        if not self.selected_job: return
+        if self._pending_recovery: return
+        job = self.CC.jobs[self.selected_job]
+        start = self._next_serial(job) if self.allocator else None
+        if self.allocator and start is None:
+            self.emit("error", title="Serial Numbers", message="No leased serials are on hand and the serial "
+                      f"allocator cannot be reached:\n{self.allocator.error or 'waiting for a lease'}")
+            return
+        staged = self._take_staged()
+        if staged and start is not None and staged["start"] != start: staged = None
+        self.counters["stage_hits" if staged else "stage_misses"] += 1
+        if staged:
+            rows, project = staged["rows"], staged["project"]
+            if staged["work_next"] and not self.ledger: os.replace(staged["work_next"], self.WORKING_BATCH)
+            else: self.write_working_batch(rows)
+            lb_ok = self._swap_in_lightburn_batch(staged) or self.write_lightburn_batch([r["FullCode"] for r in rows])
+        else:
+            rows, codes = self.build_preview_rows(start)
+            if not rows: return
+            project = None
+            if self.CC.lb_template and job.lightburn_file:
+                project = self._write_batch_project(job, rows)
+                if not project: return
+            self.write_working_batch(rows)
+            lb_ok = self.write_lightburn_batch(codes)  # unchanged (skipped) unless a lease moved the start
+        if not lb_ok:
+            self._drop_working_batch()
+            self.emit("error", title="LightBurn Batch", message=f"Could not write {self.LB_BATCH}, so LightBurn "
+                      "would engrave the wrong codes. Check the folder and press Start again.")
+            return
+        if project:
+            self.counters["lb_projects"] += 1
+            self._prune_batch_projects(keep=project)
+        if self.allocator:
+            self.allocator.take(block_key(job.part_number, rows[0]["DateCode"]), len(rows))
+            nxt = self._next_serial(job)
+        else:
+            nxt = int(rows[-1]["Serial5"]) + 1
+        if nxt is not None: self._request_stage(job, nxt, lb=True)
+
+        self.inflight = {"job": self.selected_job, "date_code": rows[0]["DateCode"], "rows": rows, "logged": 0,
+                         "project": project}
+        self._snapshot("air_before")
+        self.append_planned(rows)
+        self.is_engraving = True
+        self._publish_engraving()
+        self.banner_engraving()
+
+        self.cycle_records = []
+        self._cycle_sample = {"job": self.selected_job, "t0": time.monotonic()}
+        self._run_recipe("job_cycle", self.job_cycle_recipe(job))
+
+    def abort_stop_flow(self):
+        if self.cycle: self.cycle.cancel("aborted")
+        self.set_status("Aborting job. Stopping all processes.")
+        self.set_relay_by_name("Air", 0)
+        self.set_relay_by_name("Door Lock", 0)
+        self.set_relay_by_name("Stack Light", 0)
+        self.cancel_batch()
+        self._reenable_start_button()
+
+    def open_door_pulse(self):
+        if self.is_engraving:
+            self.emit("error", title="Job Running", message="Cannot open the door while a job is in progress.")
+            return
+        self.pulse_relay_by_name("Door Lock")
+        self.set_status("Door unlocked for a brief moment.")
+
+    def sim_done(self):
+        if self.CC.done_source != "timer" and self.cycle and self.cycle.signal_done("sim"): return
+        if self.CC.batch_done_on_done:
+            self.complete_whole_batch(result="SIM")
+        else:
+            self.complete_one_item(result="SIM")
+
+    def cancel_batch(self):
+        if self.inflight: self.counters["batches_aborted"] += 1
+        self._cycle_sample = None
+        self._clear_inflight()
+        self._drop_working_batch()
+        self.write_lightburn_batch([]); self.refresh_preview_upnext_and_lb()
+        self.set_status("Batch aborted / canceled. Queue cleared."); self.banner_warning()
+        self.refresh_next_serial_label()
+        self._reenable_start_button()
+
+    def on_serial_line(self, line):
+        line = (line or "").strip()
+        if not line: return
+        self.counters["serial_lines"] += 1
+        if not line.upper().startswith("INFO:"):
+            print(f"[RX] {line}")
+
+        if self.CC.done_token and line.upper() == self.CC.done_token:
+            if not (self.cycle and self.cycle.signal_done("serial")):
+                print(f"[JOB] {line} received with no batch waiting for it.")
+            return
+
+        if line.upper().startswith("RELAY:"):
+            try:
+                _, rest = line.split(":",1)
+                idx, v = rest.split(":")
+                i = int(idx.strip()); val = int(v.strip())
+                if 0 <= i < len(self.CC.relay_names):
+                    self.relay_state[i] = 1 if val else 0
+                    self._publish_io()
+            except Exception: pass
+            return
+
+        if line.upper().startswith("INPUT:"):
+            try:
+                _, rest = line.split(":", 1)
+                idx_str, val_str = rest.split(":")
+                ii = int(idx_str.strip())
+                val = int(val_str.strip())
+
+                if self.input_override[ii]: return
+                self.input_state[ii] = val
+
+                if ii == self.CC.door_input:
+                    is_closed = (val == 0)
+                    if is_closed != self.door_closed:
+                        self.door_closed = is_closed
+                        self._publish_io()
+                        self._check_and_start_job_automatically()
+                else:
+                    self._publish_io()
+                if self.cycle: self.cycle.poll_inputs()
+                self._maybe_select_job_from_input_pattern()
+            except Exception:
+                print(f"[ERROR] Failed to parse INPUT line: {line}")
+            return
+
+    def _close_lightburn_window(self):
+        """Finds the LightBurn window and sends a close message, on the window worker."""
+        if not self.windows.backend.available: return
+        pid = self._lightburn_pid()
+        def close_lightburn():
+            hwnd = self.windows.find(pid, "lightburn")
+            if hwnd:
+                print("Found LightBurn window. Sending close message.")
+                self.windows.close(hwnd)
+            else:
+                print("Could not find LightBurn window to close.")
+        self.window_worker.call(close_lightburn)
+
+    def _finalize_single_completion(self):
+        self.counters["batches_completed"] += 1
+        self._clear_inflight()
+        self._drop_working_batch()
+        self.set_status("Batch complete."); self.banner_ok()
+        self._reenable_start_button()
+        self._show_next_batch()
+        self.beep_batch_complete()
+        # --- MODIFIED: Check if LightBurn should be closed ---
+        if self.CC.lb_close_on_complete:
+            self.call_later(500, self._close_lightburn_window)
+
+    def _finalize_batch_completion(self):
+        self.counters["batches_completed"] += 1
+        self._clear_inflight()
+        self._drop_working_batch()
+        self.set_status("Batch complete (all items written)."); self.banner_ok()
+        self._reenable_start_button()
+        self._show_next_batch()
+        self.beep_batch_complete()
+        # --- MODIFIED: Check if LightBurn should be closed ---
+        if self.CC.lb_close_on_complete:
+            self.call_later(500, self._close_lightburn_window)
+
+    def complete_one_item(self, result="OK"):
+        rows = self.read_working_batch()
+        if not rows:
+            self.set_status("Idle. (No items in queue)"); self.banner_idle(); return
+        head, rest = rows[0], rows[1:]
+        self.append_completed_many([head], result=result)
+        self.append_history_csv([head], result=result)
+        self._snapshot("engraving" if rest else "air_after", logged=self.inflight.get("logged", 0) + 1)
+        if rest:
+            self.write_working_batch(rest); self.write_lightburn_batch([r["FullCode"] for r in rest])
+            self.set_status("Next ready…"); self.banner_engraving()
+        else:
+            air_after_ms = self._air_after_ms_for(head.get("JobID"))
+            self.set_status(f"Final item complete. Waiting for post-job delay ({air_after_ms / 1000:g}s)...")
+            self._run_recipe("job_end", self.job_end_recipe(air_after_ms, self._finalize_single_completion))
+
+    def complete_whole_batch(self, result="OK"):
+        rows = self.read_working_batch()
+        if not rows:
+            self.set_status("Idle. (No items in queue)"); self.banner_idle(); return
+        self.append_completed_many(rows, result=result)
+        self.append_history_csv(rows, result=result)
+        self._snapshot("air_after", logged=self.inflight.get("logged", 0) + len(rows))
+
+        air_after_ms = self._air_after_ms_for(rows[0].get("JobID"))
+        self.set_status(f"Batch complete. Waiting for post-job delay ({air_after_ms / 1000:g}s)...")
+        self._run_recipe("job_end", self.job_end_recipe(air_after_ms, self._finalize_batch_completion))
+
+    def _air_after_ms_for(self, job_key):
+        job = self.CC.jobs.get(job_key) or self.CC.jobs.get(self.selected_job)
+        return job.air_after_ms if job else 0
+
+    def beep_batch_complete(self):
+        try:
+            if IS_WINDOWS:
+                import winsound; winsound.MessageBeep(winsound.MB_ICONASTERISK)
+            else:
+                print("\a", end="", flush=True)
+        except Exception: pass
+
+    # ---------- Relays & inputs ----------
+    def _test_relay(self, index):
+        cc = self.CC
+        name = cc.relay_names[index]
+        mode = cc.relay_modes[index]
+
+        if cc.relay_disabled[index]:
+            self.set_status(f"Warning: {name} is disabled in settings.")
+            return
+
+        if cc.simulate:
+            if mode == "pulse":
+                ms = cc.relay_pulse_ms[index]
+                self.pulse_relay_by_name(name, ms)
+                self.set_status(f"Simulating {name}: Pulse for {ms}ms.")
+            elif mode == "switch":
+                current_state = self.relay_state[index]
+                new_state = 1 - current_state
+                self.set_relay_by_name(name, new_state)
+                self.set_status(f"Simulating {name}: Toggled to {'ON' if new_state else 'OFF'}.")
+        else:
+            if mode == "pulse":
+                ms = cc.relay_pulse_ms[index]
+                ok = self.serial.pulse(index, ms)
+                self.set_status(f"Testing {name}: Sent PULSE {index} {ms}." if ok else f"Failed to send PULSE to {name}.")
+            elif mode == "switch":
+                current_state = self.relay_state[index]
+                new_state = 1 - current_state
+                ok = self.serial.relay_set(index, new_state)
+                if ok:
+                    self.relay_state[index] = new_state
+                    self._publish_io()
+                self.set_status(f"Testing {name}: Sent RSET {index} {new_state}." if ok else f"Failed to send RSET to {name}.")
+
+    def sim_toggle_relay(self, i):
+        cc = self.CC
+        ms = cc.relay_pulse_ms[i]
+        name = cc.relay_names[i]
+
+        if cc.relay_disabled[i]:
+            self.set_status(f"Warning: {name} is disabled in settings.")
+            return
+
+        if cc.simulate:
+            if ms > 0:
+                self.relay_state[i] = 1; self._publish_io()
+                self.call_later(ms, self._sim_relay_off_after_pulse, i)
+                self.set_status(f"Simulated pulse on {name} for {ms}ms")
+            else:
+                self.relay_state[i] = 1 - self.relay_state[i]; self._publish_io()
+                self.set_status(f"Simulated toggle on {name} to {'ON' if self.relay_state[i] else 'OFF'}")
+        else:
+            if ms > 0:
+                ok = self.serial.pulse(i, ms)
+            else:
+                ok = self.serial.relay_toggle(i)
+            self.set_status(f"Sent {'pulse' if ms>0 else 'toggle'} to {name}." if ok else f"Failed to send to {name}.")
+
+    def _sim_relay_off_after_pulse(self, i):
+        self.relay_state[i] = 0
+        self._publish_io()
+
+    def sim_set_input(self, i, value):
+        name = self.CC.input_names[i]
+        self.input_override[i] = value
+        val = 1 if value else 0
+        self.input_state[i] = val
+        if i == self.CC.door_input:
+            self.door_closed = bool(val)
+        self._publish_io()
+        if self.cycle: self.cycle.poll_inputs()
+
+        self._maybe_select_job_from_input_pattern()
+
+        if self.CC.simulate:
+            self.set_status(f"Simulated {name} to {'ON' if value else 'OFF'}")
+        else:
+            ok = self.serial.sim_input(i, val)
+            self.set_status(f"Sent sim input to {name}." if ok else f"Failed to send sim input to {name}.")
+
+    # ---------- Job select & date ----------
+    def _schedule_midnight(self):
+        # Capped at an hour so a clock change (DST, NTP, resume from sleep) is noticed within the hour.
+        self.call_later(min(DateContext.ms_to_midnight() + 50, 3_600_000), self._on_midnight, name="midnight")
+
+    def _on_midnight(self):
+        try:
+            if date.today() == self.dates.day: return
+            self.dates = DateContext()
+            print(f"[ENGINE] Date is now {self.dates.code}.")
+            if self.allocator: self._prepare_serials_ahead()
+            if self.inflight:  # the running batch keeps its date; its files roll over when it ends
+                self._rollover_pending = True
+            else:
+                self._roll_over_logs()
+        finally:
+            self._schedule_midnight()
+
+    def _roll_over_logs(self):
+        self._rollover_pending = False
+        self.filter_completed_today_old_dates()
+        self._start_retention()
+        self.CONFIG["LAST_DATE_CODE"] = self.dates.code
+        self.save_config()
+        if self.selected_job: self._set(job_details=dict(self.state.get("job_details") or {}, date=self.dates.code))
+        self.refresh_next_serial_label()
+
+    def _get_current_input_pattern(self):
+        try:
+            return "".join("0" if self.input_state[i] else "1" for i in self.CC.select_inputs)
+        except IndexError:
+            self.set_status("Error: Job select inputs in the I/O map are not all configured.")
+            return None
+
+    def _check_for_job_select_on_start(self):
+        self._maybe_select_job_from_input_pattern()
+        self.call_later(200, self._check_for_job_select_on_start)
+
+    def _maybe_select_job_from_input_pattern(self):
+        current_pattern = self._get_current_input_pattern()
+        current_time = int(time.time() * 1000)
+
+        if current_pattern != self.last_job_pattern:
+            self.last_stable_job_time = current_time
+            self.last_job_pattern = current_pattern
+            return
+
+        if current_time - self.last_stable_job_time < self.job_cooldown_ms:
+            return
+
+        if current_pattern is None or current_pattern == self.CC.idle_pattern:
+            if self.selected_job:
+                self.selected_job = ""
+                self.batch_size_text = ""
+                self._set(job="", job_details={}, next_serial="", batch_size="", preview={"codes": [], "total": 0})
+                self.write_lightburn_batch([])
+                self.set_status("Idle. Waiting for job sensor input.")
+            return
+
+        found_key = self.CC.job_select_table.get(current_pattern)
+
+        if found_key:
+            if self.selected_job != found_key:
+                self.select_job(found_key)
+        else:
+            if self.selected_job != "":
+                self.selected_job = ""
+                self._set(job="")
+                self.set_status(f"Warning: Input pattern '{current_pattern}' does not match any configured job. Cleared job selection.")
+
+    def set_relay_by_name(self, name, val):
+        cc = self.CC
+        i = cc.relay_index.get(name)
+        if i is None or cc.relay_disabled[i]: return
+
+        if cc.simulate:
+            self.relay_state[i] = val
+        else:
+            ok = self.serial.relay_set(i, val)
+            if ok:
+                self.relay_state[i] = val
+        self._publish_io()
+
+    def pulse_relay_by_name(self, name, ms=None):
+        """Pulses the named relay for ms, or for its configured pulse length if ms is None."""
+        cc = self.CC
+        i = cc.relay_index.get(name)
+        if i is None or cc.relay_disabled[i]: return
+        if ms is None: ms = cc.relay_pulse_ms[i]
+
+        if cc.simulate:
+            self.relay_state[i] = 1
+            self.call_later(ms, self._sim_relay_off_after_pulse, i)
+        else:
+            ok = self.serial.pulse(i, ms)
+            if ok:
+                self.relay_state[i] = 1
+        self._publish_io()
+
+    # ---------- Prompts & recovery ----------
+    def _prompt(self, kind, title, message):
+        """Asks the front end a yes/no question; the answer comes back as a command."""
+        self.pending_prompt = {"kind": kind, "title": title, "message": message}
+        self.emit("prompt", **self.pending_prompt)
+
+    def _answered(self, kind):
+        if self.pending_prompt and self.pending_prompt["kind"] == kind:
+            self.pending_prompt = None
+            return True
+        return False
+
+    def _offer_inflight_recovery(self):
+        snap, unlogged = self._pending_recovery["snapshot"], self._pending_recovery["unlogged"]
+        job_name = unlogged[0].get("JobName", snap.get("job", "?"))
+        on = [n for n, v in zip(self.CC.relay_names, snap.get("relays", [])) if v]
+        print(f"[INFLIGHT] Interrupted batch: job={job_name} phase={snap.get('phase')} unlogged={len(unlogged)} relays_on={on}")
+        if snap.get("phase") in ("start_sent", "engraving", "air_after"):
+            first, last = unlogged[0]["FullCode"], unlogged[-1]["FullCode"]
+            # Leased serials are never handed out twice, so a re-run gets new ones.
+            no = ("No: discard them; the next batch takes new serials and these are left unused." if self.allocator
+                  else "No: discard them; the same serials will be used for the next batch.")
+            self._prompt("recovery", "Interrupted Batch",
+                f"The station stopped during a {job_name} batch after the laser was started.\n\n"
+                f"{len(unlogged)} item(s) were never logged:\n{first}\n... {last}\n\n"
+                "Were these parts engraved?\n\n"
+                "Yes: log them as RECOVERED so their serials are not issued again.\n" + no)
+            return
+        self._pending_recovery = None
+        self.set_status(f"Interrupted {job_name} batch was never started by the laser. Discarded.")
+        self._finish_inflight_recovery()
+
+    def cmd_resolve_recovery(self, engraved):
+        if not self._answered("recovery") or not self._pending_recovery: return
+        rec, self._pending_recovery = self._pending_recovery, None
+        unlogged = rec["unlogged"]
+        if engraved:
+            self.append_completed_many(unlogged, result="RECOVERED")
+            self.append_history_csv(unlogged, result="RECOVERED")
+            self.set_status(f"Recovered {len(unlogged)} item(s) from the interrupted batch.")
+        else:
+            self.set_status("Interrupted batch discarded. Its serials are left unused; the next batch takes new ones." if self.allocator
+                            else "Interrupted batch discarded. Its serials will be reissued.")
+        self._finish_inflight_recovery()
+
+    def _finish_inflight_recovery(self):
+        self._clear_inflight()
+        self._drop_working_batch()
+        self.refresh_next_serial_label()
+        self.refresh_preview_upnext_and_lb()
+        self._check_and_start_job_automatically()
+
+    # ---------- Job selection ----------
+    def select_job(self, key):
+        old_job = self.selected_job
+
+        if key:
+            self.selected_job = key
+            self._set(job=key)
+
+        if key and key != old_job:
+            print(f"DEBUG: Job change detected. Old: '{old_job}', New: '{key}'.")
+            should_autofocus = False
+
+            if not self.is_startup_complete:
+                print("DEBUG: Autofocus triggered by first job selection.")
+                should_autofocus = True
+                self.is_startup_complete = True
+
+            elif self.last_valid_job and key != self.last_valid_job:
+                print("DEBUG: Autofocus triggered because new job differs from the last valid one.")
+                should_autofocus = True
+
+            if should_autofocus:
+                self.do_autofocus()
+
+        if key:
+            self.last_valid_job = key
+            job = self._show_job_details(key)
+
+            self.refresh_next_serial_label()
+            self.refresh_preview_upnext_and_lb()
+            self.set_status(f"Selected {job.display_name}. Serial batch loaded.")
+            self.banner_idle()
+
+            if self.CC.open_lb_on_start:
+                self.call_later(100, self._open_and_position_lb_for_current_job)
+
+        self._check_and_start_job_automatically()
+
+    def _show_job_details(self, key):
+        job = self.CC.jobs[key]
+        self.batch_size_text = str(job.default_batch)
+        self._set(job_details={
+            "part": job.part_number or "",
+            "rev": "" if job.revision is None else job.revision,
+            "ver": job.version or "",
+            "cav": "" if job.cavity is None else job.cavity,
+            "mach": "" if job.machine is None else job.machine,
+            "date": self.dates.code
+        }, batch_size=self.batch_size_text)
+        return job
+
+    def refresh_next_serial_label(self):
+        try:
+            if not self.selected_job: self._set(next_serial=""); return
+            job = self.CC.jobs[self.selected_job]
+        except Exception: job = None
+        next_n = self._next_serial(job) if job and job.part_number else 1
+        self._set(next_serial="" if next_n is None else f"{next_n:05d}")
+
+    def refresh_preview_upnext_and_lb(self):
+        rows, codes = self.build_preview_rows()
+        self._set(preview={"codes": codes[:self.CC.up_next_tail], "total": len(rows)})
+        self.write_lightburn_batch(codes)
+        if rows and not self.inflight:  # while a batch runs, the stage is the batch after it
+            self._request_stage(self.CC.jobs[self.selected_job], int(rows[0]["Serial5"]), rows, codes)
+
+    def cmd_export_completed(self, start, end, path, history=False):
+        """Streams the completed items logged on start..end (YYYY-MM-DD) to a CSV at path, on a background thread."""
+        try: first, last = (datetime.strptime(d, "%Y-%m-%d").date() for d in (start, end or start))
+        except ValueError:
+            self.emit("error", title="Export", message="Dates must be YYYY-MM-DD."); return
+        if history: rows, fields = iter_history(self.CC.history_path, first, last), HISTORY_FIELDS
+        else: rows, fields = iter_completed(self.DIRS["logs"], first, last), COMPLETED_FIELDS
+        def export_completed():
+            tmp, n = f"{path}.tmp", 0
+            try:
+                with open(tmp, "w", newline="", encoding="utf-8") as fh:
+                    w = csv.DictWriter(fh, fieldnames=fields, extrasaction="ignore")
+                    w.writeheader()
+                    for row in rows: w.writerow(row); n += 1
+                os.replace(tmp, path)
+            except (OSError, csv.Error) as e:
+                self.emit("error", title="Export", message=f"Export failed:\n{e}"); return
+            print(f"[EXPORT] {n} item(s) from {first} to {last} written to {path}.")
+            self.emit("info", title="Export", message=f"{n} item(s) written to\n{path}")
+        threading.Thread(target=export_completed, name="Export", daemon=True).start()
+
+    def cmd_set_batch_size(self, text):
+        self.batch_size_text = text
+        self.state["batch_size"] = text  # not echoed: the sender is showing it and the operator may still be typing
+        if not self.is_engraving: self.refresh_preview_upnext_and_lb()
+
+    def cmd_set_job_default_batch(self):
+        key = self.selected_job
+        if not key:
+            self.emit("error", title="No Job", message="No job selected yet."); return
+        try: n = max(1, int(self.batch_size_text or 0))
+        except Exception: n = 1
+        self.CONFIG["JOBS"][key]["default_batch"] = n
+        error = self.save_config()
+        if error:
+            self.emit("error", title="Save Config", message=error); return
+        self.set_status(f"Default batch for {self.CC.jobs[key].display_name} set to {n}.")
+
+    # ---------- Autofocus ----------
+    def do_autofocus(self):
+        if not self.CC.af_enabled:
+            self.set_status("Autofocus is disabled in settings.")
+            return
+
+        if self.is_engraving:
+            self.emit("error", title="Job Running", message="Cannot run Auto Focus while a job is in progress.")
+            return
+
+        if not self.selected_job:
+            self.emit("error", title="No Job", message="Please select a job first.")
+            return
+
+        self.focus_pending = True  # auto-start waits until the operator has answered
+        self._prompt("autofocus", "Auto Focus", "Do you want to run Auto Focus for this job?")
+
+    def _run_focus_cycle(self):
+        if not self.selected_job:
+            self._focus_done(); return
+
+        focus_x = self.CC.jobs[self.selected_job].focus_height
+
+        self.set_status("Sending Auto Focus pulse...")
+        self.pulse_relay_by_name("Auto Focus")
+        self._prompt("focus_check", "Focus Check", f"Was the Height set to {focus_x}?")
+
+    def _focus_done(self):
+        self.focus_pending = False
+        self._check_and_start_job_automatically()
+
+    def cmd_autofocus(self):
+        self.do_autofocus()
+
+    def cmd_autofocus_reply(self, run):
+        if not self._answered("autofocus"): return
+        if run:
+            self._run_focus_cycle()
+        else:
+            self.set_status("Auto Focus skipped by user.")
+            self._focus_done()
+
+    def cmd_focus_check_reply(self, confirmed):
+        if not self._answered("focus_check"): return
+        if confirmed:
+            # The job can be cleared (idle pattern, JOBS reload) while the prompt is open.
+            job = self.CC.jobs.get(self.selected_job)
+            self.set_status(f"Focus confirmed ({job.focus_height})." if job else "Focus confirmed.")
+            self._focus_done()
+        else:
+            self.set_status("Focus NOT confirmed. Retrying...")
+            self.call_later(100, self._run_focus_cycle)
+
+    # ---------- Commands ----------
+    def cmd_open_door(self): self.open_door_pulse()
+    def cmd_abort(self): self.abort_stop_flow()
+    def cmd_sim_done(self): self.sim_done()
+    def cmd_test_relay(self, index): self._test_relay(index)
+    def cmd_sim_toggle_relay(self, index): self.sim_toggle_relay(index)
+    def cmd_sim_set_input(self, index, value): self.sim_set_input(index, value)
+    def cmd_open_lightburn(self): self._open_and_position_lb_for_current_job()
@@ -0,0 +1,168 @@
+"""Read-only HTTP status endpoint for a StationEngine.
+
+  GET /status   current station state and counters as JSON
+  GET /events   Server-Sent Events: the full state, then every change
+  GET /metrics  Prometheus text exposition
+
+Runs an asyncio server on its own thread. /status and /metrics read the
+engine's snapshot on request; the engine is only subscribed to while at
+least one /events client is connected, so an idle server costs nothing
+but a listening socket.
+"""
+import asyncio, json, threading
+
+SSE_KEEPALIVE_SEC = 15
+
+def _prom_escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render_metrics(snap):
+    """Formats an engine snapshot as Prometheus text."""
+    out = []
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP station_{name} {help_text}")
+        out.append(f"# TYPE station_{name} {kind}")
+        for labels, value in samples:
+            lbl = ",".join(f'{k}="{_prom_escape(v)}"' for k, v in labels.items())
+            out.append(f"station_{name}{{{lbl}}} {value}" if lbl else f"station_{name} {value}")
+
+    state = snap.get("state", {})
+    metric("up", "gauge", "Engine is running.", [({}, 1)])
+    metric("connected", "gauge", "ESP32 serial link is open.", [({}, int(bool(state.get("connected"))))])
+    metric("door_closed", "gauge", "Door sensor reports closed.", [({}, int(bool(state.get("door_closed"))))])
+    metric("engraving", "gauge", "A batch is running.", [({}, int(bool(state.get("is_engraving"))))])
+    metric("job_selected", "gauge", "Currently selected job.", [({"job": state["job"]}, 1)] if state.get("job") else [])
+    names = snap.get("input_names", [])
+    metric("input", "gauge", "Raw input level (0 = active).",
+           [({"index": i, "name": names[i] if i < len(names) else ""}, v) for i, v in enumerate(state.get("inputs", []))])
+    names = snap.get("relay_names", [])
+    metric("relay", "gauge", "Relay output state.",
+           [({"index": i, "name": names[i] if i < len(names) else ""}, v) for i, v in enumerate(state.get("relays", []))])
+    try: next_serial = int(state.get("next_serial") or 0)
+    except ValueError: next_serial = 0
+    metric("next_serial", "gauge", "Next serial number for the selected job.", [({}, next_serial)])
+    batch = state.get("batch") or {}
+    metric("batch_items", "gauge", "Items in the running batch.", [({}, batch.get("total", 0))])
+    metric("batch_items_done", "gauge", "Items of the running batch already logged.", [({}, batch.get("done", 0))])
+    timing = snap.get("timing", {})
+    metric("timer_lateness_ms", "summary", "How late timers ran versus their scheduled time.",
+           [({"timer": t, "quantile": q}, s[k]) for t, s in sorted(timing.items())
+            for q, k in (("0.5", "p50_ms"), ("0.99", "p99_ms"))])
+    metric("timer_lateness_max_ms", "gauge", "Worst timer lateness since start.",
+           [({"timer": t}, s["max_ms"]) for t, s in sorted(timing.items())])
+    for name, value in sorted(snap.get("counters", {}).items()):
+        metric(f"{name}_total", "counter", f"Count of {name.replace('_', ' ')} since start.", [({}, value)])
+    return "\n".join(out) + "\n"
+
+
+class StatusServer:
+    """Serves engine.snapshot() over HTTP. start()/stop() may be called from any thread."""
+    def __init__(self, engine, host="127.0.0.1", port=8765):
+        self.engine = engine
+        self.host, self.port = host, port
+        self._loop = None
+        self._thread = None
+        self._stopped = None
+        self._clients = set()
+        self._events = None
+
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="StatusServer", daemon=True)
+        self._thread.start()
+        ready.wait(5.0)
+
+    def stop(self, timeout=5.0):
+        if self._loop and self._stopped:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread: self._thread.join(timeout)
+
+    def _run(self, ready):
+        try:
+            asyncio.run(self._main(ready))
+        except Exception as e:
+            print(f"[STATUS] Server stopped: {e}")
+        finally:
+            ready.set()
+            self._unsubscribe()
+
+    async def _main(self, ready):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[STATUS] Listening on http://{self.host}:{self.port}/status")
+        ready.set()
+        async with server:
+            await self._stopped.wait()
+        for q in list(self._clients): q.put_nowait(None)
+
+    # ---------- Engine events (only while /events clients are connected) ----------
+    def _subscribe(self):
+        self._events = self.engine.subscribe(replay=False)
+        threading.Thread(target=self._bridge, args=(self._events,), name="StatusEvents", daemon=True).start()
+
+    def _unsubscribe(self):
+        events, self._events = self._events, None
+        if events is None: return
+        self.engine.unsubscribe(events)
+        events.put(None)
+
+    def _bridge(self, events):
+        while True:
+            item = events.get()
+            if item is None or self._loop is None: return
+            try: self._loop.call_soon_threadsafe(self._broadcast, item)
+            except RuntimeError: return  # loop closed
+
+    def _broadcast(self, item):
+        event, payload = item
+        if event != "state": return
+        for q in self._clients: q.put_nowait(payload)
+
+    # ---------- HTTP ----------
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            method, path = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")[:2]
+            path = path.split("?", 1)[0]
+            if method != "GET":
+                await self._respond(writer, 405, "text/plain", "Method Not Allowed\n")
+            elif path == "/status":
+                await self._respond(writer, 200, "application/json", json.dumps(self.engine.snapshot()))
+            elif path == "/metrics":
+                await self._respond(writer, 200, "text/plain; version=0.0.4", render_metrics(self.engine.snapshot()))
+            elif path == "/events":
+                await self._stream(writer)
+            else:
+                await self._respond(writer, 404, "text/plain", "Not Found\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, code, ctype, body):
+        reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}[code]
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {code} {reason}\r\nContent-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+                     "Cache-Control: no-store\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def _stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\nConnection: close\r\n\r\n")
+        q = asyncio.Queue()
+        q.put_nowait(self.engine.snapshot()["state"])
+        self._clients.add(q)
+        if len(self._clients) == 1: self._subscribe()
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(q.get(), SSE_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                else:
+                    if payload is None: return
+                    writer.write(f"event: state\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+                await writer.drain()
+        finally:
+            self._clients.discard(q)
+            if not self._clients: self._unsubscribe()
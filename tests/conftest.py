@@ -0,0 +1,57 @@
+import json, os, stat, sys, threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import station_engine
+
+
+def on_engine(engine, fn, *args, timeout=5.0):
+    """Runs fn(*args) on the engine thread and returns its result."""
+    done, out = threading.Event(), {}
+    def call():
+        try: out["result"] = fn(*args)
+        finally: done.set()
+    engine.call_soon(call)
+    assert done.wait(timeout), f"{getattr(fn, '__name__', 'call')} did not run on the engine thread"
+    return out.get("result")
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    """make_engine(**sections) starts a simulated StationEngine rooted in tmp_path; each section dict updates the default one."""
+    engines = []
+    def make(**sections):
+        logs = tmp_path / "LOGS"
+        cfg = {"ROOT": str(tmp_path), "OPEN_LB_FILE_ON_START": False,
+               "FILE_PATHS": {"next_batch_path": str(logs / "NextBatch.csv"),
+                              "completed_today_path": str(logs / "Completed_Today.csv"),
+                              "entire_history_path": str(logs / "All_Jobs_History.csv")},
+               "SERIAL": {"enabled": False}, "SIMULATE": {"enabled": True},
+               "JOBS": {"Job 8": {"display_name": "Bracket", "part_number": "PN1", "default_batch": 3,
+                                  "lightburn_file": "", "select_pattern": "100"}}}
+        for name, section in sections.items():
+            if isinstance(section, dict) and isinstance(cfg.get(name), dict): cfg[name].update(section)
+            else: cfg[name] = section
+        path = tmp_path / "Config" / "gui_config.json"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(json.dumps(cfg), encoding="utf-8")
+        engine = station_engine.StationEngine(str(path))
+        engine.start()
+        engines.append(engine)
+        on_engine(engine, lambda: None)  # startup has run
+        return engine
+    yield make
+    for engine in engines:
+        engine.lightburn.close()
+        engine.stop()
+
+
+@pytest.fixture
+def fake_exe(tmp_path):
+    """A stand-in LightBurn executable: a shell script that stays running."""
+    exe = tmp_path / "LightBurn"
+    exe.write_text("#!/bin/sh\nexec sleep 60\n")
+    exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    return str(exe)
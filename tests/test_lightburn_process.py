@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from conftest import on_engine
+from station_engine import LightBurnProcess
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the stand-in LightBurn is a shell script")
+
+
+@pytest.fixture
+def projects(tmp_path):
+    paths = []
+    for name in ("Bracket.lbrn2", "Cover.lbrn2"):
+        (tmp_path / name).write_text("<LightBurnProject/>")
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def test_same_project_reuses_the_running_instance(make_engine, fake_exe, projects):
+    engine = make_engine(LIGHTBURN={"exe_path": fake_exe})
+    assert on_engine(engine, engine._open_lightburn_file, projects[0]) == "launched"
+    pid = engine.lightburn.proc.pid
+    assert on_engine(engine, engine._open_lightburn_file, projects[0]) == "reused"
+    assert engine.lightburn.proc.pid == pid
+    assert (engine.counters["lb_launches"], engine.counters["lb_reuses"]) == (1, 1)
+
+
+def test_relaunches_once_the_instance_has_exited(make_engine, fake_exe, projects):
+    engine = make_engine(LIGHTBURN={"exe_path": fake_exe})
+    on_engine(engine, engine._open_lightburn_file, projects[0])
+    engine.lightburn.proc.kill(); engine.lightburn.proc.wait()
+    assert on_engine(engine, engine._open_lightburn_file, projects[0]) == "launched"
+    assert (engine.counters["lb_launches"], engine.counters["lb_reuses"]) == (2, 0)
+
+
+def test_another_project_closes_the_tracked_instance(fake_exe, projects):
+    lb = LightBurnProcess()
+    try:
+        lb.launch(fake_exe, projects[0])
+        first = lb.proc
+        lb.launch(fake_exe, projects[1])
+        assert first.poll() is not None
+        assert lb.has_loaded(projects[1]) and not lb.has_loaded(projects[0])
+    finally:
+        lb.close()
+    assert not lb.running()
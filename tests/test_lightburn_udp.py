@@ -0,0 +1,107 @@
+import os, socket, threading
+
+import pytest
+
+from conftest import on_engine
+from lightburn_udp import LightBurnUdp, StandIn, reply_ok
+
+
+def free_udp_ports(n=2):
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(n)]
+    for s in socks: s.bind(("127.0.0.1", 0))
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks: s.close()
+    return ports
+
+
+def exchange(client, command, timeout=5.0):
+    done, out = threading.Event(), {}
+    def on_reply(reply, rtt_ms):
+        out["reply"] = reply; done.set()
+    client.send(command, on_reply)
+    assert done.wait(timeout)
+    return out["reply"]
+
+
+@pytest.fixture
+def ports():
+    return free_udp_ports()
+
+
+@pytest.fixture
+def standin(ports):
+    started = []
+    def start(fail=()):
+        started.append(StandIn(*ports, fail=fail).start())
+        return started[-1]
+    yield start
+    for s in started: s.stop()
+
+
+@pytest.fixture
+def project(tmp_path):
+    path = tmp_path / "Bracket.lbrn2"
+    path.write_text("<LightBurnProject/>")
+    return str(path)
+
+
+def test_client_gets_the_standin_replies(ports, standin, project):
+    lb = standin()
+    client = LightBurnUdp("127.0.0.1", *ports, timeout_ms=1000)
+    try:
+        assert reply_ok(exchange(client, "PING"))
+        assert reply_ok(exchange(client, f"LOADFILE:{project}"))
+    finally:
+        client.close()
+    assert lb.received == ["PING", f"LOADFILE:{project}"]
+    assert lb.loaded == project
+
+
+def test_failed_command_is_not_ok(ports, standin):
+    standin(fail=["LOADFILE"])
+    client = LightBurnUdp("127.0.0.1", *ports, timeout_ms=1000)
+    try:
+        reply = exchange(client, "LOADFILE:C:/Jobs/Bracket.lbrn2")
+    finally:
+        client.close()
+    assert reply == "!ERROR" and not reply_ok(reply)
+
+
+def test_no_reply_without_lightburn(ports):
+    client = LightBurnUdp("127.0.0.1", *ports, timeout_ms=100)
+    try:
+        assert exchange(client, "PING") is None
+    finally:
+        client.close()
+
+
+def udp_engine(make_engine, ports, **lightburn):
+    return make_engine(LIGHTBURN=dict(lightburn, control="udp", udp_port=ports[0], udp_reply_port=ports[1],
+                                      udp_timeout_ms=500))
+
+
+def load(engine, path):
+    loaded = threading.Event()
+    on_engine(engine, engine._open_lightburn_project, path, None, loaded.set)
+    assert loaded.wait(5.0)
+
+
+def test_engine_loads_over_udp_once(make_engine, ports, standin, project):
+    lb = standin()
+    engine = udp_engine(make_engine, ports)
+    load(engine, project)
+    load(engine, project)
+    assert lb.received == [f"LOADFILE:{project}"]
+    assert (engine.counters["lb_launches"], engine.counters["lb_reuses"]) == (0, 1)
+    assert engine.state["lightburn"]["project"] == os.path.basename(project)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="the stand-in LightBurn is a shell script")
+def test_engine_opens_the_file_when_loadfile_fails(make_engine, ports, standin, project, fake_exe):
+    standin(fail=["LOADFILE"])
+    engine = udp_engine(make_engine, ports, exe_path=fake_exe)
+    load(engine, project)
+    assert engine.counters["lb_launches"] == 1
+    assert engine.lightburn.has_loaded(project)
+    # Not remembered as loaded over UDP, so the next load asks LightBurn again.
+    assert engine._lb_udp_project is None
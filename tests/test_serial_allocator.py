@@ -0,0 +1,182 @@
+import json, socket, time
+from datetime import timedelta
+
+import pytest
+
+from conftest import on_engine
+from serial_allocator import AllocatorServer, BlockAuthority, HttpAuthority, SerialAllocator, block_key
+from station_engine import DateContext
+
+
+class FlakyAuthority:
+    """A BlockAuthority whose lease() raises error (when set) as an unreachable authority would."""
+    def __init__(self, path):
+        self.inner = BlockAuthority(path)
+        self.error = None
+        self.calls = 0
+
+    def lease(self, *args):
+        self.calls += 1
+        if self.error: raise self.error
+        return self.inner.lease(*args)
+
+
+def free_tcp_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(predicate, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def prepared(alloc, part, date_code, n, **kw):
+    """prepare() and wait for its background lease to finish."""
+    alloc.prepare(part, date_code, n, **kw)
+    wait_for(lambda: block_key(part, date_code) not in alloc._leasing)
+
+
+# ---------- BlockAuthority ----------
+def test_authority_never_hands_out_a_serial_twice(tmp_path):
+    auth = BlockAuthority(str(tmp_path / "SerialAuthority.json"))
+    assert auth.lease("PN1", "261019", 200) == (1, 200)
+    assert auth.lease("PN1", "261019", 200, station="B") == (201, 400)
+    assert auth.lease("PN2", "261019", 5) == (1, 5)
+    assert auth.lease("PN1", "261020", 5) == (1, 5)
+
+
+def test_authority_starts_at_the_floor_and_survives_a_restart(tmp_path):
+    path = str(tmp_path / "SerialAuthority.json")
+    assert BlockAuthority(path).lease("PN1", "261019", 10, floor=57) == (57, 66)
+    assert BlockAuthority(path).lease("PN1", "261019", 10, floor=1) == (67, 76)
+
+
+def test_authority_keeps_a_week_of_date_codes(tmp_path):
+    auth = BlockAuthority(str(tmp_path / "SerialAuthority.json"), keep_days=2)
+    for code in ("261017", "261018", "261019"): auth.lease("PN1", code, 1)
+    assert sorted(auth.blocks()) == ["PN1|261018", "PN1|261019"]
+
+
+# ---------- SerialAllocator ----------
+def test_take_is_consecutive_and_keeps_a_block_in_reserve(tmp_path):
+    alloc = SerialAllocator(BlockAuthority(str(tmp_path / "auth.json")), str(tmp_path / "SerialBlocks.json"), block_size=10)
+    key = block_key("PN1", "261019")
+    assert alloc.peek(key, 3) is None and alloc.take(key, 3) is None
+    prepared(alloc, "PN1", "261019", 3)
+    assert alloc.remaining(key) == 10 and alloc.leases == 1
+    assert [alloc.take(key, 3) for _ in range(3)] == [1, 4, 7]
+    prepared(alloc, "PN1", "261019", 3)  # 1 left: leases the next block, which joins the first
+    assert alloc.peek(key, 3) == 10
+    assert alloc.take(key, 3) == 10
+    assert alloc.remaining(key) == 8
+
+
+def test_blocks_survive_a_restart_and_old_days_are_dropped(tmp_path):
+    auth, path = BlockAuthority(str(tmp_path / "auth.json")), str(tmp_path / "SerialBlocks.json")
+    alloc = SerialAllocator(auth, path, block_size=10)
+    prepared(alloc, "PN1", "261019", 3, ahead=True)
+    prepared(alloc, "PN1", "261020", 3, ahead=True)
+    alloc.take(block_key("PN1", "261019"), 3)
+    again = SerialAllocator(auth, path, block_size=10)
+    assert again.peek(block_key("PN1", "261019"), 3) == 4
+    again.take(block_key("PN1", "261020"), 3)
+    with open(path, encoding="utf-8") as f: assert list(json.load(f)) == ["PN1|261020"]
+
+
+def test_first_lease_starts_at_the_stations_own_next_serial(tmp_path):
+    alloc = SerialAllocator(BlockAuthority(str(tmp_path / "auth.json")), str(tmp_path / "SerialBlocks.json"), block_size=10)
+    prepared(alloc, "PN1", "261019", 3, floor=lambda: 42)
+    assert alloc.peek(block_key("PN1", "261019"), 3) == 42
+
+
+def test_ahead_leases_only_one_batch(tmp_path):
+    auth = FlakyAuthority(str(tmp_path / "auth.json"))
+    alloc = SerialAllocator(auth, str(tmp_path / "SerialBlocks.json"), block_size=10)
+    prepared(alloc, "PN1", "261020", 3, ahead=True)
+    prepared(alloc, "PN1", "261020", 3, ahead=True)
+    assert auth.calls == 1
+    prepared(alloc, "PN1", "261020", 3)  # a batch in use wants a block in reserve as well
+    assert auth.calls == 2
+
+
+def test_batches_run_from_the_reserve_while_the_authority_is_down(tmp_path):
+    auth = FlakyAuthority(str(tmp_path / "auth.json"))
+    alloc = SerialAllocator(auth, str(tmp_path / "SerialBlocks.json"), block_size=10)
+    key = block_key("PN1", "261019")
+    prepared(alloc, "PN1", "261019", 5)
+    auth.error = OSError("connection refused")
+    starts = []
+    for _ in range(2):
+        prepared(alloc, "PN1", "261019", 5)
+        starts.append(alloc.take(key, 5))
+    assert starts == [1, 6]
+    assert alloc.error == "connection refused"
+    assert alloc.take(key, 5) is None
+    auth.error, alloc.RETRY_S = None, 0
+    alloc._retry_at.clear()
+    prepared(alloc, "PN1", "261019", 5)
+    assert alloc.take(key, 5) == 11 and alloc.error == ""
+
+
+def test_a_failed_lease_is_retried_later(tmp_path):
+    auth = FlakyAuthority(str(tmp_path / "auth.json"))
+    auth.error = ValueError("bad reply")
+    alloc = SerialAllocator(auth, str(tmp_path / "SerialBlocks.json"), block_size=10)
+    prepared(alloc, "PN1", "261019", 3)
+    assert not alloc._leasing
+    prepared(alloc, "PN1", "261019", 3)
+    assert auth.calls == 1  # waiting out RETRY_S
+    alloc._retry_at.clear()
+    auth.error = None
+    prepared(alloc, "PN1", "261019", 3)
+    assert auth.calls == 2 and alloc.remaining(block_key("PN1", "261019")) == 10
+
+
+# ---------- Over HTTP ----------
+@pytest.fixture
+def server(tmp_path):
+    srv = AllocatorServer(BlockAuthority(str(tmp_path / "SerialAuthority.json")), "127.0.0.1", free_tcp_port())
+    srv.start()
+    yield srv
+    srv.stop()
+
+
+def test_http_lease_round_trip(server):
+    client = HttpAuthority(f"http://127.0.0.1:{server.port}")
+    assert client.lease("PN1", "261019", 10, floor=5, station="A") == (5, 14)
+    assert client.lease("PN1", "261019", 10, station="B") == (15, 24)
+    assert server.authority.blocks() == {"PN1|261019": 25}
+
+
+def test_http_bad_request_is_an_oserror(server):
+    with pytest.raises(OSError):
+        HttpAuthority(f"http://127.0.0.1:{server.port}").lease("", "261019", 10)
+
+
+def test_unreachable_authority_is_an_oserror():
+    with pytest.raises(OSError):
+        HttpAuthority(f"http://127.0.0.1:{free_tcp_port()}", timeout=0.5).lease("PN1", "261019", 10)
+
+
+# ---------- Station ----------
+def test_station_runs_tomorrows_first_batch_from_the_reserve(make_engine, server):
+    engine = make_engine(SERIAL_ALLOCATOR={"mode": "server", "url": f"http://127.0.0.1:{server.port}", "block_size": 10},
+                         JOBS={"Job 8": {"display_name": "Bracket", "part_number": "PN1", "default_batch": 3, "select_pattern": "100"},
+                               "Job 9": {"display_name": "Cover", "part_number": "PN2", "default_batch": 4, "select_pattern": "101"}})
+    today = engine.dates
+    tomorrow = DateContext(today.day + timedelta(days=1))
+    keys = [block_key(pn, d.code) for pn in ("PN1", "PN2") for d in (today, tomorrow)]
+    wait_for(lambda: all(engine.allocator.remaining(k) for k in keys))
+    server.stop()
+
+    def next_serials():
+        return [engine._next_serial(engine.CC.jobs[key]) for key in ("Job 8", "Job 9")]
+    assert on_engine(engine, next_serials) == [1, 1]
+    def midnight():
+        engine.dates = tomorrow
+        return next_serials()
+    assert on_engine(engine, midnight) == [1, 1]
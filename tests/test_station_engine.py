@@ -0,0 +1,17 @@
+from conftest import on_engine
+
+
+def test_focus_reply_after_the_job_was_cleared(make_engine):
+    engine = make_engine()
+    def ask():
+        engine.select_job("Job 8")
+        engine.focus_pending = True
+        engine._run_focus_cycle()
+        engine.selected_job = ""  # idle pattern or a JOBS reload while the prompt is open
+    on_engine(engine, ask)
+    assert engine.pending_prompt["kind"] == "focus_check"
+    engine.submit("focus_check_reply", confirmed=True)
+    on_engine(engine, lambda: None)
+    assert not engine.focus_pending
+    assert engine.pending_prompt is None
+    assert engine.state["status"] == "Focus confirmed."
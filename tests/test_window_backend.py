@@ -0,0 +1,108 @@
+import threading
+
+from conftest import on_engine
+from window_backend import FakeBackend, WindowManager, WindowWorker
+
+
+def test_pid_lookup_is_cached_and_revalidated():
+    backend = FakeBackend()
+    hwnd = backend.open_window(4321, "Bracket.lbrn2 - LightBurn")
+    wm = WindowManager(backend)
+    assert wm.find_for_pid(4321) == hwnd
+    assert wm.find_for_pid(4321) == hwnd
+    assert (wm.hits, wm.misses, backend.calls["windows"]) == (1, 1, 1)
+    backend.destroy(hwnd)
+    reopened = backend.open_window(4321, "Bracket.lbrn2 - LightBurn")
+    assert wm.find_for_pid(4321) == reopened
+    assert (wm.hits, wm.misses, backend.calls["windows"]) == (1, 2, 2)
+
+
+def test_pid_lookup_skips_untitled_and_foreign_windows():
+    backend = FakeBackend()
+    backend.open_window(4321, "")
+    backend.open_window(999, "LightBurn")
+    wm = WindowManager(backend)
+    assert wm.find_for_pid(4321) is None
+    assert wm.find_for_pid(4321) is None
+    assert wm.misses == 2
+
+
+def test_title_lookup_is_cached_until_the_title_changes():
+    backend = FakeBackend()
+    hwnd = backend.open_window(4321, "Bracket.lbrn2 - LightBurn")
+    wm = WindowManager(backend)
+    assert wm.find_titled("lightburn") == hwnd
+    assert wm.find_titled("LightBurn") == hwnd
+    assert (wm.hits, wm.misses) == (1, 1)
+    backend.wins[hwnd]["title"] = "Save changes?"
+    assert wm.find_titled("lightburn") is None
+    assert wm.misses == 2
+
+
+def test_find_falls_back_to_the_title():
+    backend = FakeBackend()
+    hwnd = backend.open_window(4321, "LightBurn")
+    wm = WindowManager(backend)
+    assert wm.find(pid=1234, keyword="lightburn") == hwnd
+    assert wm.find(pid=None, keyword="lightburn") == hwnd
+
+
+def test_close_drops_the_cached_handle():
+    backend = FakeBackend()
+    hwnd = backend.open_window(4321, "LightBurn")
+    wm = WindowManager(backend)
+    wm.find(4321, "lightburn"); wm.find_titled("lightburn")
+    wm.close(hwnd)
+    assert hwnd not in backend.wins
+    assert wm.find(4321, "lightburn") is None
+
+
+def test_move_bottom_right():
+    backend = FakeBackend(screen=(1920, 1080))
+    hwnd = backend.open_window(4321, "LightBurn")
+    WindowManager(backend).move_bottom_right(hwnd, 520, 380, margin=8)
+    assert backend.wins[hwnd]["rect"] == (1392, 692, 520, 380)
+
+
+def test_worker_runs_calls_off_the_callers_thread():
+    worker = WindowWorker()
+    done, out = threading.Event(), {}
+    def lookup(): return threading.current_thread().name
+    def on_done(result):
+        out["thread"] = result; done.set()
+    try:
+        worker.call(lookup, on_done=on_done)
+        assert done.wait(5.0)
+    finally:
+        worker.stop()
+    assert out["thread"] == "WindowWorker"
+    assert worker.stats()["lookup"]["count"] == 1
+
+
+def position(engine):
+    """Runs _position_lb_small_bottom_right and waits for the window worker to finish it."""
+    done = threading.Event()
+    on_engine(engine, engine._position_lb_small_bottom_right)
+    engine.window_worker.call(lambda: None, on_done=lambda _: done.set())
+    assert done.wait(5.0)
+
+
+def test_engine_moves_lightburn_when_positioning_is_enabled(make_engine):
+    engine = make_engine(LIGHTBURN={"enable_positioning": True, "window_width": 520, "window_height": 380, "window_margin": 8})
+    backend = FakeBackend(screen=(1920, 1080))
+    hwnd = backend.open_window(4321, "Bracket.lbrn2 - LightBurn")
+    engine.windows = WindowManager(backend)
+    position(engine)
+    position(engine)
+    assert backend.wins[hwnd]["rect"] == (1392, 692, 520, 380)
+    assert (engine.windows.hits, engine.windows.misses) == (1, 1)
+
+
+def test_engine_leaves_lightburn_alone_by_default(make_engine):
+    engine = make_engine()
+    backend = FakeBackend()
+    hwnd = backend.open_window(4321, "LightBurn")
+    engine.windows = WindowManager(backend)
+    position(engine)
+    assert backend.wins[hwnd]["rect"] is None
+    assert backend.calls["move"] == 0
@@ -0,0 +1,228 @@
+"""Window automation for the station, behind a small backend interface.
+
+  Win32Backend  ctypes calls into user32 (Windows only)
+  FakeBackend   in-memory windows with configurable per-call latency, for tests on any OS
+  NullBackend   no window system; every lookup finds nothing
+
+WindowManager remembers the HWND found for each process and title keyword
+and revalidates it with two cheap calls (IsWindow, owner PID / title)
+before falling back to enumerating every top-level window. WindowWorker
+runs all automation on one background thread so no caller ever waits on
+enumeration, focus juggling or the sleeps some calls need.
+"""
+import collections, platform, queue, threading, time
+
+IS_WINDOWS = platform.system() == "Windows"
+
+class NullBackend:
+    """Backend interface. hwnd values are opaque non-zero ints."""
+    available = False
+    def windows(self): return []  # [(hwnd, pid, title)] of visible top-level windows
+    def is_window(self, hwnd): return False
+    def owner_pid(self, hwnd): return 0
+    def title(self, hwnd): return ""
+    def screen_size(self): return (0, 0)
+    def move(self, hwnd, x, y, width, height): pass
+    def close(self, hwnd): pass
+
+class Win32Backend(NullBackend):
+    available = True
+    WM_CLOSE = 0x0010
+    SW_RESTORE = 9
+    SM_CXSCREEN, SM_CYSCREEN = 0, 1
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+        self._ctypes, self._wintypes = ctypes, wintypes
+        self.user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._enum_proc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
+
+    def windows(self):
+        u, wins = self.user32, []
+        def callback(hwnd, lParam):
+            if not u.IsWindowVisible(hwnd): return True
+            wins.append((hwnd, self.owner_pid(hwnd), self.title(hwnd)))
+            return True
+        u.EnumWindows(self._enum_proc(callback), 0)
+        return wins
+
+    def is_window(self, hwnd):
+        return bool(hwnd) and bool(self.user32.IsWindow(hwnd))
+
+    def owner_pid(self, hwnd):
+        pid = self._wintypes.DWORD()
+        self.user32.GetWindowThreadProcessId(hwnd, self._ctypes.byref(pid))
+        return pid.value
+
+    def title(self, hwnd):
+        length = self.user32.GetWindowTextLengthW(hwnd)
+        buf = self._ctypes.create_unicode_buffer(length + 1)
+        self.user32.GetWindowTextW(hwnd, buf, length + 1)
+        return buf.value
+
+    def screen_size(self):
+        return (self.user32.GetSystemMetrics(self.SM_CXSCREEN), self.user32.GetSystemMetrics(self.SM_CYSCREEN))
+
+    def move(self, hwnd, x, y, width, height):
+        try:
+            self.user32.ShowWindow(hwnd, self.SW_RESTORE)
+            self.user32.MoveWindow(hwnd, x, y, width, height, True)
+        except Exception:
+            pass
+
+    def close(self, hwnd):
+        self.user32.PostMessageW(hwnd, self.WM_CLOSE, 0, 0)
+
+class FakeBackend(NullBackend):
+    """In-memory windows. Every call sleeps latency_ms (windows() sleeps enum_ms) and is counted in calls."""
+    available = True
+    def __init__(self, latency_ms=0, enum_ms=0, screen=(1920, 1080)):
+        self.latency_s, self.enum_s = latency_ms / 1000.0, enum_ms / 1000.0
+        self.screen = screen
+        self.calls = collections.Counter()
+        self.wins = {}  # hwnd -> {"pid", "title", "rect"}
+        self._next_hwnd = 0x100
+        self._lock = threading.Lock()
+
+    def open_window(self, pid, title):
+        with self._lock:
+            self._next_hwnd += 1
+            self.wins[self._next_hwnd] = {"pid": pid, "title": title, "rect": None}
+            return self._next_hwnd
+
+    def destroy(self, hwnd):
+        with self._lock: self.wins.pop(hwnd, None)
+
+    def _call(self, name, delay=None):
+        self.calls[name] += 1
+        time.sleep(self.latency_s if delay is None else delay)
+
+    def windows(self):
+        self._call("windows", self.enum_s)
+        with self._lock: return [(h, w["pid"], w["title"]) for h, w in self.wins.items()]
+
+    def is_window(self, hwnd):
+        self._call("is_window")
+        return hwnd in self.wins
+
+    def owner_pid(self, hwnd):
+        self._call("owner_pid")
+        return self.wins.get(hwnd, {}).get("pid", 0)
+
+    def title(self, hwnd):
+        self._call("title")
+        return self.wins.get(hwnd, {}).get("title", "")
+
+    def screen_size(self):
+        return self.screen
+
+    def move(self, hwnd, x, y, width, height):
+        self._call("move")
+        if hwnd in self.wins: self.wins[hwnd]["rect"] = (x, y, width, height)
+
+    def close(self, hwnd):
+        self._call("close")
+        self.destroy(hwnd)
+
+def default_backend():
+    return Win32Backend() if IS_WINDOWS else NullBackend()
+
+
+class WindowManager:
+    """Window lookups with an HWND cache per PID and per title keyword."""
+    def __init__(self, backend):
+        self.backend = backend
+        self._by_pid = {}
+        self._by_title = {}
+        self.hits = 0
+        self.misses = 0
+
+    def find_for_pid(self, pid):
+        """Returns the titled top-level window owned by pid, or None."""
+        b = self.backend
+        hwnd = self._by_pid.get(pid)
+        if hwnd and b.is_window(hwnd) and b.owner_pid(hwnd) == pid:
+            self.hits += 1
+            return hwnd
+        self.misses += 1
+        self._by_pid.pop(pid, None)
+        for h, p, title in b.windows():
+            if p == pid and title:
+                self._by_pid[pid] = h
+                return h
+        return None
+
+    def find_titled(self, keyword):
+        """Returns a visible window whose title contains keyword (case-insensitive), or None."""
+        b, key = self.backend, keyword.lower()
+        hwnd = self._by_title.get(key)
+        if hwnd and b.is_window(hwnd) and key in b.title(hwnd).lower():
+            self.hits += 1
+            return hwnd
+        self.misses += 1
+        self._by_title.pop(key, None)
+        for h, _, title in b.windows():
+            if key in (title or "").lower():
+                self._by_title[key] = h
+                return h
+        return None
+
+    def find(self, pid=None, keyword=None):
+        """By PID first, then by title."""
+        return (pid and self.find_for_pid(pid)) or (keyword and self.find_titled(keyword)) or None
+
+    def move_bottom_right(self, hwnd, width, height, margin=10):
+        sw, sh = self.backend.screen_size()
+        self.backend.move(hwnd, max(0, sw - width - margin), max(0, sh - height - margin), width, height)
+
+    def close(self, hwnd):
+        self.backend.close(hwnd)
+        for cache in (self._by_pid, self._by_title):
+            for k in [k for k, v in cache.items() if v == hwnd]: del cache[k]
+
+
+class WindowWorker:
+    """Runs window automation on one background thread.
+
+    call(fn, *args, on_done=None) returns at once; on_done(result) is called
+    from the worker. stats() gives the count, mean and worst duration per call name.
+    """
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="WindowWorker", daemon=True)
+        self._thread.start()
+
+    def call(self, fn, *args, on_done=None):
+        self._jobs.put((fn, args, on_done))
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def stats(self):
+        with self._lock:
+            return {name: {"count": n, "mean_ms": round(total / n, 3), "max_ms": round(worst, 3)}
+                    for name, (n, total, worst) in self._stats.items()}
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: return
+            fn, args, on_done = job
+            t0 = time.monotonic()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                print(f"[WINDOW] {getattr(fn, '__name__', 'call')} failed: {e}")
+                result = None
+            ms = (time.monotonic() - t0) * 1000.0
+            name = getattr(fn, "__name__", "call")
+            with self._lock:
+                n, total, worst = self._stats.get(name, (0, 0.0, 0.0))
+                self._stats[name] = (n + 1, total + ms, max(worst, ms))
+            if on_done:
+                try: on_done(result)
+                except Exception as e: print(f"[WINDOW] Callback for {name} failed: {e}")